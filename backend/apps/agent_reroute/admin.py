@@ -1,3 +1,39 @@
+import json
+
 from django.contrib import admin
+from django.utils.html import format_html
+
+from .models import AgentDecision, DecisionPath, SchedulerJob
+from .snapshots import decode_decision
+
+
+@admin.register(AgentDecision)
+class AgentDecisionAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "shipment_id", "action", "approved", "feature_schema")
+    list_filter = ("approved", "feature_schema")
+    search_fields = ("shipment_id",)
+    exclude = ("input_snapshot", "output_decision", "features")
+    readonly_fields = ("created_at", "shipment_id", "current_route_id", "proposed_route_id",
+                       "feature_schema", "decoded")
+
+    @admin.display(description="Action")
+    def action(self, obj):
+        return (obj.output_decision or {}).get("action")
+
+    @admin.display(description="Decision")
+    def decoded(self, obj):
+        return format_html("<pre>{}</pre>", json.dumps(decode_decision(obj), indent=2, default=str))
+
+
+@admin.register(DecisionPath)
+class DecisionPathAdmin(admin.ModelAdmin):
+    list_display = ("route_id", "created_at")
+    readonly_fields = ("route_id", "coordinates", "created_at")
+
 
-# Register your models here.
+@admin.register(SchedulerJob)
+class SchedulerJobAdmin(admin.ModelAdmin):
+    list_display = ("name", "interval_seconds", "leader", "last_started_at", "last_duration_ms",
+                    "runs", "failures", "skipped_ticks", "overruns")
+    readonly_fields = ("name", "interval_seconds", "leader", "last_started_at", "last_duration_ms",
+                       "last_error", "runs", "failures", "skipped_ticks", "overruns")
@@ -0,0 +1,221 @@
+"""
+Admission control for the decision endpoints.
+
+At most ADMISSION_MAX_CONCURRENT requests per process run the decision path
+(model + routing provider) at once. Up to ADMISSION_MAX_QUEUE more wait for
+a slot, each for at most ADMISSION_QUEUE_TIMEOUT_SECONDS. Anything beyond
+that is turned away at once instead of piling up behind the model:
+
+  429 + Retry-After   the wait queue is full
+  503 + Retry-After   waited the full timeout without getting a slot
+
+Requests outside the decision path (logins, proposals, ...) are never
+limited, so they stay responsive while evaluations are shed. Queue depth,
+in-flight count and rejections are reported by admission_snapshot(); queue
+wait times go to the latency metrics as "admission.wait". Sync and async
+views share the same limiter and counters: sync views wait on a condition
+variable, async views on a future of their own event loop (woken from
+whichever thread frees a slot), so a queued async request holds no thread.
+"""
+import asyncio
+import functools
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .metrics import record_latency
+
+
+class Rejected(Exception):
+    def __init__(self, status: int, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class AdmissionLimiter:
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 16, queue_timeout: float = 5.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._async_waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    def acquire(self):
+        """Take a slot, waiting in the bounded queue if needed; raises Rejected."""
+        started = time.perf_counter()
+        with self._cond:
+            if self.in_flight >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    self.rejected_queue_full += 1
+                    raise Rejected(429, "queue_full")
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+                try:
+                    deadline = started + self.queue_timeout
+                    while self.in_flight >= self.max_concurrent:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            self.rejected_timeout += 1
+                            raise Rejected(503, "timeout")
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self._take()
+        record_latency("admission.wait", (time.perf_counter() - started) * 1000.0)
+
+    async def acquire_async(self):
+        """acquire() for coroutines: queued callers await a future instead of blocking a thread."""
+        started = time.perf_counter()
+        deadline = started + self.queue_timeout
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self.in_flight < self.max_concurrent:
+                self._take()
+                queued = False
+            elif self.waiting >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise Rejected(429, "queue_full")
+            else:
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+                queued = True
+        if queued:
+            try:
+                while True:
+                    woken = loop.create_future()
+                    with self._cond:
+                        # a wake-up may have been missed or consumed by a timeout; the counters decide
+                        if self.in_flight < self.max_concurrent:
+                            self._take()
+                            break
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            self.rejected_timeout += 1
+                            raise Rejected(503, "timeout")
+                        self._async_waiters.append((loop, woken))
+                    try:
+                        await asyncio.wait_for(woken, remaining)
+                    except asyncio.TimeoutError:
+                        pass
+                    finally:
+                        with self._cond:
+                            if (loop, woken) in self._async_waiters:
+                                self._async_waiters.remove((loop, woken))
+            except asyncio.CancelledError:
+                # the request went away; if it had been woken for a free slot, pass that on
+                with self._cond:
+                    if self.in_flight < self.max_concurrent:
+                        self._wake_one()
+                raise
+            finally:
+                with self._cond:
+                    self.waiting -= 1
+        record_latency("admission.wait", (time.perf_counter() - started) * 1000.0)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._wake_one()
+
+    def _take(self):
+        self.in_flight += 1
+        self.admitted += 1
+
+    def _wake_one(self):
+        """Wake one thread and one coroutine waiting for a slot (whoever loses waits again). Hold the lock."""
+        self._cond.notify()
+        while self._async_waiters:
+            loop, woken = self._async_waiters.popleft()
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_set_woken, woken)
+                return
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "max_queue_depth": self.max_waiting,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_timeout": self.rejected_timeout,
+            }
+
+
+_limiter: Optional[AdmissionLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_admission_limiter() -> AdmissionLimiter:
+    """The process-wide limiter, built from the ADMISSION_* settings on first use."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            cfg = settings.ROUTE_AI
+            _limiter = AdmissionLimiter(cfg.get("ADMISSION_MAX_CONCURRENT", 4), cfg.get("ADMISSION_MAX_QUEUE", 16),
+                                        cfg.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", 5.0))
+        return _limiter
+
+
+def admission_snapshot() -> Dict[str, int]:
+    return get_admission_limiter().snapshot()
+
+
+def reset_admission():
+    global _limiter
+    with _limiter_lock:
+        _limiter = None
+
+
+def admission_controlled(view):
+    """Run `view` (sync or async) under the admission limiter; shed load with 429/503 and Retry-After."""
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            limiter = get_admission_limiter()
+            try:
+                await limiter.acquire_async()
+            except Rejected as e:
+                return _rejected(e)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                limiter.release()
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        limiter = get_admission_limiter()
+        try:
+            limiter.acquire()
+        except Rejected as e:
+            return _rejected(e)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            limiter.release()
+    return wrapper
+
+
+def _set_woken(woken: asyncio.Future):
+    if not woken.done():
+        woken.set_result(None)
+
+
+def _rejected(e: Rejected) -> JsonResponse:
+    response = JsonResponse({"detail": "Decision service busy, retry later", "reason": e.reason}, status=e.status)
+    response["Retry-After"] = str(settings.ROUTE_AI.get("ADMISSION_RETRY_AFTER_SECONDS", 2))
+    return response
@@ -6,3 +6,6 @@ class AgentRerouteConfig(AppConfig):
     name = 'apps.agent_reroute'
     label = 'agent_reroute'
     verbose_name = 'Agent_Reroute'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,59 @@
+"""
+Everything one decision reads from the database, loaded once.
+
+DecisionContext wraps a Shipment fetched with its route, origin, destination
+and vehicle in a single query; route segments are prefetched for batches and
+loaded at most once otherwise. The agent hands the context to the routing
+provider and uses it to write AgentDecision rows, so no step re-fetches the
+shipment.
+"""
+from functools import cached_property
+from typing import Dict, Iterable, List
+
+from apps.shipments.models import Shipment
+
+RELATED = ("route", "origin", "destination", "vehicle")
+
+
+class DecisionContext:
+    def __init__(self, shipment: Shipment):
+        self.shipment = shipment
+
+    @classmethod
+    def load(cls, shipment_id) -> "DecisionContext":
+        return cls(Shipment.objects.select_related(*RELATED).get(id=shipment_id))
+
+    @classmethod
+    def load_many(cls, shipment_ids: Iterable) -> Dict[str, "DecisionContext"]:
+        """{str(shipment_id): context} for the shipments that exist, in two queries."""
+        qs = (Shipment.objects.select_related(*RELATED)
+              .prefetch_related("route__segments")
+              .filter(id__in=list(shipment_ids)))
+        return {str(s.id): cls(s) for s in qs}
+
+    @property
+    def shipment_id(self):
+        return self.shipment.id
+
+    @property
+    def route(self):
+        return self.shipment.route
+
+    @property
+    def origin(self):
+        return self.shipment.origin
+
+    @property
+    def destination(self):
+        return self.shipment.destination
+
+    @property
+    def vehicle(self):
+        return self.shipment.vehicle
+
+    @cached_property
+    def segments(self) -> List:
+        """Route segments in seq order (uses the prefetch cache when present)."""
+        if self.route is None:
+            return []
+        return list(self.route.segments.all())
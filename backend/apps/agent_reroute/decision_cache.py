@@ -0,0 +1,111 @@
+"""
+Per-process memo of route decisions keyed by a feature fingerprint.
+
+A fingerprint covers everything a decision depends on: the feature snapshot,
+the shipment status, the current route option, the routing provider's graph,
+the model version and the ROUTE_AI decision settings. When a shipment is
+re-evaluated with the same fingerprint the previous DecisionResult is returned
+without calling the model or writing an AgentDecision row.
+
+Entries expire after DECISION_CACHE_TTL_SECONDS and the least recently used
+shipments are evicted beyond DECISION_CACHE_SIZE; a size of 0 disables the cache.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+# Current-option fields that feed the decision (path is covered by route_id)
+OPTION_KEYS = ("route_id", "eta_minutes", "toll_cost_usd", "distance_km")
+
+# ROUTE_AI settings that change the outcome for identical inputs
+DECISION_SETTINGS = ("P_DELAY_THRESHOLD", "SCORE_WEIGHTS", "IMPROVEMENT_EPS", "MAX_ALTERNATIVES")
+
+
+def _rounded(value):
+    return round(value, 4) if isinstance(value, float) else value
+
+
+def decision_fingerprint(snap: Dict[str, Any], status: str, current: Dict[str, Any],
+                         routing_version: str, model_version: str, cfg: Dict[str, Any]) -> str:
+    features = {k: _rounded(v) for k, v in snap.items()}
+    # lead_time_hours counts down continuously; only whole-bucket changes matter
+    bucket = cfg.get("DECISION_CACHE_LEAD_TIME_BUCKET_HOURS", 1.0)
+    if "lead_time_hours" in features and bucket > 0:
+        features["lead_time_hours"] = int(snap["lead_time_hours"] // bucket)
+    payload = {
+        "features": features,
+        "status": status,
+        "current": {k: _rounded(current.get(k)) for k in OPTION_KEYS},
+        "routing": routing_version,
+        "model": model_version,
+        "settings": {k: cfg.get(k) for k in DECISION_SETTINGS},
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class DecisionCache:
+    """Bounded TTL/LRU map of shipment_id -> (fingerprint, decision)."""
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, shipment_id, fingerprint: str):
+        key = str(shipment_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                fp, value, expires = entry
+                if fp == fingerprint and expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, shipment_id, fingerprint: str, value):
+        if self.maxsize <= 0:
+            return
+        key = str(shipment_id)
+        with self._lock:
+            self._entries[key] = (fingerprint, value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, shipment_id):
+        with self._lock:
+            self._entries.pop(str(shipment_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache: Optional[DecisionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_decision_cache() -> DecisionCache:
+    global _cache
+    cfg = settings.ROUTE_AI
+    size = cfg.get("DECISION_CACHE_SIZE", 10000)
+    ttl = cfg.get("DECISION_CACHE_TTL_SECONDS", 900)
+    with _cache_lock:
+        if _cache is None or _cache.maxsize != size or _cache.ttl != ttl:
+            _cache = DecisionCache(size, ttl)
+        return _cache
@@ -0,0 +1,198 @@
+"""
+Buffered AgentDecision logging.
+
+log_decisions() hands unsaved AgentDecision rows to a per-process
+DecisionLogWriter. A background thread writes them with bulk_create as soon
+as DECISION_LOG_BATCH_SIZE rows are waiting or DECISION_LOG_FLUSH_MS after
+the first row of a batch arrived, so neither evaluate requests nor sweeps
+wait for the insert. The queue holds at most DECISION_LOG_QUEUE_SIZE rows.
+When it is full, DECISION_LOG_POLICY decides what happens: "block" waits up
+to DECISION_LOG_BLOCK_TIMEOUT_SECONDS per submitted batch and then drops the
+rest of it, "drop" drops rows immediately. Whatever is still buffered is flushed at interpreter exit
+(including multiprocessing workers). Set DECISION_LOG_ASYNC to False to write
+synchronously.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from multiprocessing import util as mp_util
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .models import AgentDecision
+from .snapshots import store_paths
+
+logger = logging.getLogger(__name__)
+
+
+class _Marker:
+    """Queued after the rows a flush() or close() must wait for."""
+
+    def __init__(self, stop=False):
+        self.stop = stop
+        self.done = threading.Event()
+
+
+class DecisionLogWriter:
+    def __init__(self, batch_size=500, flush_ms=200, max_queue=10000, policy="block", block_timeout=1.0):
+        if policy not in ("block", "drop"):
+            raise ValueError(f"Unknown decision log policy '{policy}' (use 'block' or 'drop')")
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = max(0, flush_ms) / 1000.0
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, max_queue))
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    # -- producer side --------------------------------------------------------
+    def submit(self, records: Iterable[AgentDecision]):
+        if self._closed:
+            save_decisions(list(records), batch_size=self.batch_size)
+            return
+        self._ensure_thread()
+        # "block" waits at most block_timeout for the whole batch, not per row
+        deadline = time.monotonic() + self.block_timeout if self.policy == "block" else None
+        for record in records:
+            try:
+                remaining = deadline - time.monotonic() if deadline is not None else 0
+                if remaining > 0:
+                    self._queue.put(record, timeout=remaining)
+                else:
+                    self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % 1000 == 0:
+                    logger.warning(f"Decision log queue full; {self.dropped} decision(s) dropped so far")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything submitted so far is written. False on timeout."""
+        if self._thread is None:
+            return True
+        marker = _Marker()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 10.0):
+        """Final flush; later submits are written synchronously."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        marker = _Marker(stop=True)
+        self._queue.put(marker)
+        if not marker.done.wait(timeout):
+            logger.error(f"Decision log did not flush within {timeout}s; {self.pending} decision(s) lost")
+        thread.join(timeout)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="decision-log", daemon=True)
+                self._thread.start()
+
+    # -- writer thread --------------------------------------------------------
+    def _run(self):
+        batch: List[AgentDecision] = []
+        deadline = 0.0
+        try:
+            while True:
+                timeout = max(0.0, deadline - time.monotonic()) if batch else None
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if isinstance(item, _Marker):
+                    self._write(batch)
+                    batch = []
+                    item.done.set()
+                    if item.stop:
+                        return
+                    continue
+                if item is not None:
+                    if not batch:
+                        deadline = time.monotonic() + self.flush_seconds
+                    batch.append(item)
+                if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                    self._write(batch)
+                    batch = []
+        finally:
+            connection.close()
+
+    def _write(self, batch: List[AgentDecision]):
+        if not batch:
+            return
+        close_old_connections()
+        try:
+            save_decisions(batch, batch_size=self.batch_size)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Failed to write {len(batch)} agent decision(s): {e}")
+
+
+def save_decisions(records: List[AgentDecision], batch_size: Optional[int] = None):
+    """Insert decisions, storing the alternative paths they reference first."""
+    paths = {}
+    for record in records:
+        paths.update(getattr(record, "paths", None) or {})
+    store_paths(paths)
+    AgentDecision.objects.bulk_create(records, batch_size=batch_size)
+
+
+_writer: Optional[DecisionLogWriter] = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_decision_log() -> DecisionLogWriter:
+    """The process-wide writer (a forked child gets its own)."""
+    global _writer, _writer_pid
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            cfg = settings.ROUTE_AI
+            _writer = DecisionLogWriter(
+                batch_size=cfg.get("DECISION_LOG_BATCH_SIZE", 500),
+                flush_ms=cfg.get("DECISION_LOG_FLUSH_MS", 200),
+                max_queue=cfg.get("DECISION_LOG_QUEUE_SIZE", 10000),
+                policy=cfg.get("DECISION_LOG_POLICY", "block"),
+                block_timeout=cfg.get("DECISION_LOG_BLOCK_TIMEOUT_SECONDS", 1.0),
+            )
+            _writer_pid = os.getpid()
+            atexit.register(_writer.close)
+            # multiprocessing workers exit without running atexit handlers
+            mp_util.Finalize(None, _writer.close, exitpriority=10)
+        return _writer
+
+
+def log_decisions(records: List[AgentDecision]):
+    if not records:
+        return
+    if settings.ROUTE_AI.get("DECISION_LOG_ASYNC", True):
+        get_decision_log().submit(records)
+    else:
+        save_decisions(records)
+
+
+def flush_decisions(timeout: Optional[float] = None) -> bool:
+    if _writer is None or _writer_pid != os.getpid():
+        return True
+    return _writer.flush(timeout)
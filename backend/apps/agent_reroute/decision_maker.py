@@ -1,16 +1,54 @@
-from dataclasses import dataclass
-from typing import Dict, Any, Optional
+from dataclasses import dataclass, replace
+import numpy as np
+from typing import Dict, Any, Optional, List, Tuple
 from django.conf import settings
 from apps.agent_reroute.models import AgentDecision
-from apps.agent_reroute.ml import predict_p_delay
+from apps.agent_reroute.context import DecisionContext
+from apps.agent_reroute.decision_log import log_decisions
+from apps.agent_reroute.ml import (build_feature_matrix, build_features_from_shipment, model_version,
+                                   predict_rows, predict_alternatives_many)
+from apps.agent_reroute.metrics import StageTimings
+from apps.agent_reroute.decision_cache import decision_fingerprint, get_decision_cache
+from apps.agent_reroute.executors import arun_steps, run_steps
+from apps.agent_reroute.snapshots import FEATURE_SCHEMA_VERSION, compact_option, decision_paths, encode_features
+from apps.agent_reroute.scoring import objective_row, pack_options, score, score_batch
 from apps.agent_reroute.routers.graph_router import GraphRoutingProvider
 
-W = settings.ROUTE_AI["SCORE_WEIGHTS"]
+# Shipments in these states are never re-evaluated by fleet sweeps
+INACTIVE_STATUSES = ("DELIVERED", "CANCELLED")
 
-def _score(option: Dict[str, Any], p_delay: float) -> float:
-    return -(W["eta_minutes"]*float(option["eta_minutes"])
-             + W["toll_cost_usd"]*float(option.get("toll_cost_usd", 0.0))
-             + W["p_delay"]*(p_delay*100.0))
+def active_shipments():
+    from apps.shipments.models import Shipment
+    return Shipment.objects.exclude(status__in=INACTIVE_STATUSES)
+
+def _score(option: Dict[str, Any], p_delay: float, weights: Dict[str, float]) -> float:
+    return float(score(np.array(objective_row({**option, "p_delay": p_delay})), weights))
+
+def _as_dict(option) -> Dict[str, Any]:
+    """Convert RouteOption to dict - handle all possible cases"""
+    try:
+        if hasattr(option, 'copy'):
+            # It's a dict-like object, create a copy to avoid modifying the original
+            return option.copy()
+        elif hasattr(option, '__dict__'):
+            # It's an object with attributes, convert to dict
+            return {
+                'route_id': getattr(option, 'route_id', ''),
+                'eta_minutes': getattr(option, 'eta_minutes', 0),
+                'toll_cost_usd': getattr(option, 'toll_cost_usd', 0),
+                'path': getattr(option, 'path', [])
+            }
+        else:
+            # Try to convert to dict
+            return dict(option)
+    except Exception:
+        # Fallback to a basic dict
+        return {
+            'route_id': 'unknown',
+            'eta_minutes': 480,
+            'toll_cost_usd': 25.0,
+            'path': []
+        }
 
 @dataclass
 class DecisionResult:
@@ -18,6 +56,8 @@ class DecisionResult:
     current: Dict[str, Any]
     best_alt: Optional[Dict[str, Any]]
     rationale: str
+    shipment_id: Optional[str] = None
+    cached: bool = False    # returned from the decision cache; nothing was re-scored or logged
 
 class RouteDecisionAgent:
     def __init__(self, routing_provider=None):
@@ -25,86 +65,242 @@ class RouteDecisionAgent:
         self.cfg = settings.ROUTE_AI
 
     def decide(self, shipment_id) -> DecisionResult:
-        from apps.shipments.models import Shipment
-        s = Shipment.objects.select_related("route").get(id=shipment_id)
-        current_option = self.routing.get_current_option(shipment_id)
-        
-        # Convert RouteOption to dict - handle all possible cases
+        """Decide for one shipment; per-stage wall times are left in self.timings."""
+        self.timings = StageTimings("decide")
         try:
-            if hasattr(current_option, 'copy'):
-                # It's a dict-like object, create a copy to avoid modifying the original
-                current = current_option.copy()
-            elif hasattr(current_option, '__dict__'):
-                # It's an object with attributes, convert to dict
-                current = {
-                    'route_id': getattr(current_option, 'route_id', ''),
-                    'eta_minutes': getattr(current_option, 'eta_minutes', 0),
-                    'toll_cost_usd': getattr(current_option, 'toll_cost_usd', 0),
-                    'path': getattr(current_option, 'path', [])
-                }
-            else:
-                # Try to convert to dict
-                current = dict(current_option)
-        except Exception as e:
-            # Fallback to a basic dict
-            current = {
-                'route_id': 'unknown',
-                'eta_minutes': 480,
-                'toll_cost_usd': 25.0,
-                'path': []
-            }
-            
-        p_delay, snap = predict_p_delay(s, current)
-        current["p_delay"] = p_delay
-        cur_score = _score(current, p_delay)
+            return run_steps(self._decide(shipment_id, self.timings))
+        finally:
+            self.timings.finish()
+
+    async def adecide(self, shipment_id) -> DecisionResult:
+        """decide() for async views: DB work on the DB pool, model calls on the inference pool."""
+        self.timings = StageTimings("decide")
+        try:
+            return await arun_steps(self._decide(shipment_id, self.timings))
+        finally:
+            self.timings.finish()
+
+    def _decide(self, shipment_id, t: StageTimings):
+        """Decision steps for one shipment; yields each model call as (fn, args) (see executors)."""
+        with t.stage("fetch"):
+            ctx = DecisionContext.load(shipment_id)
+            s = ctx.shipment
+        with t.stage("current_option"):
+            current = _as_dict(self.routing.current_option_for(ctx))
+        with t.stage("features"):
+            snap, X = build_features_from_shipment(s, current)
+        with t.stage("cache"):
+            cache = get_decision_cache()
+            fp = self._fingerprint(s, snap, current, self.routing.fingerprint(), model_version())
+            hit = cache.get(s.id, fp)
+        if hit is not None:
+            return replace(hit, cached=True)
+
+        records: List[AgentDecision] = []
+
+        def collect(shipment_id, current, best, cur_score, best_score, action, snap, rationale):
+            records.append(self._record(s.id, s.route_id, current, best, cur_score,
+                                        best_score, action, snap, rationale))
+
+        # The current route is scored on its own, before any alternatives exist: the gate
+        # needs its p_delay to decide whether routing alternatives is worth doing at all
+        # (most shipments stick), so it cannot share one matrix with them
+        with t.stage("predict"):
+            p_delay = (yield predict_rows, ([s], [snap], X))[0]
+        result = self._gate(shipment_id, current, p_delay, snap, collect)
+        if result is None:
+            with t.stage("alternatives"):
+                alts = self._alternatives(ctx)
+            with t.stage("predict_alternatives"):
+                alt_ps = (yield predict_alternatives_many, ([(s, snap, current, alts)],))[0]
+            with t.stage("score"):
+                result = self._choose_many([(shipment_id, current, p_delay, snap, alts, alt_ps)], collect)[0]
+        with t.stage("log"):
+            log_decisions(records)
+        cache.put(s.id, fp, result)
+        return result
+
+    def decide_many(self, shipment_ids) -> Tuple[List[DecisionResult], Dict[str, str]]:
+        """
+        Batch version of decide(): one shipment query, one feature matrix and a
+        single predict_proba call for the shipments not answered from the
+        decision cache, plus one more call for the alternatives of every
+        high-risk shipment. The two calls cannot be merged: alternatives are
+        only routed for shipments the first call puts over P_DELAY_THRESHOLD.
+        Decisions go to the buffered decision log.
+        Returns (results in input order, {shipment_id: error}); per-stage
+        wall times for the whole batch are left in self.timings.
+        """
+        self.timings = StageTimings("decide_many")
+        try:
+            return run_steps(self._decide_many(shipment_ids, self.timings))
+        finally:
+            self.timings.finish()
+
+    async def adecide_many(self, shipment_ids) -> Tuple[List[DecisionResult], Dict[str, str]]:
+        """decide_many() for async views: DB work on the DB pool, model calls on the inference pool."""
+        self.timings = StageTimings("decide_many")
+        try:
+            return await arun_steps(self._decide_many(shipment_ids, self.timings))
+        finally:
+            self.timings.finish()
+
+    def _decide_many(self, shipment_ids, t: StageTimings):
+        ids = [str(i) for i in shipment_ids]
+        with t.stage("fetch"):
+            contexts = DecisionContext.load_many(ids)
 
+        errors: Dict[str, str] = {}
+        shipments, currents = [], []
+        with t.stage("current_option"):
+            for sid in dict.fromkeys(ids):
+                ctx = contexts.get(sid)
+                if ctx is None:
+                    errors[sid] = "Shipment not found"
+                    continue
+                if ctx.shipment.route_id is None:
+                    errors[sid] = "Shipment has no route"
+                    continue
+                try:
+                    currents.append(_as_dict(self.routing.current_option_for(ctx)))
+                except Exception as e:
+                    errors[sid] = str(e)
+                    continue
+                shipments.append(ctx.shipment)
+
+        with t.stage("features"):
+            snaps, X = build_feature_matrix(shipments, currents)
+
+        # Unchanged shipments are answered from the decision cache
+        decided: Dict[str, DecisionResult] = {}
+        fingerprints: Dict[str, str] = {}
+        miss_rows = []
+        with t.stage("cache"):
+            cache = get_decision_cache()
+            routing_version, version = self.routing.fingerprint(), model_version()
+            for i, (s, snap, current) in enumerate(zip(shipments, snaps, currents)):
+                sid = str(s.id)
+                fingerprints[sid] = self._fingerprint(s, snap, current, routing_version, version)
+                hit = cache.get(sid, fingerprints[sid])
+                if hit is not None:
+                    decided[sid] = replace(hit, cached=True)
+                else:
+                    miss_rows.append(i)
+        misses = [(shipments[i], currents[i], snaps[i]) for i in miss_rows]
+
+        records: List[AgentDecision] = []
+
+        def collect(shipment_id, current, best, cur_score, best_score, action, snap, rationale):
+            s = contexts[str(shipment_id)].shipment
+            records.append(self._record(s.id, s.route_id, current, best, cur_score,
+                                        best_score, action, snap, rationale))
+
+        with t.stage("predict"):
+            predictions = []
+            if misses:
+                predictions = yield predict_rows, ([m[0] for m in misses], [m[2] for m in misses], X.iloc[miss_rows])
+        high_risk = []
+        for (s, current, snap), p_delay in zip(misses, predictions):
+            sid = str(s.id)
+            try:
+                result = self._gate(sid, current, p_delay, snap, collect)
+                if result is not None:
+                    decided[sid] = result
+                else:
+                    with t.stage("alternatives"):
+                        high_risk.append((s, snap, current, self._alternatives(contexts[sid]), p_delay))
+            except Exception as e:
+                errors[sid] = str(e)
+
+        # Every alternative of every high-risk shipment in one model call, then
+        # one scoring pass over the whole (shipments x alternatives) batch
+        with t.stage("predict_alternatives"):
+            alt_ps = yield predict_alternatives_many, ([(s, snap, current, alts) for s, snap, current, alts, _ in high_risk],)
+        items = [(str(s.id), current, p_delay, snap, alts, ps)
+                 for (s, snap, current, alts, p_delay), ps in zip(high_risk, alt_ps)]
+        with t.stage("score"):
+            try:
+                for result in self._choose_many(items, collect):
+                    decided[result.shipment_id] = result
+            except Exception as e:
+                for sid, *_ in items:
+                    errors[sid] = str(e)
+
+        with t.stage("log"):
+            log_decisions(records)
+        for s, _, _ in misses:
+            sid = str(s.id)
+            if sid in decided and sid not in errors:
+                cache.put(sid, fingerprints[sid], decided[sid])
+        results = [decided[str(s.id)] for s in shipments if str(s.id) in decided]
+        return results, errors
+
+    def _fingerprint(self, shipment, snap, current, routing_version, version) -> str:
+        return decision_fingerprint(snap, shipment.status, current, routing_version, version, self.cfg)
+
+    def _alternatives(self, ctx: DecisionContext) -> List[Dict[str, Any]]:
+        return [_as_dict(a) for a in self.routing.alternatives_for(ctx, self.cfg["MAX_ALTERNATIVES"])]
+
+    def _gate(self, shipment_id, current, p_delay, snap, log) -> Optional[DecisionResult]:
+        """Decide 'stick' for low-risk shipments; None means alternatives must be scored."""
+        current["p_delay"] = p_delay
         if p_delay < self.cfg["P_DELAY_THRESHOLD"]:
             rationale = f"p_delay={p_delay:.2f} < threshold {self.cfg['P_DELAY_THRESHOLD']:.2f}; stay."
-            self._log(shipment_id, current, None, cur_score, None, "stick", snap, rationale)
-            return DecisionResult("stick", current, None, rationale)
-
-        alts = self.routing.get_alternatives(shipment_id, self.cfg["MAX_ALTERNATIVES"])
-        if not alts:
-            rationale = "High risk but no alternatives; stay."
-            self._log(shipment_id, current, None, cur_score, None, "stick", snap, rationale)
-            return DecisionResult("stick", current, None, rationale)
-
-        best, best_score = None, None
-        for a in alts:
-            # Convert RouteOption to dict if needed
-            if hasattr(a, 'copy'):
-                # It's a dict-like object, create a copy to avoid modifying the original
-                alt_dict = a.copy()
-            else:
-                alt_dict = dict(a)
-                
-            alt_p = max(0.0, p_delay - 0.10)  # replace with true per-alt prediction later
-            alt_dict["p_delay"] = alt_p
-            s_alt = _score(alt_dict, alt_p)
-            if best is None or s_alt > best_score:
-                best, best_score = alt_dict, s_alt
-
-        improvement = (best_score - cur_score) / (abs(cur_score) + 1e-6)
-        if improvement >= self.cfg["IMPROVEMENT_EPS"]:
-            delta_eta = best["eta_minutes"] - current["eta_minutes"]
-            rationale = (f"p_delay={p_delay:.2f} ≥ threshold; alt improves score {improvement*100:.1f}%. "
-                         f"Alt ETA {best['eta_minutes']:.0f}m (Δ{delta_eta:+.0f}m).")
-            self._log(shipment_id, current, best, cur_score, best_score, "propose_switch", snap, rationale)
-            return DecisionResult("propose_switch", current, best, rationale)
-
-        rationale = f"Alternatives exist but improvement {improvement*100:.1f}% < {self.cfg['IMPROVEMENT_EPS']*100:.0f}%."
-        self._log(shipment_id, current, None, cur_score, best_score, "stick", snap, rationale)
-        return DecisionResult("stick", current, None, rationale)
-
-    def _log(self, shipment_id, current, best, cur_score, best_score, action, snap, rationale):
-        from apps.shipments.models import Shipment
-        s = Shipment.objects.only("id","route_id").get(id=shipment_id)
-        AgentDecision.objects.create(
-            shipment_id=s.id,
-            current_route_id=s.route_id,
-            proposed_route_id=None if not best else best.get("route_id"),
-            input_snapshot={"features": snap, "current": current},
+            log(shipment_id, current, None, _score(current, p_delay, self.cfg["SCORE_WEIGHTS"]), None, "stick", snap, rationale)
+            return DecisionResult("stick", current, None, rationale, str(shipment_id))
+        return None
+
+    def _choose_many(self, items, log) -> List[DecisionResult]:
+        """
+        Pick the best alternative for each high-risk shipment with one pass of
+        the vectorized scoring kernel. items: (shipment_id, current, p_delay,
+        snap, alts, alt_ps) per shipment.
+        """
+        for _, _, _, _, alts, alt_ps in items:
+            for alt_dict, alt_p in zip(alts, alt_ps):
+                alt_dict["p_delay"] = alt_p
+        scored = score_batch(pack_options([[current] for _, current, *_ in items])[:, 0],
+                             pack_options([alts for *_, alts, _ in items]),
+                             self.cfg["SCORE_WEIGHTS"])
+
+        results = []
+        for i, (shipment_id, current, p_delay, snap, alts, _) in enumerate(items):
+            sid = str(shipment_id)
+            cur_score = float(scored.current_score[i])
+            if not alts:
+                rationale = "High risk but no alternatives; stay."
+                log(shipment_id, current, None, cur_score, None, "stick", snap, rationale)
+                results.append(DecisionResult("stick", current, None, rationale, sid))
+                continue
+
+            best = alts[int(scored.best_index[i])]
+            best_score = float(scored.best_score[i])
+            improvement = float(scored.improvement[i])
+            if improvement >= self.cfg["IMPROVEMENT_EPS"]:
+                delta_eta = best["eta_minutes"] - current["eta_minutes"]
+                rationale = (f"p_delay={p_delay:.2f} ≥ threshold; alt improves score {improvement*100:.1f}%. "
+                             f"Alt ETA {best['eta_minutes']:.0f}m (Δ{delta_eta:+.0f}m), alt p_delay={best['p_delay']:.2f}.")
+                log(shipment_id, current, best, cur_score, best_score, "propose_switch", snap, rationale)
+                results.append(DecisionResult("propose_switch", current, best, rationale, sid))
+                continue
+
+            rationale = f"Alternatives exist but improvement {improvement*100:.1f}% < {self.cfg['IMPROVEMENT_EPS']*100:.0f}%."
+            # best is logged (not proposed) so replays can re-score it under other settings
+            log(shipment_id, current, best, cur_score, best_score, "stick", snap, rationale)
+            results.append(DecisionResult("stick", current, None, rationale, sid))
+        return results
+
+    def _record(self, shipment_id, route_id, current, best, cur_score, best_score, action, snap, rationale) -> AgentDecision:
+        record = AgentDecision(
+            shipment_id=shipment_id,
+            current_route_id=route_id,
+            proposed_route_id=best.get("route_id") if best and action == "propose_switch" else None,
+            feature_schema=FEATURE_SCHEMA_VERSION,
+            features=encode_features(snap),
+            input_snapshot={"current": compact_option(current)},
             output_decision={"action": action, "current_score": cur_score,
-                             "best_alt_score": best_score, "best_alt": best,
+                             "best_alt_score": best_score, "best_alt": compact_option(best),
                              "rationale": rationale},
         )
+        record.paths = decision_paths(best)   # stored by reference when the record is saved
+        return record
@@ -0,0 +1,79 @@
+"""
+Change tracking for fleet sweeps.
+
+Anything that can change a shipment's decision marks it dirty: edits to the
+tracked Shipment fields, new VehiclePosition rows for its vehicle, edits to
+its route (see signals.py) and weather updates for its locations
+(mark_dirty_for_locations), and alerts raised for it. On PostgreSQL every mark
+also sends a NOTIFY that wakes the listen_reevaluate worker (notify.py).
+Sweeps evaluate sweep_shipments(): the dirty set
+plus active shipments without a decision in the last SWEEP_STALE_SECONDS, and
+clear the marks of the shipments they evaluated. The time of the last mark
+is also kept per shipment in ShipmentChange (for the active-shipment feed).
+
+QuerySet.update() and raw SQL bypass signals; callers that use them should
+call mark_dirty() themselves.
+"""
+from datetime import timedelta
+from typing import Iterable
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AgentDecision, DirtyShipment, ShipmentChange
+from .notify import notify_dirty
+
+# Shipment fields whose changes invalidate the last decision
+TRACKED_SHIPMENT_FIELDS = ("route_id", "status", "current_location_id", "scheduled_at")
+
+
+def mark_dirty(shipment_ids: Iterable, reason: str):
+    ids = {str(i) for i in shipment_ids if i is not None}
+    if not ids:
+        return
+    now = timezone.now()
+    DirtyShipment.objects.bulk_create(
+        [DirtyShipment(shipment_id=sid, reason=reason[:100], marked_at=now) for sid in ids],
+        update_conflicts=True, unique_fields=["shipment_id"], update_fields=["reason", "marked_at"],
+    )
+    ShipmentChange.objects.bulk_create(
+        [ShipmentChange(shipment_id=sid, changed_at=now) for sid in ids],
+        update_conflicts=True, unique_fields=["shipment_id"], update_fields=["changed_at"],
+    )
+    notify_dirty(ids)
+
+
+def mark_dirty_for_vehicle(vehicle_id, reason: str = "position"):
+    from .decision_maker import active_shipments
+    mark_dirty(active_shipments().filter(vehicle_id=vehicle_id).values_list("id", flat=True), reason)
+
+
+def mark_dirty_for_route(route_id, reason: str = "route"):
+    from .decision_maker import active_shipments
+    mark_dirty(active_shipments().filter(route_id=route_id).values_list("id", flat=True), reason)
+
+
+def mark_dirty_for_locations(location_ids: Iterable, reason: str = "weather"):
+    """For weather feeds: shipments starting, ending or currently at any of these locations."""
+    from .decision_maker import active_shipments
+    location_ids = list(location_ids)
+    qs = active_shipments().filter(
+        Q(origin_id__in=location_ids) | Q(destination_id__in=location_ids) | Q(current_location_id__in=location_ids)
+    )
+    mark_dirty(qs.values_list("id", flat=True), reason)
+
+
+def sweep_shipments(now=None):
+    """Active shipments that are dirty or whose last decision is older than SWEEP_STALE_SECONDS."""
+    from .decision_maker import active_shipments
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.ROUTE_AI.get("SWEEP_STALE_SECONDS", 3600))
+    recent = AgentDecision.objects.filter(created_at__gte=cutoff).values("shipment_id")
+    dirty = DirtyShipment.objects.values("shipment_id")
+    return active_shipments().filter(Q(id__in=dirty) | ~Q(id__in=recent))
+
+
+def clear_dirty(shipment_ids: Iterable, before):
+    """Clear marks set before `before`; marks added while the sweep ran stay for the next one."""
+    DirtyShipment.objects.filter(shipment_id__in=list(shipment_ids), marked_at__lte=before).delete()
@@ -0,0 +1,109 @@
+"""
+Executors behind the async agentic views.
+
+Blocking database work (loading shipments, routing, logging decisions) runs
+in a bounded thread pool of ASYNC_DB_THREADS threads, so async views never
+hold more than that many connections per process. Model inference runs in a
+separate pool of ASYNC_INFERENCE_WORKERS threads (default: one per core);
+predict_proba spends its time in NumPy / scikit-learn code that releases the
+GIL, and threads share the one loaded model. The event loop only awaits.
+
+The decision pipeline is written as a generator that yields every model call
+as (fn, args) and is sent back the result. run_steps() drives it inline;
+arun_steps() runs the code between model calls on the DB pool and the model
+calls on the inference pool.
+"""
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+_db_executor: Optional[ThreadPoolExecutor] = None
+_inference_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    with _executor_lock:
+        if _db_executor is None:
+            _db_executor = ThreadPoolExecutor(max_workers=settings.ROUTE_AI.get("ASYNC_DB_THREADS", 8),
+                                              thread_name_prefix="agentic-db")
+        return _db_executor
+
+
+def get_inference_executor() -> ThreadPoolExecutor:
+    global _inference_executor
+    with _executor_lock:
+        if _inference_executor is None:
+            workers = settings.ROUTE_AI.get("ASYNC_INFERENCE_WORKERS") or os.cpu_count() or 1
+            _inference_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agentic-infer")
+        return _inference_executor
+
+
+def shutdown_executors():
+    global _db_executor, _inference_executor
+    with _executor_lock:
+        for executor in (_db_executor, _inference_executor):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        _db_executor = _inference_executor = None
+
+
+def _in_db_thread(fn, *args, **kwargs):
+    # Pool threads outlive requests: drop connections that are broken or past CONN_MAX_AGE
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run blocking ORM code on the DB pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(_in_db_thread, fn, *args, **kwargs))
+
+
+async def run_inference(fn, *args, **kwargs):
+    """Run a model call on the inference pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_inference_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def run_steps(steps):
+    """Drive a decision pipeline synchronously: every model call it yields runs inline."""
+    value = None
+    try:
+        while True:
+            fn, args = steps.send(value)
+            value = fn(*args)
+    except StopIteration as done:
+        return done.value
+
+
+def _advance(steps, value=None, error: Optional[BaseException] = None):
+    # StopIteration cannot cross a Future, so completion is returned as a flag
+    try:
+        return False, (steps.throw(error) if error is not None else steps.send(value))
+    except StopIteration as done:
+        return True, done.value
+
+
+async def arun_steps(steps):
+    """Drive a decision pipeline: its code on the DB pool, the model calls it yields on the inference pool."""
+    finished, step = await run_db(_advance, steps)
+    while not finished:
+        fn, args = step
+        try:
+            value = await run_inference(fn, *args)
+        except Exception as e:
+            finished, step = await run_db(_advance, steps, error=e)
+        else:
+            finished, step = await run_db(_advance, steps, value)
+    return step
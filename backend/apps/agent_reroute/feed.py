@@ -0,0 +1,82 @@
+"""
+Column-oriented feed of active shipments for the automation.
+
+build_feed() returns the decision-relevant fields of active shipments and
+their model features as parallel arrays (one list per column, row i of every
+list is the same shipment), which is far smaller than serializing shipment
+objects. Every response carries a version token: the time of the latest
+change recorded in ShipmentChange. Passing it back as since= returns only
+shipments changed after it, plus the ids of changed shipments that are no
+longer active under "removed". Changes are re-sent for FEED_OVERLAP_SECONDS
+before the token so a change committed while the previous pull was reading
+is not missed; clients upsert rows by id.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .decision_maker import active_shipments
+from .ml import SNAPSHOT_KEYS, build_feature_matrix
+from .models import ShipmentChange
+from .snapshots import FEATURE_SCHEMA_VERSION
+
+
+def version_token(changed_at: Optional[datetime]) -> str:
+    """Opaque version: microseconds since the epoch of the latest change ("0" before any)."""
+    if changed_at is None:
+        return "0"
+    return str(int(changed_at.timestamp() * 1_000_000))
+
+
+def parse_since(value: str) -> datetime:
+    """A version token or an ISO-8601 datetime; raises ValueError otherwise."""
+    value = value.strip()
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value) / 1_000_000, tz=dt_timezone.utc)
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid since value {value!r}")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+
+
+def build_feed(since: Optional[datetime] = None) -> Dict[str, Any]:
+    # The version is read first: changes committed while the rows are read are picked up next time
+    version = version_token(ShipmentChange.objects.aggregate(latest=Max("changed_at"))["latest"])
+    active = active_shipments()
+    shipments = active.select_related("origin", "destination").only(
+        "id", "ref_no", "status", "route_id", "current_location_id", "scheduled_at",
+        "origin__lat", "origin__lng", "destination__lat", "destination__lng").order_by("id")
+    removed = []
+    if since is not None:
+        overlap = timedelta(seconds=settings.ROUTE_AI.get("FEED_OVERLAP_SECONDS", 5))
+        changed = ShipmentChange.objects.filter(changed_at__gt=since - overlap)
+        shipments = shipments.filter(id__in=changed.values("shipment_id"))
+        removed = sorted(str(sid) for sid in changed.exclude(shipment_id__in=active.values("id"))
+                         .values_list("shipment_id", flat=True))
+    shipments = list(shipments)
+
+    generated_at = timezone.now()
+    snaps, _ = build_feature_matrix(shipments, [None] * len(shipments))
+    columns = {
+        "id": [str(s.id) for s in shipments],
+        "ref_no": [s.ref_no for s in shipments],
+        "status": [s.status for s in shipments],
+        "route_id": [str(s.route_id) if s.route_id else None for s in shipments],
+        "current_location_id": [str(s.current_location_id) if s.current_location_id else None for s in shipments],
+        "scheduled_at": [s.scheduled_at.isoformat() for s in shipments],
+    }
+    features = {key: [round(float(snap[key]), 3) for snap in snaps] for key in SNAPSHOT_KEYS}
+    return {
+        "version": version,
+        "since": version_token(since) if since is not None else None,
+        "generated_at": generated_at.isoformat(),   # lead_time_hours is relative to this
+        "count": len(shipments),
+        "columns": columns,
+        "feature_schema": FEATURE_SCHEMA_VERSION,
+        "features": features,
+        "removed": removed,
+    }
@@ -0,0 +1,135 @@
+"""
+Shard leases for sweeps spread over several nodes.
+
+Shipments are split into SWEEP_SHARDS shards by shard_of(shipment_id): the
+low 32 bits of the UUID modulo the shard count (computed in SQL on
+PostgreSQL). Each shard has a SweepLease row. A worker claims a free shard
+with a conditional UPDATE, so two workers can never hold the same shard,
+renews the lease between evaluation chunks, and releases it with swept_at
+set when the shard is done. A shard is claimable once per sweep round
+(SWEEP_INTERVAL_SECONDS, aligned to the epoch) and again whenever its lease
+expires without a release, so a dead worker's shards are picked up after
+SWEEP_LEASE_SECONDS. Every claim bumps the shard's generation; renew and
+release only succeed for the generation the worker claimed.
+"""
+import os
+import socket
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from .models import SweepLease
+
+SHARD_MASK = 0xFFFFFFFF
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def shard_of(shipment_id, shard_count: int) -> int:
+    value = shipment_id if isinstance(shipment_id, uuid.UUID) else uuid.UUID(str(shipment_id))
+    return (value.int & SHARD_MASK) % shard_count
+
+
+def filter_shard(queryset, shard: int, shard_count: int):
+    """Rows of a Shipment queryset that belong to `shard`."""
+    if connection.vendor == "postgresql":
+        table = queryset.model._meta.db_table
+        expr = RawSQL(f"(('x' || right(replace(\"{table}\".\"id\"::text, '-', ''), 8))::bit(32)::bigint %% %s)",
+                      [shard_count])
+        return queryset.annotate(sweep_shard=expr).filter(sweep_shard=shard)
+    ids = [pk for pk in queryset.values_list("pk", flat=True) if shard_of(pk, shard_count) == shard]
+    return queryset.filter(pk__in=ids)
+
+
+def round_start(now: datetime, interval_seconds: int) -> datetime:
+    epoch = int(now.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % max(1, int(interval_seconds)), tz=dt_timezone.utc)
+
+
+def ensure_shards(shard_count: int):
+    """Lease rows for shards 0..shard_count-1; rows of removed shards go once nobody holds them."""
+    SweepLease.objects.bulk_create([SweepLease(shard=i) for i in range(shard_count)], ignore_conflicts=True)
+    now = timezone.now()
+    SweepLease.objects.filter(shard__gte=shard_count).filter(Q(owner__isnull=True) | Q(expires_at__lt=now)).delete()
+
+
+@dataclass
+class Lease:
+    shard: int
+    owner: str
+    generation: int
+    expires_at: datetime
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class ShardLeaser:
+    def __init__(self, owner: Optional[str] = None, shard_count: Optional[int] = None,
+                 lease_seconds: Optional[int] = None, interval_seconds: Optional[int] = None):
+        cfg = settings.ROUTE_AI
+        self.owner = owner or default_owner()
+        self.shard_count = shard_count or cfg.get("SWEEP_SHARDS", 16)
+        self.lease_seconds = lease_seconds or cfg.get("SWEEP_LEASE_SECONDS", 120)
+        self.interval_seconds = interval_seconds or cfg.get("SWEEP_INTERVAL_SECONDS", 300)
+
+    def claimable(self, now: datetime) -> List[int]:
+        """Shards due this round that nobody holds (or whose lease expired)."""
+        return list(SweepLease.objects.filter(shard__lt=self.shard_count)
+                    .filter(Q(owner__isnull=True) | Q(expires_at__lt=now))
+                    .filter(Q(swept_at__isnull=True) | Q(swept_at__lt=round_start(now, self.interval_seconds)))
+                    .order_by("shard").values_list("shard", flat=True))
+
+    def claim(self, now: Optional[datetime] = None) -> Optional[Lease]:
+        """Claim one due shard; None when every shard is held or already swept this round."""
+        now = now or timezone.now()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        due = self.claimable(now)
+        # Start at a different shard per worker so simultaneous claims rarely collide
+        offset = shard_of(uuid.uuid5(uuid.NAMESPACE_DNS, self.owner), len(due)) if due else 0
+        for shard in due[offset:] + due[:offset]:
+            won = (SweepLease.objects.filter(shard=shard)
+                   .filter(Q(owner__isnull=True) | Q(expires_at__lt=now))
+                   .filter(Q(swept_at__isnull=True) | Q(swept_at__lt=round_start(now, self.interval_seconds)))
+                   .update(owner=self.owner, expires_at=expires_at, generation=F("generation") + 1))
+            if won:
+                generation = SweepLease.objects.filter(shard=shard).values_list("generation", flat=True).get()
+                return Lease(shard, self.owner, generation, expires_at)
+        return None
+
+    def renew(self, lease: Lease, now: Optional[datetime] = None):
+        """Extend the lease; raises LeaseLost if another worker took the shard over."""
+        now = now or timezone.now()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        updated = (SweepLease.objects.filter(shard=lease.shard, owner=lease.owner, generation=lease.generation)
+                   .update(expires_at=expires_at))
+        if not updated:
+            raise LeaseLost(f"Lease on shard {lease.shard} was taken over")
+        lease.expires_at = expires_at
+
+    def release(self, lease: Lease, swept: bool = True, now: Optional[datetime] = None) -> bool:
+        """Give the shard back; swept=True records this round's sweep as complete."""
+        now = now or timezone.now()
+        values = {"owner": None, "expires_at": None}
+        if swept:
+            values["swept_at"] = now
+        return bool(SweepLease.objects.filter(shard=lease.shard, owner=lease.owner, generation=lease.generation)
+                    .update(**values))
+
+    def leases(self, now: Optional[datetime] = None) -> Iterable[Lease]:
+        """Claim due shards one after another until none are left this round."""
+        while True:
+            lease = self.claim(now)
+            if lease is None:
+                return
+            yield lease
@@ -0,0 +1,106 @@
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.agent_reroute.ml import FEATURE_COLUMNS, build_features_from_trips, get_model, predict_matrix
+from apps.agent_reroute.tabular import ChunkWriter, require_pyarrow
+
+# Columns copied from the input so scored rows can be joined back to trips
+ID_COLUMNS = ["BookingID", "vehicle_no", "trip_start_date"]
+
+
+def iter_trip_chunks(path, chunk_size, sheet="Sheet1"):
+    """Yield DataFrames of at most chunk_size rows without loading the whole file"""
+    ext = Path(path).suffix.lower()
+    if ext == ".csv":
+        yield from pd.read_csv(path, chunksize=chunk_size)
+    elif ext in (".parquet", ".pq"):
+        pq = require_pyarrow()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    elif ext in (".xlsx", ".xlsm"):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            ws = wb[sheet] if sheet in wb.sheetnames else wb.active
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            buf = []
+            for row in rows:
+                buf.append(row)
+                if len(buf) >= chunk_size:
+                    yield pd.DataFrame(buf, columns=header)
+                    buf = []
+            if buf:
+                yield pd.DataFrame(buf, columns=header)
+        finally:
+            wb.close()
+    else:
+        raise CommandError(f"Unsupported input format '{ext}' (use .xlsx, .csv or .parquet)")
+
+
+class Command(BaseCommand):
+    help = "Score an offline trip file (.xlsx/.csv/.parquet) with the agent's delay model, chunk by chunk"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--input", type=str, default="data/delivery_truck_data.xlsx", help="Trip file to score")
+        parser.add_argument("--output", type=str, default=None, help="Output .csv or .parquet (default: <input>_scored.csv)")
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Rows held in memory at a time")
+        parser.add_argument("--sheet", type=str, default="Sheet1", help="Worksheet name for .xlsx input")
+        parser.add_argument("--threshold", type=float, default=None, help="Flag threshold (default: ROUTE_AI P_DELAY_THRESHOLD)")
+
+    def handle(self, *args, **opts):
+        src = opts["input"]
+        if not os.path.exists(src):
+            raise CommandError(f"Input file not found: {src}")
+        out = opts["output"] or str(Path(src).with_suffix("")) + "_scored.csv"
+        threshold = opts["threshold"] if opts["threshold"] is not None else settings.ROUTE_AI["P_DELAY_THRESHOLD"]
+
+        try:
+            model = get_model()
+        except Exception as e:
+            raise CommandError(f"Could not load delay model: {e}")
+
+        writer = ChunkWriter(out)
+        rows = flagged = labelled = hits = 0
+        started = time.perf_counter()
+        try:
+            for chunk in iter_trip_chunks(src, max(1, opts["chunk_size"]), opts["sheet"]):
+                X = build_features_from_trips(chunk)
+                try:
+                    p = predict_matrix(model, X)
+                except Exception as e:
+                    raise CommandError(f"Model failed on rows {rows}-{rows + len(chunk) - 1}: {e}")
+
+                scored = chunk[[c for c in ID_COLUMNS if c in chunk.columns]].copy()
+                for col in FEATURE_COLUMNS:
+                    scored[col] = X[col].values
+                scored["p_delay"] = p
+                scored["flagged"] = (p >= threshold).astype(int)
+                flagged += int(scored["flagged"].sum())
+
+                if "delay_hours" in chunk.columns:
+                    delay_hours = pd.to_numeric(chunk["delay_hours"], errors="coerce")
+                    scored["delayed_flag"] = (delay_hours > 0).astype(int).where(delay_hours.notna())
+                    known = scored["delayed_flag"].notna()
+                    labelled += int(known.sum())
+                    hits += int((scored.loc[known, "delayed_flag"] == scored.loc[known, "flagged"]).sum())
+
+                writer.write(scored)
+                rows += len(chunk)
+        finally:
+            writer.close()
+
+        elapsed = time.perf_counter() - started
+        rate = rows / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(f"Scored {rows} trips in {elapsed:.2f}s ({rate:.0f} rows/s); "
+                          f"{flagged} flagged at p_delay ≥ {threshold:.2f}")
+        if labelled:
+            self.stdout.write(f"Flag agrees with delay_hours > 0 on {hits}/{labelled} labelled trips ({hits / labelled:.1%})")
+        self.stdout.write(self.style.SUCCESS(f"Results written to {out}"))
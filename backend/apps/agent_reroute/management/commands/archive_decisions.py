@@ -0,0 +1,173 @@
+import os
+import time
+from datetime import timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.agent_reroute.models import AgentDecision
+from apps.agent_reroute.partitions import (add_months, drop_partition, ensure_partitions, list_partitions,
+                                           month_start)
+from apps.agent_reroute.snapshots import FEATURE_SCHEMA_VERSION, FEATURE_SCHEMAS, feature_matrix
+from apps.agent_reroute.tabular import require_pyarrow
+
+# Route option fields flattened for the current route and the best alternative
+# (the current route id is already the current_route_id column)
+OPTION_FIELDS = {
+    "current": ("eta_minutes", "toll_cost_usd", "distance_km", "p_delay"),
+    "best_alt": ("route_id", "eta_minutes", "toll_cost_usd", "distance_km", "p_delay"),
+}
+
+
+def _option_value(option, field):
+    value = (option or {}).get(field)
+    if value is None:
+        return None
+    return str(value) if field == "route_id" else float(value)
+
+
+def archive_schema():
+    import pyarrow as pa
+    fields = [
+        ("id", pa.int64()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("shipment_id", pa.string()),
+        ("current_route_id", pa.string()),
+        ("proposed_route_id", pa.string()),
+        ("approved", pa.bool_()),
+        ("action", pa.string()),
+        ("rationale", pa.string()),
+        ("current_score", pa.float64()),
+        ("best_alt_score", pa.float64()),
+    ]
+    for prefix, names in OPTION_FIELDS.items():
+        fields += [(f"{prefix}_{f}", pa.string() if f == "route_id" else pa.float64()) for f in names]
+    fields += [(f"feature_{k}", pa.float64()) for k in FEATURE_SCHEMAS[FEATURE_SCHEMA_VERSION]]
+    return pa.schema(fields)
+
+
+def flatten_decisions(rows):
+    """
+    One flat record per AgentDecision (dicts with the model's field names):
+    output_decision and the current / best alternative options become scalar
+    columns and every feature of the current schema becomes a feature_<name>
+    column (packed vectors are decoded in one go; legacy rows from their JSON).
+    """
+    keys = FEATURE_SCHEMAS[FEATURE_SCHEMA_VERSION]
+    X = feature_matrix((row["feature_schema"], row["features"], row["input_snapshot"]) for row in rows)
+    out = []
+    for row, values in zip(rows, X.tolist()):
+        snapshot = row["input_snapshot"] or {}
+        decision = row["output_decision"] or {}
+        flat = {
+            "id": row["id"],
+            "created_at": row["created_at"],
+            "shipment_id": str(row["shipment_id"]),
+            "current_route_id": str(row["current_route_id"]) if row["current_route_id"] else None,
+            "proposed_route_id": str(row["proposed_route_id"]) if row["proposed_route_id"] else None,
+            "approved": row["approved"],
+            "action": decision.get("action"),
+            "rationale": decision.get("rationale"),
+            "current_score": decision.get("current_score"),
+            "best_alt_score": decision.get("best_alt_score"),
+        }
+        for prefix, option in (("current", snapshot.get("current")), ("best_alt", decision.get("best_alt"))):
+            for field in OPTION_FIELDS[prefix]:
+                flat[f"{prefix}_{field}"] = _option_value(option, field)
+        for key, value in zip(keys, values):
+            flat[f"feature_{key}"] = None if value != value else value   # NaN: missing from a legacy row
+        out.append(flat)
+    return out
+
+
+class Command(BaseCommand):
+    help = ("Archive AgentDecision months older than the retention window to compressed Parquet, "
+            "then drop them (monthly partitions on PostgreSQL, row deletes elsewhere)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retention-months", type=int, default=None,
+                            help="Months kept in the database besides the current one (default: ROUTE_AI DECISION_RETENTION_MONTHS)")
+        parser.add_argument("--output-dir", type=str, default=None,
+                            help="Directory for agent_decisions_YYYY_MM.parquet (default: ROUTE_AI DECISION_ARCHIVE_DIR)")
+        parser.add_argument("--months-ahead", type=int, default=2, help="Partitions to pre-create after the current month")
+        parser.add_argument("--chunk-size", type=int, default=20000, help="Rows read and written per Parquet row group")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be archived")
+
+    def handle(self, *args, **opts):
+        cfg = settings.ROUTE_AI
+        retention = opts["retention_months"] if opts["retention_months"] is not None else cfg.get("DECISION_RETENTION_MONTHS", 3)
+        if retention < 0:
+            raise CommandError("--retention-months must be >= 0")
+        out_dir = Path(opts["output_dir"] or cfg.get("DECISION_ARCHIVE_DIR"))
+        now = timezone.now()
+        cutoff = add_months(month_start(now), -retention)
+
+        if not opts["dry_run"]:
+            for name in ensure_partitions(now, max(0, opts["months_ahead"])):
+                self.stdout.write(f"Created partition {name}")
+
+        partitions = {month: name for name, month in list_partitions() if month is not None}
+        months = {month for month in partitions if month < cutoff}
+        months |= {month_start(d) for d in AgentDecision.objects.filter(created_at__lt=cutoff)
+                   .datetimes("created_at", "month", tzinfo=dt_timezone.utc)}
+        if not months:
+            self.stdout.write(self.style.SUCCESS(f"Nothing older than {cutoff:%Y-%m} to archive"))
+            return
+
+        if not opts["dry_run"]:
+            require_pyarrow()
+            out_dir.mkdir(parents=True, exist_ok=True)
+        total = 0
+        started = time.perf_counter()
+        for month in sorted(months):
+            end = add_months(month, 1)
+            qs = AgentDecision.objects.filter(created_at__gte=month, created_at__lt=end)
+            if opts["dry_run"]:
+                self.stdout.write(f"{month:%Y-%m}: {qs.count()} decisions would be archived")
+                continue
+            path = self._archive_month(qs, out_dir, month, max(1, opts["chunk_size"]))
+            rows = self._parquet_rows(path)
+            if rows != qs.count():
+                raise CommandError(f"{path} has {rows} rows but {month:%Y-%m} has {qs.count()}; nothing dropped")
+            if month in partitions:
+                drop_partition(partitions[month])
+            qs.delete()   # rows of unpartitioned tables / the default partition
+            total += rows
+            self.stdout.write(f"{month:%Y-%m}: archived {rows} decisions to {path}")
+
+        if not opts["dry_run"]:
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"Archived {total} decisions from {len(months)} month(s) in {elapsed:.2f}s"))
+
+    def _archive_month(self, qs, out_dir: Path, month, chunk_size) -> Path:
+        import pyarrow as pa
+        pq = require_pyarrow()
+        path = out_dir / f"agent_decisions_{month:%Y_%m}.parquet"
+        n = 1
+        while path.exists():   # a month archived earlier (e.g. late rows from the default partition)
+            path = out_dir / f"agent_decisions_{month:%Y_%m}-{n}.parquet"
+            n += 1
+        tmp = path.with_suffix(".parquet.tmp")
+        schema = archive_schema()
+        fields = ["id", "created_at", "shipment_id", "current_route_id", "proposed_route_id",
+                  "input_snapshot", "output_decision", "approved", "feature_schema", "features"]
+        with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+            last = None
+            while True:
+                page = qs.order_by("id")
+                if last is not None:
+                    page = page.filter(id__gt=last)
+                rows = list(page.values(*fields)[:chunk_size])
+                if not rows:
+                    break
+                writer.write_table(pa.Table.from_pylist(flatten_decisions(rows), schema=schema))
+                last = rows[-1]["id"]
+        os.replace(tmp, path)
+        return path
+
+    @staticmethod
+    def _parquet_rows(path) -> int:
+        return require_pyarrow().ParquetFile(path).metadata.num_rows
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.agent_reroute.routers.contraction import CH_FORMAT_VERSION, ContractionHierarchy
+from apps.agent_reroute.routers.road_graph import build_road_graph
+
+
+class Command(BaseCommand):
+    help = "Build the contraction hierarchy used for fast route queries and save it next to the delay model"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", type=str, default=None, help="Artifact path (default: ROUTE_AI['CH_PATH'])")
+
+    def handle(self, *args, **opts):
+        out = opts["output"] or settings.ROUTE_AI.get("CH_PATH")
+        if not out:
+            raise CommandError("No output path given and ROUTE_AI['CH_PATH'] is not set")
+
+        started = time.perf_counter()
+        graph = build_road_graph()
+        if not len(graph):
+            raise CommandError("No routes with usable geometry found. Run seed_routes first.")
+        edges = sum(len(a) for a in graph.adj) // 2
+        self.stdout.write(f"Road graph: {len(graph)} nodes, {edges} edges ({time.perf_counter() - started:.2f}s)")
+
+        started = time.perf_counter()
+        ch = ContractionHierarchy.build(graph)
+        ch.save(out)
+        shortcuts = len(ch.middle)
+        self.stdout.write(self.style.SUCCESS(
+            f"Contraction hierarchy v{CH_FORMAT_VERSION} with {shortcuts} shortcuts saved to {out} "
+            f"({time.perf_counter() - started:.2f}s, graph {graph.fingerprint[:12]})"
+        ))
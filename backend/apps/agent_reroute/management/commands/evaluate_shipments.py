@@ -0,0 +1,167 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from django.core.management.base import BaseCommand
+
+
+def _init_worker():
+    # Workers are spawned (not forked) so they never share the parent's DB socket
+    import django
+    django.setup()
+
+
+def evaluate_chunk(shipment_ids, started_at=None):
+    """
+    Evaluate one chunk in the current process.
+    decide_many() queues the chunk's AgentDecision rows on the buffered decision log;
+    dirty marks set before started_at are cleared for the shipments evaluated.
+    Returns (evaluated, proposals, errors).
+    """
+    from apps.agent_reroute.decision_maker import RouteDecisionAgent
+    from apps.agent_reroute.dirty import clear_dirty
+    results, errors = RouteDecisionAgent().decide_many(shipment_ids)
+    if started_at is not None:
+        clear_dirty([r.shipment_id for r in results], started_at)
+    proposals = sum(1 for r in results if r.action == "propose_switch")
+    return len(results), proposals, len(errors)
+
+
+def iter_id_chunks(queryset, size):
+    """Keyset-paginate primary keys so no cursor stays open between chunks"""
+    last = None
+    while True:
+        qs = queryset.order_by("pk")
+        if last is not None:
+            qs = qs.filter(pk__gt=last)
+        chunk = list(qs.values_list("pk", flat=True)[:size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+
+
+def run_chunks(chunks, started_at, pool=None, workers=1, renew=None):
+    """
+    Evaluate chunks inline or on `pool`; returns (evaluated, proposals, errors).
+    renew() is called after every finished chunk (leased sweeps extend their lease with it).
+    If anything raises (e.g. LeaseLost), chunks not started yet are cancelled and running
+    ones awaited before the error propagates, so nothing is still evaluating afterwards.
+    """
+    evaluated = proposals = errors = 0
+    if pool is None:
+        for chunk in chunks:
+            n, p, e = evaluate_chunk(chunk, started_at)
+            evaluated, proposals, errors = evaluated + n, proposals + p, errors + e
+            if renew is not None:
+                renew()
+        return evaluated, proposals, errors
+
+    # Keep at most two chunks per worker in flight so memory stays bounded
+    in_flight = set()
+    try:
+        chunks = iter(chunks)
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < workers * 2:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    in_flight.add(pool.submit(evaluate_chunk, chunk, started_at))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                n, p, e = fut.result()
+                evaluated, proposals, errors = evaluated + n, proposals + p, errors + e
+            if renew is not None:
+                renew()
+    except BaseException:
+        for fut in in_flight:
+            fut.cancel()
+        wait(in_flight)
+        raise
+    return evaluated, proposals, errors
+
+
+def leased_chunks(leaser, lease, queryset, size):
+    """Chunks of one shard, renewing the lease before each is handed out (LeaseLost stops the shard)."""
+    for chunk in iter_id_chunks(queryset, size):
+        leaser.renew(lease)
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = ("Evaluate active shipments that changed since their last decision or whose decision is stale "
+            "(--all for every active shipment), optionally in parallel across processes and, with "
+            "--sharded, across nodes")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (1 = run inline)")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Shipments per decide_many() batch")
+        parser.add_argument("--all", action="store_true", help="Evaluate every active shipment, not only dirty/stale ones")
+        parser.add_argument("--sharded", action="store_true",
+                            help="Lease shards (ROUTE_AI SWEEP_SHARDS) so several nodes can share the sweep; "
+                                 "exits when every shard has been swept this round")
+        parser.add_argument("--owner", type=str, default=None, help="Lease owner name (default: host:pid)")
+
+    def handle(self, *args, **opts):
+        from django.utils import timezone
+        from apps.agent_reroute.decision_maker import active_shipments
+        from apps.agent_reroute.dirty import sweep_shipments
+
+        workers = max(1, opts["workers"])
+        size = max(1, opts["chunk_size"])
+        started_at = timezone.now()
+        queryset = active_shipments() if opts["all"] else sweep_shipments(started_at)
+        started = time.perf_counter()
+
+        pool = None
+        if workers > 1:
+            ctx = multiprocessing.get_context("spawn")
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker)
+        try:
+            if opts["sharded"]:
+                evaluated, proposals, errors = self._sweep_shards(queryset, size, started_at, pool, workers, opts["owner"])
+            else:
+                evaluated, proposals, errors = run_chunks(iter_id_chunks(queryset, size), started_at, pool, workers)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        # Rows still buffered in this process (workers flush on exit)
+        from apps.agent_reroute.decision_log import flush_decisions
+        flush_decisions()
+
+        elapsed = time.perf_counter() - started
+        rate = evaluated / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Evaluated {evaluated} shipments ({proposals} switch proposals, {errors} errors) "
+            f"in {elapsed:.2f}s with {workers} worker(s) — {rate:.1f} shipments/s"
+        ))
+
+    def _sweep_shards(self, queryset, size, started_at, pool, workers, owner):
+        from apps.agent_reroute.leases import LeaseLost, ShardLeaser, ensure_shards, filter_shard
+
+        leaser = ShardLeaser(owner=owner)
+        ensure_shards(leaser.shard_count)
+        evaluated = proposals = errors = 0
+        for lease in leaser.leases():
+            shard_qs = filter_shard(queryset, lease.shard, leaser.shard_count)
+            try:
+                n, p, e = run_chunks(leased_chunks(leaser, lease, shard_qs, size), started_at, pool, workers,
+                                     renew=lambda: leaser.renew(lease))
+            except LeaseLost as e:
+                self.stderr.write(f"{e}; leaving it to its new owner")
+                continue
+            except Exception:
+                leaser.release(lease, swept=False)
+                raise
+            evaluated, proposals, errors = evaluated + n, proposals + p, errors + e
+            if leaser.release(lease):
+                self.stdout.write(f"Shard {lease.shard}/{leaser.shard_count}: {n} shipments")
+            else:
+                self.stderr.write(f"Lease on shard {lease.shard} was lost before release; "
+                                  f"{n} shipments evaluated but the shard is not recorded as swept")
+        return evaluated, proposals, errors
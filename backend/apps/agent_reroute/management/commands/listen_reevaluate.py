@@ -0,0 +1,99 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import InterfaceError, OperationalError, connection
+from django.utils import timezone
+
+from apps.agent_reroute.metrics import record_latency
+from apps.agent_reroute.notify import Coalescer, DirtyListener
+from .evaluate_shipments import evaluate_chunk
+
+
+def dirty_backlog():
+    """Active shipments marked dirty (notifications sent while nobody listened are lost)."""
+    from apps.agent_reroute.decision_maker import active_shipments
+    from apps.agent_reroute.models import DirtyShipment
+    return list(active_shipments().filter(id__in=DirtyShipment.objects.values("shipment_id"))
+                .values_list("id", flat=True))
+
+
+def reevaluate(shipment_ids):
+    """Re-decide the active shipments among shipment_ids as one batch; returns (evaluated, proposals, errors)."""
+    from apps.agent_reroute.decision_maker import active_shipments
+    started_at = timezone.now()
+    active = list(active_shipments().filter(id__in=list(shipment_ids)).values_list("id", flat=True))
+    if not active:
+        return 0, 0, 0
+    return evaluate_chunk(active, started_at)
+
+
+class Command(BaseCommand):
+    help = ("Re-decide shipments as soon as they change: LISTEN for the NOTIFY sent when a shipment is marked "
+            "dirty (PostgreSQL), coalesce notifications over a short window and evaluate them as one batch")
+
+    def add_arguments(self, parser):
+        cfg = settings.ROUTE_AI
+        parser.add_argument("--window", type=float, default=cfg.get("REEVALUATE_WINDOW_SECONDS", 2.0),
+                            help="Seconds to collect notifications after the first one before deciding")
+        parser.add_argument("--max-batch", type=int, default=cfg.get("REEVALUATE_MAX_BATCH", 500),
+                            help="Decide at once when this many shipments are waiting")
+        parser.add_argument("--resync", type=float, default=cfg.get("REEVALUATE_RESYNC_SECONDS", 300),
+                            help="Seconds between re-reads of the dirty set, to pick up missed notifications")
+        parser.add_argument("--once", action="store_true",
+                            help="Evaluate the current dirty set once and exit (works on any database)")
+
+    def handle(self, *args, **opts):
+        if opts["once"]:
+            self._batch(dirty_backlog(), time.monotonic())
+            return
+        if connection.vendor != "postgresql":
+            raise CommandError("listen_reevaluate needs PostgreSQL LISTEN/NOTIFY; use --once or evaluate_shipments")
+
+        coalescer = Coalescer(opts["window"], opts["max_batch"])
+        listener = DirtyListener()
+        backoff = 1.0
+        try:
+            while True:
+                try:
+                    listener.listen()
+                    self.stdout.write(f"Listening on {listener.channel!r}")
+                    backoff = 1.0
+                    self._listen(listener, coalescer, opts["resync"])
+                except (OperationalError, InterfaceError) as e:
+                    # The connection dropped: notifications may have been missed, so
+                    # _listen starts again from the dirty set once reconnected
+                    self.stderr.write(f"Connection lost ({e}); reconnecting in {backoff:.0f}s")
+                    listener.close()
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 60.0)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+
+    def _listen(self, listener, coalescer, resync):
+        next_resync = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= next_resync:
+                coalescer.add(dirty_backlog(), now)
+                next_resync = now + resync
+            ids = listener.wait(coalescer.timeout(now, idle=next_resync - now))
+            now = time.monotonic()
+            coalescer.add(ids, now)
+            if coalescer.ready(now):
+                opened_at = coalescer.opened_at
+                self._batch(coalescer.drain(now), opened_at)
+
+    def _batch(self, shipment_ids, opened_at):
+        if not shipment_ids:
+            return
+        started = time.monotonic()
+        evaluated, proposals, errors = reevaluate(shipment_ids)
+        done = time.monotonic()
+        record_latency("reevaluate.batch", (done - started) * 1000.0)
+        # first notification of the batch -> decided
+        record_latency("reevaluate.reaction", (done - opened_at) * 1000.0)
+        self.stdout.write(f"Re-evaluated {evaluated} of {len(shipment_ids)} notified shipments "
+                          f"({proposals} switch proposals, {errors} errors) in {done - started:.2f}s")
@@ -0,0 +1,112 @@
+import json
+
+import joblib
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.agent_reroute.ml import get_model
+from apps.agent_reroute.models import AgentDecision
+from apps.agent_reroute.replay import archive_files, iter_archive_arrays, iter_decision_arrays, replay_all
+from apps.agent_reroute.tabular import ChunkWriter, parse_when, require_pyarrow
+
+
+def parse_overrides(items):
+    """KEY=VALUE pairs (VALUE parsed as JSON when possible) as a dict of ROUTE_AI overrides."""
+    overrides = {}
+    for item in items or []:
+        key, sep, value = item.partition("=")
+        if not sep or not key:
+            raise CommandError(f"--set expects KEY=VALUE, got '{item}'")
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+class Command(BaseCommand):
+    help = ("Replay logged agent decisions against a candidate delay model and ROUTE_AI settings "
+            "and report how many actions would change (read-only)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", type=str, default=None,
+                            help="Candidate model artifact (default: the ROUTE_AI MODEL_PATH model)")
+        parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                            help="Override a ROUTE_AI setting, e.g. --set P_DELAY_THRESHOLD=0.4 "
+                                 "--set 'SCORE_WEIGHTS={\"eta_minutes\": 1.0, \"toll_cost_usd\": 0.2, \"p_delay\": 40.0}'")
+        parser.add_argument("--archive", action="append", default=[],
+                            help="Replay archive_decisions Parquet files (file or directory; repeatable) instead of the database")
+        parser.add_argument("--since", type=str, default=None, help="Only decisions created at or after this date")
+        parser.add_argument("--until", type=str, default=None, help="Only decisions created before this date")
+        parser.add_argument("--chunk-size", type=int, default=50000, help="Decisions replayed per batch")
+        parser.add_argument("--output", type=str, default=None,
+                            help="Write per-decision results (.csv or .parquet); --flips-only keeps changed actions")
+        parser.add_argument("--flips-only", action="store_true", help="Only write decisions whose action changes")
+        parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+
+    def handle(self, *args, **opts):
+        cfg = {**settings.ROUTE_AI, **parse_overrides(opts["set"])}
+        for key in ("SCORE_WEIGHTS", "P_DELAY_THRESHOLD", "IMPROVEMENT_EPS"):
+            if key not in cfg:
+                raise CommandError(f"ROUTE_AI has no {key}")
+        try:
+            model = joblib.load(opts["model"]) if opts["model"] else get_model()
+        except Exception as e:
+            raise CommandError(f"Could not load delay model: {e}")
+        chunk_size = max(1, opts["chunk_size"])
+
+        if opts["archive"]:
+            require_pyarrow()
+            files = archive_files(opts["archive"])
+            if not files:
+                raise CommandError(f"No archive files found in {', '.join(opts['archive'])}")
+            chunks = iter_archive_arrays(files, chunk_size)
+            source = f"{len(files)} archive file(s)"
+        else:
+            qs = AgentDecision.objects.all()
+            since, until = parse_when(opts["since"], "since"), parse_when(opts["until"], "until")
+            if since:
+                qs = qs.filter(created_at__gte=since)
+            if until:
+                qs = qs.filter(created_at__lt=until)
+            chunks = iter_decision_arrays(qs, chunk_size)
+            source = "the database"
+
+        writer = ChunkWriter(opts["output"]) if opts["output"] else None
+
+        def write(result):
+            df = result.frame()
+            if opts["flips_only"]:
+                df = df[result.candidate != result.switched]
+            if len(df):
+                writer.write(df)
+
+        try:
+            summary = replay_all(chunks, model, cfg, on_result=write if writer else None)
+        except CommandError:
+            raise
+        except Exception as e:
+            raise CommandError(f"Replay failed: {e}")
+        finally:
+            if writer:
+                writer.close()
+
+        report = summary.as_dict()
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        n = max(summary.decisions, 1)
+        self.stdout.write(f"Replayed {summary.decisions} decisions from {source} in {summary.seconds:.2f}s "
+                          f"({summary.throughput:.0f} decisions/s)")
+        self.stdout.write(f"Switches: {summary.logged_switches} logged → {summary.candidate_switches} candidate "
+                          f"({summary.logged_switches / n:.1%} → {summary.candidate_switches / n:.1%})")
+        self.stdout.write(f"Flips: {summary.flips} ({summary.stick_to_switch} stick→switch, "
+                          f"{summary.switch_to_stick} switch→stick); "
+                          f"{summary.no_alternative} high-risk without a logged alternative")
+        for name in ("p_delay_delta", "score_delta"):
+            stats = report[name]
+            if stats["mean"] is not None:
+                self.stdout.write(f"{name}: mean {stats['mean']:+.4f}, mean |Δ| {stats['mean_abs']:.4f}, "
+                                  f"p95 |Δ| {stats['p95_abs']:.4f}, max |Δ| {stats['max_abs']:.4f}")
+        if writer:
+            self.stdout.write(self.style.SUCCESS(f"Results written to {opts['output']}"))
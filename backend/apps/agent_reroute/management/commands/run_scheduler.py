@@ -0,0 +1,98 @@
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import InterfaceError, OperationalError, connection
+
+from apps.agent_reroute.leases import default_owner
+from apps.agent_reroute.scheduler import (AdvisoryLeader, Job, Scheduler, expire_proposals, job_intervals,
+                                          record_run)
+
+
+class Command(BaseCommand):
+    help = ("Run the fleet sweep, proposal expiry and decision retention jobs on their ROUTE_AI "
+            "SCHEDULER_INTERVALS with jitter; with several replicas only the advisory-lock leader runs them")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--jobs", type=str, default=None,
+                            help="Comma-separated jobs to run (default: all of sweep, expire_proposals, retention)")
+        parser.add_argument("--sweep-workers", type=int, default=1, help="evaluate_shipments --workers for the sweep")
+        parser.add_argument("--owner", type=str, default=None, help="Name recorded as leader (default: host:pid)")
+        parser.add_argument("--standby-seconds", type=float, default=10.0,
+                            help="How often a standby scheduler tries to take the lead")
+        parser.add_argument("--once", action="store_true", help="Run every job once (as leader) and exit")
+
+    def handle(self, *args, **opts):
+        intervals = job_intervals()
+        names = [n.strip() for n in opts["jobs"].split(",") if n.strip()] if opts["jobs"] else list(intervals)
+        unknown = [n for n in names if n not in intervals]
+        if unknown or not names:
+            raise CommandError(f"Unknown job(s) {', '.join(unknown)}; choose from {', '.join(intervals)}")
+        runners = {
+            "sweep": lambda: call_command("evaluate_shipments", workers=max(1, opts["sweep_workers"]), stdout=self.stdout),
+            "expire_proposals": self._expire,
+            "retention": lambda: call_command("archive_decisions", stdout=self.stdout),
+        }
+        jobs = [Job(name, float(intervals[name]), runners[name]) for name in names]
+        scheduler = Scheduler(jobs, jitter=settings.ROUTE_AI.get("SCHEDULER_JITTER", 0.1))
+        leader = AdvisoryLeader()
+        owner = opts["owner"] or default_owner()
+
+        if opts["once"]:
+            if not leader.acquire():
+                raise CommandError("Another scheduler holds the lead")
+            try:
+                scheduler.start(scheduler.clock())
+                for job in jobs:
+                    self._run(scheduler, job, owner)
+            finally:
+                leader.release()
+            return
+
+        standby = max(0.1, opts["standby_seconds"])
+        leading = False
+        try:
+            while True:
+                try:
+                    if not leading:
+                        if not leader.acquire():
+                            time.sleep(standby)
+                            continue
+                        leading = True
+                        scheduler.start(scheduler.clock())
+                        self.stdout.write(f"{owner} is leading: {', '.join(f'{j.name} every {j.interval:.0f}s' for j in jobs)}")
+                    for job in scheduler.due(scheduler.clock()):
+                        if not leader.held():
+                            leading = False
+                            self.stderr.write("Lost the scheduler lock; standing by")
+                            break
+                        self._run(scheduler, job, owner)
+                    if leading:
+                        time.sleep(min(max(0.0, scheduler.next_due() - scheduler.clock()), standby))
+                except (OperationalError, InterfaceError) as e:
+                    # The lock went with the connection; another replica may lead by now
+                    self.stderr.write(f"Database error ({e}); standing by")
+                    connection.close()
+                    leading = False
+                    time.sleep(standby)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            leader.release()
+
+    def _expire(self):
+        self.stdout.write(f"Expired {expire_proposals()} pending proposal(s)")
+
+    def _run(self, scheduler, job, owner):
+        result = scheduler.run(job)
+        record_run(result, owner)
+        notes = []
+        if result.skipped:
+            notes.append(f"{result.skipped} tick(s) skipped")
+        if result.overrun:
+            notes.append(f"overran its {job.interval:.0f}s interval")
+        if result.error:
+            self.stderr.write(f"{job.name} failed after {result.duration:.2f}s: {result.error}")
+        else:
+            self.stdout.write(f"{job.name} finished in {result.duration:.2f}s" + (f" ({'; '.join(notes)})" if notes else ""))
@@ -0,0 +1,81 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.agent_reroute.simulation import Scenario, build_fleet_template, simulate
+from apps.agent_reroute.tuning import parse_values
+
+
+class Command(BaseCommand):
+    help = ("Monte Carlo simulation of synthetic fleet days under the rerouting policy: on-time rate, "
+            "switch proposals (approval queue) and driver notifications per day")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trials", type=int, default=1000, help="Synthetic fleet days per scenario")
+        parser.add_argument("--seed", type=int, default=None, help="RNG seed (same seed, same results)")
+        parser.add_argument("--workers", type=int, default=1, help="Worker processes for trial blocks")
+        parser.add_argument("--fleet-size", type=int, default=None, help="Shipments per day (default: template size)")
+        parser.add_argument("--thresholds", type=str, default=None,
+                            help="Comma-separated P_DELAY_THRESHOLD values to sweep (default: current setting)")
+        parser.add_argument("--eps", type=str, default=None,
+                            help="Comma-separated IMPROVEMENT_EPS values to sweep (default: current setting)")
+        parser.add_argument("--approval-rate", type=float, default=1.0, help="Share of proposals approved and applied")
+        parser.add_argument("--day-sigma", type=float, default=0.5, help="Std of the fleet-wide daily logit shock")
+        parser.add_argument("--shipment-sigma", type=float, default=0.75, help="Std of the per-shipment logit shock")
+        parser.add_argument("--all-shipments", action="store_true",
+                            help="Draw from every shipment with a route, not only active ones")
+        parser.add_argument("--json", action="store_true", help="Print per-scenario summaries as JSON")
+
+    def handle(self, *args, **opts):
+        from apps.agent_reroute.decision_maker import active_shipments
+        from apps.shipments.models import Shipment
+
+        cfg = settings.ROUTE_AI
+        if opts["trials"] < 1:
+            raise CommandError("--trials must be >= 1")
+        if not 0.0 <= opts["approval_rate"] <= 1.0:
+            raise CommandError("--approval-rate must be between 0 and 1")
+        try:
+            thresholds = parse_values(opts["thresholds"]) if opts["thresholds"] else [cfg["P_DELAY_THRESHOLD"]]
+            eps_values = parse_values(opts["eps"]) if opts["eps"] else [cfg["IMPROVEMENT_EPS"]]
+        except ValueError as e:
+            raise CommandError(f"--thresholds/--eps must be comma-separated numbers: {e}")
+
+        started = time.perf_counter()
+        queryset = Shipment.objects.filter(route__isnull=False) if opts["all_shipments"] else active_shipments()
+        template = build_fleet_template(list(queryset.values_list("id", flat=True)))
+        if not len(template):
+            raise CommandError("No shipments with a route to build the fleet from")
+        built = time.perf_counter() - started
+
+        scenarios = [Scenario.from_settings(cfg, threshold=t, improvement_eps=e, approval_rate=opts["approval_rate"],
+                                            fleet_size=opts["fleet_size"], day_sigma=opts["day_sigma"],
+                                            shipment_sigma=opts["shipment_sigma"])
+                     for t in thresholds for e in eps_values]
+        started = time.perf_counter()
+        results = simulate(template, scenarios, opts["trials"], opts["seed"], max(1, opts["workers"]))
+        elapsed = time.perf_counter() - started
+
+        if opts["json"]:
+            self.stdout.write(json.dumps([{"threshold": r.scenario.threshold, "improvement_eps": r.scenario.improvement_eps,
+                                           **r.summary()} for r in results], indent=2))
+            return
+        fleet = opts["fleet_size"] or len(template)
+        days = opts["trials"] * len(scenarios)
+        self.stdout.write(f"Fleet template: {len(template)} shipments (built in {built:.2f}s); "
+                          f"{fleet} shipments/day, {opts['trials']} days x {len(scenarios)} scenario(s) "
+                          f"in {elapsed:.2f}s ({days / elapsed if elapsed > 0 else 0:.0f} fleet-days/s)")
+        self.stdout.write(f"{'threshold':>9} {'eps':>6} {'on_time':>8} {'p5-p95':>13} {'baseline':>8} "
+                          f"{'proposals/day':>13} {'p95':>6} {'notifications/day':>17} {'p95':>6}")
+        for r in results:
+            s = r.summary()
+            self.stdout.write(
+                f"{r.scenario.threshold:>9.3f} {r.scenario.improvement_eps:>6.3f} "
+                f"{s['on_time_rate']['mean']:>8.2%} "
+                f"{s['on_time_rate']['p5']:>6.1%}-{s['on_time_rate']['p95']:<6.1%} "
+                f"{s['baseline_on_time_rate']['mean']:>8.2%} "
+                f"{s['proposals']['mean']:>13.1f} {s['proposals']['p95']:>6.0f} "
+                f"{s['notifications']['mean']:>17.1f} {s['notifications']['p95']:>6.0f}"
+            )
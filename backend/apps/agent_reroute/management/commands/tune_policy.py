@@ -0,0 +1,121 @@
+import os
+import time
+
+import joblib
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.agent_reroute.ml import get_model
+from apps.agent_reroute.models import AgentDecision
+from apps.agent_reroute.replay import archive_files, iter_archive_arrays, iter_decision_arrays
+from apps.agent_reroute.tabular import parse_when, require_pyarrow
+from apps.agent_reroute.tuning import build_history, grid_candidates, parse_values, random_candidates, search
+
+
+def delivered_outcomes(shipment_ids, batch_size=1000):
+    """{shipment_id: {"scheduled_at", "delivered_at"}} for the delivered shipments among shipment_ids."""
+    from apps.shipments.models import Shipment
+    ids = sorted(set(shipment_ids))
+    out = {}
+    for start in range(0, len(ids), batch_size):
+        rows = (Shipment.objects.filter(id__in=ids[start:start + batch_size], delivered_at__isnull=False)
+                .values_list("id", "scheduled_at", "delivered_at"))
+        for sid, scheduled_at, delivered_at in rows:
+            out[str(sid)] = {"scheduled_at": scheduled_at, "delivered_at": delivered_at}
+    return out
+
+
+class Command(BaseCommand):
+    help = ("Grid or random search over P_DELAY_THRESHOLD, IMPROVEMENT_EPS and SCORE_WEIGHTS against logged "
+            "decisions and delivered-shipment outcomes; prints the switch rate / avoided delay Pareto front")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--thresholds", type=str, default="0.2,0.3,0.4,0.5,0.6,0.7",
+                            help="Comma-separated P_DELAY_THRESHOLD values (grid) or range ends (random)")
+        parser.add_argument("--eps", type=str, default="0.0,0.02,0.05,0.1,0.2", help="IMPROVEMENT_EPS values")
+        parser.add_argument("--eta-weights", type=str, default=None, help="SCORE_WEIGHTS eta_minutes values (default: current)")
+        parser.add_argument("--toll-weights", type=str, default=None, help="SCORE_WEIGHTS toll_cost_usd values (default: current)")
+        parser.add_argument("--p-weights", type=str, default=None,
+                            help="SCORE_WEIGHTS p_delay values (default: 0.25x, 0.5x, 1x, 2x and 4x the current weight)")
+        parser.add_argument("--random", type=int, default=0,
+                            help="Draw this many random candidates within the min/max of each list instead of the grid")
+        parser.add_argument("--seed", type=int, default=None, help="Seed for --random")
+        parser.add_argument("--workers", type=int, default=1, help="Worker processes evaluating candidate blocks")
+        parser.add_argument("--model", type=str, default=None, help="Model artifact (default: the ROUTE_AI MODEL_PATH model)")
+        parser.add_argument("--archive", action="append", default=[],
+                            help="Use archive_decisions Parquet files (file or directory; repeatable) instead of the database")
+        parser.add_argument("--since", type=str, default=None, help="Only decisions created at or after this date")
+        parser.add_argument("--until", type=str, default=None, help="Only decisions created before this date")
+        parser.add_argument("--chunk-size", type=int, default=50000, help="Decisions loaded per batch")
+        parser.add_argument("--top", type=int, default=20, help="Pareto rows printed")
+        parser.add_argument("--output", type=str, default=None, help="Write every candidate to this .csv")
+
+    def handle(self, *args, **opts):
+        if opts["output"] and os.path.splitext(opts["output"])[1].lower() != ".csv":
+            raise CommandError("--output must be a .csv file")
+        weights = settings.ROUTE_AI["SCORE_WEIGHTS"]
+        try:
+            lists = [
+                parse_values(opts["thresholds"]),
+                parse_values(opts["eps"]),
+                parse_values(opts["eta_weights"]) if opts["eta_weights"] else [weights["eta_minutes"]],
+                parse_values(opts["toll_weights"]) if opts["toll_weights"] else [weights["toll_cost_usd"]],
+                parse_values(opts["p_weights"]) if opts["p_weights"]
+                else [weights["p_delay"] * f for f in (0.25, 0.5, 1.0, 2.0, 4.0)],
+            ]
+        except ValueError as e:
+            raise CommandError(f"Candidate values must be comma-separated numbers: {e}")
+        if any(not values for values in lists):
+            raise CommandError("Every parameter needs at least one value")
+        if opts["random"] > 0:
+            candidates = random_candidates(opts["random"], lists, opts["seed"])
+        else:
+            candidates = grid_candidates(*lists)
+
+        try:
+            model = joblib.load(opts["model"]) if opts["model"] else get_model()
+        except Exception as e:
+            raise CommandError(f"Could not load delay model: {e}")
+
+        started = time.perf_counter()
+        chunk_size = max(1, opts["chunk_size"])
+        if opts["archive"]:
+            require_pyarrow()
+            chunks = list(iter_archive_arrays(archive_files(opts["archive"]), chunk_size))
+        else:
+            qs = AgentDecision.objects.all()
+            since, until = parse_when(opts["since"], "since"), parse_when(opts["until"], "until")
+            if since:
+                qs = qs.filter(created_at__gte=since)
+            if until:
+                qs = qs.filter(created_at__lt=until)
+            chunks = list(iter_decision_arrays(qs, chunk_size))
+        outcomes = delivered_outcomes(np.concatenate([c.shipment_ids for c in chunks]) if chunks else [])
+        history = build_history(chunks, model, outcomes)
+        if not len(history):
+            raise CommandError("No logged decisions to tune against")
+        loaded = time.perf_counter() - started
+
+        table = search(history, candidates, max(1, opts["workers"]))
+        elapsed = time.perf_counter() - started - loaded
+        self.stdout.write(f"{len(history)} decisions, {history.delivered_shipments} delivered shipment(s) with outcomes; "
+                          f"loaded in {loaded:.2f}s")
+        self.stdout.write(f"Evaluated {len(candidates)} candidates in {elapsed:.2f}s "
+                          f"({len(candidates) * len(history) / max(elapsed, 1e-9):.0f} decision-candidates/s)")
+        if not history.delivered_shipments:
+            self.stdout.write(self.style.WARNING("No delivered shipments among these decisions: avoided delay is 0 throughout"))
+
+        front = table[table["pareto"]].sort_values("switch_rate").head(max(0, opts["top"]))
+        header = f"{'threshold':>9} {'eps':>6} {'w_eta':>7} {'w_toll':>7} {'w_p':>7} {'switch_rate':>11} {'avoided_min':>11}"
+        self.stdout.write(header)
+        for row in front.itertuples(index=False):
+            values = dict(zip(table.columns, row))
+            self.stdout.write(
+                f"{values['P_DELAY_THRESHOLD']:>9.3f} {values['IMPROVEMENT_EPS']:>6.3f} {values['eta_minutes']:>7.3f} "
+                f"{values['toll_cost_usd']:>7.3f} {values['p_delay']:>7.2f} {values['switch_rate']:>11.2%} "
+                f"{values['avoided_delay_minutes']:>11.1f}"
+            )
+        if opts["output"]:
+            table.to_csv(opts["output"], index=False)
+            self.stdout.write(self.style.SUCCESS(f"All {len(table)} candidates written to {opts['output']}"))
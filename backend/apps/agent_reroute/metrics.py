@@ -0,0 +1,81 @@
+"""
+Per-process latency metrics for the decision pipeline.
+
+Each decide()/decide_many() call times its stages with a StageTimings object;
+when the call finishes, one sample per stage (plus "total") is added to a
+rolling window of the last LATENCY_WINDOW samples under "<op>.<stage>".
+latency_snapshot() reports count and p50/p95/p99/max in milliseconds and is
+served by the internal metrics endpoint.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict
+
+import numpy as np
+from django.conf import settings
+
+_samples: Dict[str, Deque[float]] = {}
+_counts: Dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def record_latency(name: str, ms: float):
+    window = settings.ROUTE_AI.get("LATENCY_WINDOW", 1024)
+    with _lock:
+        samples = _samples.get(name)
+        if samples is None or samples.maxlen != window:
+            samples = _samples[name] = deque(samples or (), maxlen=window)
+        samples.append(ms)
+        _counts[name] = _counts.get(name, 0) + 1
+
+
+def latency_snapshot() -> Dict[str, Dict[str, float]]:
+    with _lock:
+        windows = {name: np.array(samples) for name, samples in _samples.items() if samples}
+        counts = dict(_counts)
+    out = {}
+    for name in sorted(windows):
+        p50, p95, p99 = np.percentile(windows[name], [50, 95, 99])
+        out[name] = {
+            "count": counts[name],
+            "window": len(windows[name]),
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3),
+            "max_ms": round(float(windows[name].max()), 3),
+        }
+    return out
+
+
+def reset_latency():
+    with _lock:
+        _samples.clear()
+        _counts.clear()
+
+
+class StageTimings:
+    """Wall time per stage of one call; a stage entered several times accumulates."""
+
+    def __init__(self, op: str):
+        self.op = op
+        self.ms: Dict[str, float] = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.ms[name] = self.ms.get(name, 0.0) + (time.perf_counter() - t0) * 1000.0
+
+    def finish(self) -> Dict[str, float]:
+        self.ms["total"] = (time.perf_counter() - self._started) * 1000.0
+        for name, ms in self.ms.items():
+            record_latency(f"{self.op}.{name}", ms)
+        return self.ms
+
+    def as_dict(self) -> Dict[str, float]:
+        return {name: round(ms, 3) for name, ms in self.ms.items()}
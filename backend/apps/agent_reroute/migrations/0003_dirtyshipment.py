@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent_reroute', '0002_routeproposal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyShipment',
+            fields=[
+                ('shipment_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('reason', models.CharField(max_length=100)),
+                ('marked_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='agentdecision',
+            index=models.Index(fields=['shipment_id', 'created_at'], name='agent_rerou_shipmen_f06396_idx'),
+        ),
+    ]
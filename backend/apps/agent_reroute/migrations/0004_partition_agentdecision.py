@@ -0,0 +1,115 @@
+import re
+from datetime import datetime
+
+from django.db import migrations
+
+TABLE = "agent_reroute_agentdecision"
+# A free-standing sequence: identity columns are not allowed on partitioned tables before PG 17
+SEQUENCE = f"{TABLE}_pk_seq"
+
+COLUMNS = "id, created_at, shipment_id, current_route_id, proposed_route_id, input_snapshot, output_decision, approved"
+
+# Columns as created by 0001_initial; a partitioned table's primary key must include the partition key
+PARTITIONED_TABLE_SQL = f"""
+CREATE TABLE {TABLE} (
+    id bigint NOT NULL DEFAULT nextval('{SEQUENCE}'),
+    created_at timestamp with time zone NOT NULL,
+    shipment_id uuid NOT NULL,
+    current_route_id uuid NULL,
+    proposed_route_id uuid NULL,
+    input_snapshot jsonb NOT NULL,
+    output_decision jsonb NOT NULL,
+    approved boolean NULL,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at)
+"""
+
+PLAIN_TABLE_SQL = f"""
+CREATE TABLE {TABLE} (
+    id bigint NOT NULL DEFAULT nextval('{SEQUENCE}') PRIMARY KEY,
+    created_at timestamp with time zone NOT NULL,
+    shipment_id uuid NOT NULL,
+    current_route_id uuid NULL,
+    proposed_route_id uuid NULL,
+    input_snapshot jsonb NOT NULL,
+    output_decision jsonb NOT NULL,
+    approved boolean NULL
+)
+"""
+
+
+def _next_month(month):
+    return month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+
+
+def _rebuild(cursor, create_sql, after_create=lambda cursor, old: None):
+    """Recreate the table with create_sql, keeping rows, ids and secondary index names."""
+    old = f"{TABLE}_old"
+    cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {old}")
+    cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'", [old])
+    for (name,) in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE {old} DROP CONSTRAINT {name}")
+    cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", [old])
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        cursor.execute(f"DROP INDEX {name}")
+
+    cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE}")
+    cursor.execute(f"ALTER SEQUENCE {SEQUENCE} OWNED BY NONE")
+    cursor.execute(f"SELECT setval('{SEQUENCE}', COALESCE((SELECT MAX(id) FROM {old}), 0) + 1, false)")
+    cursor.execute(create_sql)
+    after_create(cursor, old)
+    cursor.execute(f"INSERT INTO {TABLE} ({COLUMNS}) SELECT {COLUMNS} FROM {old}")
+    cursor.execute(f"DROP TABLE {old}")
+    cursor.execute(f"ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id")
+    for _, indexdef in indexes:
+        cursor.execute(re.sub(rf" ON (\S+\.)?{old} ", f" ON {TABLE} ", indexdef))
+
+
+def _create_month_partitions(cursor, old):
+    """One partition per month that already has rows through two months ahead, plus a default."""
+    cursor.execute(f"SELECT MIN(created_at), now() FROM {old}")
+    first, now = cursor.fetchone()
+    month = (first or now).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    month = datetime(month.year, month.month, 1)
+    last = datetime(now.year, now.month, 1)
+    for _ in range(2):
+        last = _next_month(last)
+    while month <= last:
+        end = _next_month(month)
+        cursor.execute(
+            f"CREATE TABLE {TABLE}_p{month:%Y%m} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{end:%Y-%m-%d} 00:00:00+00')"
+        )
+        month = end
+    cursor.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SET LOCAL TIME ZONE 'UTC'")
+        _rebuild(cursor, PARTITIONED_TABLE_SQL, _create_month_partitions)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        _rebuild(cursor, PLAIN_TABLE_SQL)
+
+
+class Migration(migrations.Migration):
+    """
+    Range-partition AgentDecision by month on created_at (PostgreSQL only;
+    other databases keep the plain table). See apps/agent_reroute/partitions.py.
+    """
+
+    dependencies = [
+        ('agent_reroute', '0003_dirtyshipment'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent_reroute', '0004_partition_agentdecision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DecisionPath',
+            fields=[
+                ('route_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('coordinates', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='agentdecision',
+            name='feature_schema',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='agentdecision',
+            name='features',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
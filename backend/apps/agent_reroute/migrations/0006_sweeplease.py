@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent_reroute', '0005_compact_decision_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SweepLease',
+            fields=[
+                ('shard', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('owner', models.CharField(blank=True, max_length=200, null=True)),
+                ('generation', models.BigIntegerField(default=0)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('swept_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
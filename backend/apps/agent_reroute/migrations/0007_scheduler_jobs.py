@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent_reroute', '0006_sweeplease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerJob',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('interval_seconds', models.FloatField()),
+                ('leader', models.CharField(blank=True, default='', max_length=200)),
+                ('last_started_at', models.DateTimeField(blank=True, null=True)),
+                ('last_duration_ms', models.FloatField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('runs', models.PositiveIntegerField(default=0)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('skipped_ticks', models.PositiveIntegerField(default=0)),
+                ('overruns', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='routeproposal',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('rejected', 'Rejected'), ('applied', 'Applied'), ('expired', 'Expired')], default='pending', max_length=20),
+        ),
+    ]
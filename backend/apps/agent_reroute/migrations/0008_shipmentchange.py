@@ -0,0 +1,20 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent_reroute', '0007_scheduler_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShipmentChange',
+            fields=[
+                ('shipment_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('changed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
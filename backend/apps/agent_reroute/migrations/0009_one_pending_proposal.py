@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+def expire_duplicate_pending(apps, schema_editor):
+    """Repeated n8n runs left several pending proposals per shipment: keep the newest."""
+    RouteProposal = apps.get_model("agent_reroute", "RouteProposal")
+    seen, stale = set(), []
+    rows = (RouteProposal.objects.filter(status="pending").order_by("shipment_id", "-created_at")
+            .values_list("id", "shipment_id"))
+    for pk, shipment_id in rows.iterator():
+        if shipment_id in seen:
+            stale.append(pk)
+        else:
+            seen.add(shipment_id)
+    for start in range(0, len(stale), 1000):
+        RouteProposal.objects.filter(id__in=stale[start:start + 1000]).update(status="expired")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent_reroute', '0008_shipmentchange'),
+    ]
+
+    operations = [
+        migrations.RunPython(expire_duplicate_pending, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='routeproposal',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('shipment_id',), name='one_pending_proposal_per_shipment'),
+        ),
+    ]
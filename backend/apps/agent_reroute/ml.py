@@ -1,4 +1,5 @@
 import joblib, numpy as np
+import os
 import pandas as pd
 from django.conf import settings
 import logging
@@ -28,10 +29,40 @@ def get_model():
         logger.error(f"Failed to load ML model: {e}")
         raise e
 
-def build_features_from_shipment(shipment, current_option):
+def model_version():
+    """
+    Identifies the model file the agent would load: name, size and mtime.
+    Changes whenever train_delay_model writes a new artifact.
+    """
+    path = settings.ROUTE_AI["MODEL_PATH"]
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "heuristic"
+    return f"{os.path.basename(str(path))}:{st.st_size}:{st.st_mtime_ns}"
+
+FEATURE_COLUMNS = [
+    "temp_c", "wind_speed", "humidity", "precipitation",
+    "haversine_km", "planned_hour", "planned_dow", "planned_month",
+    "is_weekend", "lead_time_hours", "GpsProvider", "Market/Regular", "condition"
+]
+
+SNAPSHOT_KEYS = [
+    "temp_c", "wind_speed", "humidity", "precipitation",
+    "haversine_km", "planned_hour", "planned_dow", "planned_month",
+    "is_weekend", "lead_time_hours", "gps_provider", "market_regular", "condition"
+]
+
+CONDITION_MAP = {"Clear": 0, "Clouds": 1, "Rain": 2, "Snow": 3}
+
+# Weather inputs a routing provider may supply per option as option["weather"]
+WEATHER_KEYS = ("temp_c", "wind_speed", "humidity", "precipitation", "condition")
+
+def _feature_row(shipment, current_option, now=None):
     """
     Map your shipment fields → model features.
     Adapt to your REAL pipeline (order/encodings must match training).
+    Returns (snapshot dict, feature list in FEATURE_COLUMNS order).
     """
     # Calculate haversine distance from origin to destination if available
     haversine_km = 0.0
@@ -56,8 +87,9 @@ def build_features_from_shipment(shipment, current_option):
         is_weekend = 1 if planned_dow in [6, 7] else 0  # Saturday=6, Sunday=7
         
         # Calculate lead time (hours from now to scheduled departure)
-        from django.utils import timezone
-        now = timezone.now()
+        if now is None:
+            from django.utils import timezone
+            now = timezone.now()
         lead_time_hours = max(0, (shipment.scheduled_at - now).total_seconds() / 3600)
     
     # Build features to match training data exactly
@@ -82,8 +114,7 @@ def build_features_from_shipment(shipment, current_option):
     condition_encoded = 0  # Default encoding for "Clear" condition
     
     if hasattr(shipment, "condition"):
-        condition_map = {"Clear": 0, "Clouds": 1, "Rain": 2, "Snow": 3}
-        condition_encoded = condition_map.get(shipment.condition, 0)
+        condition_encoded = CONDITION_MAP.get(shipment.condition, 0)
     
     categorical_features = [
         gps_provider,      # GpsProvider (encoded)
@@ -95,73 +126,202 @@ def build_features_from_shipment(shipment, current_option):
     all_features = numeric_features + categorical_features
     
     # Create feature snapshot for logging
-    snap = {
-        "temp_c": numeric_features[0],
-        "wind_speed": numeric_features[1],
-        "humidity": numeric_features[2],
-        "precipitation": numeric_features[3],
-        "haversine_km": numeric_features[4],
-        "planned_hour": numeric_features[5],
-        "planned_dow": numeric_features[6],
-        "planned_month": numeric_features[7],
-        "is_weekend": numeric_features[8],
-        "lead_time_hours": numeric_features[9],
-        "gps_provider": categorical_features[0],
-        "market_regular": categorical_features[1],
-        "condition": categorical_features[2],
-    }
+    snap = dict(zip(SNAPSHOT_KEYS, all_features))
+    return snap, all_features
+
+def build_features_from_shipment(shipment, current_option):
+    """
+    Build the (snapshot, 1-row DataFrame) pair for a single shipment.
+    Column names must match exactly what the model was trained with.
+    """
+    snap, row = _feature_row(shipment, current_option)
+    X = pd.DataFrame([row], columns=FEATURE_COLUMNS)
+    return snap, X
+
+def build_feature_matrix(shipments, current_options):
+    """
+    Build snapshots and a single N-row DataFrame for many shipments so the
+    model can be called once for the whole batch.
+    """
+    from django.utils import timezone
+    now = timezone.now()
+    snaps, rows = [], []
+    for shipment, option in zip(shipments, current_options):
+        snap, row = _feature_row(shipment, option, now=now)
+        snaps.append(snap)
+        rows.append(row)
+    X = pd.DataFrame(rows, columns=FEATURE_COLUMNS)
+    return snaps, X
+
+def _parse_latlon_column(series):
+    parts = series.astype(str).str.split(",", n=1, expand=True).reindex(columns=[0, 1])
+    return pd.to_numeric(parts[0], errors="coerce"), pd.to_numeric(parts[1], errors="coerce")
+
+def build_features_from_trips(df):
+    """
+    Vectorized _feature_row() for offline trip tables in the
+    delivery_truck_data.xlsx layout (CSV/Parquet exports use the same columns).
+    trip_start_date (or BookingID_Date) stands in for Shipment.scheduled_at and
+    BookingID_Date for "now", so lead time is what the agent saw at booking.
+    Returns a DataFrame with FEATURE_COLUMNS, indexed like `df`.
+    """
+    n = len(df)
+    X = pd.DataFrame(index=df.index)
+
+    for col, default in (("temp_c", 25.0), ("wind_speed", 10.0), ("humidity", 60.0), ("precipitation", 0.0)):
+        values = pd.to_numeric(df[col], errors="coerce") if col in df.columns else pd.Series(np.nan, index=df.index)
+        X[col] = values.fillna(default).astype(float)
+
+    haversine_km = pd.Series(0.0, index=df.index)
+    if "Org_lat_lon" in df.columns and "Dest_lat_lon" in df.columns:
+        org_lat, org_lng = _parse_latlon_column(df["Org_lat_lon"])
+        dst_lat, dst_lng = _parse_latlon_column(df["Dest_lat_lon"])
+        # Same rough conversion as the live pipeline
+        haversine_km = (np.sqrt((org_lat - dst_lat) ** 2 + (org_lng - dst_lng) ** 2) * 111).fillna(0.0)
+    X["haversine_km"] = haversine_km.astype(float)
+
+    scheduled = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    for col in ("trip_start_date", "BookingID_Date"):
+        if col in df.columns:
+            scheduled = scheduled.fillna(pd.to_datetime(df[col], errors="coerce"))
+    booked = pd.to_datetime(df["BookingID_Date"], errors="coerce") if "BookingID_Date" in df.columns else scheduled
+
+    has_schedule = scheduled.notna()
+    X["planned_hour"] = scheduled.dt.hour.where(has_schedule, 9).astype(int)
+    X["planned_dow"] = (scheduled.dt.dayofweek + 1).where(has_schedule, 1).astype(int)  # Monday=1, Sunday=7
+    X["planned_month"] = scheduled.dt.month.where(has_schedule, 1).astype(int)
+    X["is_weekend"] = X["planned_dow"].isin([6, 7]).astype(int)
+    lead = ((scheduled - booked).dt.total_seconds() / 3600).clip(lower=0)
+    X["lead_time_hours"] = lead.where(lead.notna(), 24).astype(float)
+
+    # Categorical features use the same (placeholder) encodings as _feature_row()
+    X["GpsProvider"] = np.zeros(n, dtype=int)
+    X["Market/Regular"] = np.zeros(n, dtype=int)
+    if "condition" in df.columns:
+        X["condition"] = df["condition"].map(CONDITION_MAP).fillna(0).astype(int)
+    else:
+        X["condition"] = np.zeros(n, dtype=int)
+    return X[FEATURE_COLUMNS]
+
+def _heuristic_p_delay(shipment, snap):
+    """Fallback probability used when the model cannot be loaded or fails."""
+    # Enhanced heuristic: detect delays based on shipment status and timing
+    base_prob = 0.1
     
-    # Create feature matrix as DataFrame (1 sample, 13 features)
-    # Column names must match exactly what the model was trained with
-    column_names = [
-        "temp_c", "wind_speed", "humidity", "precipitation",
-        "haversine_km", "planned_hour", "planned_dow", "planned_month",
-        "is_weekend", "lead_time_hours", "GpsProvider", "Market/Regular", "condition"
-    ]
+    # Check if shipment is actually delayed based on our realistic data
+    from django.utils import timezone
+    now = timezone.now()
     
-    X = pd.DataFrame([all_features], columns=column_names)
-    return snap, X
+    # If shipment is PLANNED but scheduled time has passed, it's delayed
+    if shipment.status == "PLANNED" and shipment.scheduled_at < now:
+        base_prob += 0.4  # High delay probability for overdue planned shipments
+        
+    # If shipment is ENROUTE and taking too long, it's delayed
+    elif shipment.status == "ENROUTE":
+        # Check if it's been enroute for too long (more than 2 days)
+        if shipment.scheduled_at < now - timezone.timedelta(days=2):
+            base_prob += 0.3  # Medium delay probability for long enroute shipments
+            
+    # If shipment is DELIVERED but was delivered late, it was delayed
+    elif shipment.status == "DELIVERED" and shipment.delivered_at:
+        # Check if delivery was significantly late (more than 24 hours after scheduled)
+        if shipment.delivered_at > shipment.scheduled_at + timezone.timedelta(hours=24):
+            base_prob += 0.5  # High delay probability for late deliveries
+    
+    # Add weather and distance factors
+    if snap.get("haversine_km", 0) > 500:
+        base_prob += 0.2
+    if snap.get("precipitation", 0) > 5:
+        base_prob += 0.3
+    if snap.get("condition", 0) > 1:  # Not clear weather
+        base_prob += 0.1
+        
+    return min(base_prob, 0.9)
+
+def predict_matrix(model, X):
+    """Delay probability for every row of a FEATURE_COLUMNS matrix"""
+    if hasattr(model, "predict_proba"):
+        return np.asarray(model.predict_proba(X))[:, 1].astype(float)
+    return np.asarray(model.predict(X)).astype(float)
 
 def predict_p_delay(shipment, current_option):
     try:
         model = get_model()
         snap, X = build_features_from_shipment(shipment, current_option)
-        p = float(model.predict_proba(X)[0, 1]) if hasattr(model, "predict_proba") else float(model.predict(X)[0])
+        p = float(predict_matrix(model, X)[0])
         return p, snap
     except Exception as e:
         logger.error(f"ML prediction failed: {e}")
         # Return a default probability based on simple heuristics
         snap, _ = build_features_from_shipment(shipment, current_option)
-        
-        # Enhanced heuristic: detect delays based on shipment status and timing
-        base_prob = 0.1
-        
-        # Check if shipment is actually delayed based on our realistic data
-        from django.utils import timezone
-        now = timezone.now()
-        
-        # If shipment is PLANNED but scheduled time has passed, it's delayed
-        if shipment.status == "PLANNED" and shipment.scheduled_at < now:
-            base_prob += 0.4  # High delay probability for overdue planned shipments
-            
-        # If shipment is ENROUTE and taking too long, it's delayed
-        elif shipment.status == "ENROUTE":
-            # Check if it's been enroute for too long (more than 2 days)
-            if shipment.scheduled_at < now - timezone.timedelta(days=2):
-                base_prob += 0.3  # Medium delay probability for long enroute shipments
-                
-        # If shipment is DELIVERED but was delivered late, it was delayed
-        elif shipment.status == "DELIVERED" and shipment.delivered_at:
-            # Check if delivery was significantly late (more than 24 hours after scheduled)
-            if shipment.delivered_at > shipment.scheduled_at + timezone.timedelta(hours=24):
-                base_prob += 0.5  # High delay probability for late deliveries
-        
-        # Add weather and distance factors
-        if snap.get("haversine_km", 0) > 500:
-            base_prob += 0.2
-        if snap.get("precipitation", 0) > 5:
-            base_prob += 0.3
-        if snap.get("condition", 0) > 1:  # Not clear weather
-            base_prob += 0.1
-            
-        return min(base_prob, 0.9), snap
+        return _heuristic_p_delay(shipment, snap), snap
+
+def predict_p_delay_many(shipments, current_options):
+    """
+    Vectorized predict_p_delay: one feature matrix, one predict_proba call.
+    Returns a list of (p_delay, snapshot) in the same order as `shipments`.
+    """
+    shipments = list(shipments)
+    if not shipments:
+        return []
+    snaps, X = build_feature_matrix(shipments, current_options)
+    return list(zip(predict_rows(shipments, snaps, X), snaps))
+
+def predict_rows(shipments, snaps, X):
+    """
+    Delay probability for prebuilt feature rows (one predict_proba call),
+    falling back to the heuristic for every row if the model fails.
+    """
+    try:
+        return [float(p) for p in predict_matrix(get_model(), X)]
+    except Exception as e:
+        logger.error(f"ML batch prediction failed: {e}")
+        return [_heuristic_p_delay(s, snap) for s, snap in zip(shipments, snaps)]
+
+def route_feature_row(snap, current_option, option):
+    """
+    Feature row for scoring `option` instead of the shipment's current route.
+    Starts from the shipment snapshot and applies the route-dependent parts the
+    model knows about: distance scales with the option's length relative to
+    the current route, and corridor weather (option["weather"]) replaces the
+    shipment-level weather when the routing provider supplies it.
+    Returns (snapshot, feature list in FEATURE_COLUMNS order).
+    """
+    feats = dict(snap)
+    cur_km, alt_km = current_option.get("distance_km"), option.get("distance_km")
+    if cur_km and alt_km:
+        feats["haversine_km"] = snap["haversine_km"] * float(alt_km) / float(cur_km)
+    for key, value in (option.get("weather") or {}).items():
+        if key == "condition":
+            feats[key] = CONDITION_MAP.get(value, 0) if isinstance(value, str) else value
+        elif key in WEATHER_KEYS and value is not None:
+            feats[key] = float(value)
+    return feats, [feats[k] for k in SNAPSHOT_KEYS]
+
+def predict_alternatives_many(items):
+    """
+    Delay probability for every alternative of every shipment with a single
+    predict_proba call. Current routes are scored earlier with predict_rows,
+    since their p_delay decides which shipments get alternatives at all.
+    items: list of (shipment, snapshot, current_option, [alternative options]).
+    Returns one list of probabilities per item, aligned with its alternatives.
+    """
+    items = list(items)
+    snaps, rows, owners = [], [], []
+    for i, (shipment, snap, current, alts) in enumerate(items):
+        for alt in alts:
+            alt_snap, row = route_feature_row(snap, current, alt)
+            snaps.append(alt_snap)
+            rows.append(row)
+            owners.append(i)
+    out = [[] for _ in items]
+    if not rows:
+        return out
+    try:
+        probs = [float(p) for p in predict_matrix(get_model(), pd.DataFrame(rows, columns=FEATURE_COLUMNS))]
+    except Exception as e:
+        logger.error(f"ML alternative prediction failed: {e}")
+        probs = [_heuristic_p_delay(items[i][0], alt_snap) for i, alt_snap in zip(owners, snaps)]
+    for i, p in zip(owners, probs):
+        out[i].append(p)
+    return out
@@ -6,9 +6,73 @@ class AgentDecision(models.Model):
     shipment_id = models.UUIDField(db_index=True)
     current_route_id = models.UUIDField(null=True, blank=True)
     proposed_route_id = models.UUIDField(null=True, blank=True)
-    input_snapshot = models.JSONField()    # features + context
+    input_snapshot = models.JSONField()    # current option (legacy rows: features + context)
     output_decision = models.JSONField()   # scores, choice, rationale
     approved = models.BooleanField(null=True)  # None=pending, True/False
+    # Packed float32 feature vector and its schema id (see snapshots.py); NULL on legacy rows
+    feature_schema = models.PositiveSmallIntegerField(null=True, blank=True)
+    features = models.BinaryField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['shipment_id', 'created_at']),
+        ]
+
+class DirtyShipment(models.Model):
+    """
+    Shipments whose decision inputs changed since they were last evaluated.
+    Written by signals.py (and weather feeds via dirty.mark_dirty); cleared by sweeps.
+    """
+    shipment_id = models.UUIDField(primary_key=True)
+    reason = models.CharField(max_length=100)   # e.g. 'status,route', 'position', 'weather'
+    marked_at = models.DateTimeField()
+
+class ShipmentChange(models.Model):
+    """
+    When each shipment's decision inputs last changed. Set with every dirty
+    mark but never cleared by sweeps, so the active-shipment feed can answer
+    since= queries.
+    """
+    shipment_id = models.UUIDField(primary_key=True)
+    changed_at = models.DateTimeField(db_index=True)
+
+class SweepLease(models.Model):
+    """
+    One row per sweep shard (see leases.py). A worker owns a shard while
+    expires_at is in the future; generation grows with every claim so a
+    worker whose lease expired cannot renew or release it any more.
+    """
+    shard = models.PositiveIntegerField(primary_key=True)
+    owner = models.CharField(max_length=200, null=True, blank=True)
+    generation = models.BigIntegerField(default=0)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    swept_at = models.DateTimeField(null=True, blank=True)   # last completed sweep of the shard
+
+class SchedulerJob(models.Model):
+    """
+    Run history of one run_scheduler job (see scheduler.py), written by the
+    leading scheduler. skipped_ticks counts ticks that passed while the
+    scheduler was busy; overruns counts runs longer than the job's interval.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    interval_seconds = models.FloatField()
+    leader = models.CharField(max_length=200, blank=True, default="")
+    last_started_at = models.DateTimeField(null=True, blank=True)
+    last_duration_ms = models.FloatField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    runs = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    skipped_ticks = models.PositiveIntegerField(default=0)
+    overruns = models.PositiveIntegerField(default=0)
+
+class DecisionPath(models.Model):
+    """
+    Paths of proposed alternatives, stored once and referenced from
+    AgentDecision by route_id (alternative ids are derived from their path).
+    """
+    route_id = models.UUIDField(primary_key=True)
+    coordinates = models.JSONField()   # [[lon, lat], ...]
+    created_at = models.DateTimeField(auto_now_add=True)
 
 class RouteProposal(models.Model):
     """
@@ -43,6 +107,7 @@ class RouteProposal(models.Model):
         ('approved', 'Approved'),
         ('rejected', 'Rejected'),
         ('applied', 'Applied'),
+        ('expired', 'Expired'),   # left pending for PROPOSAL_TTL_HOURS
     ])
     
     class Meta:
@@ -50,3 +115,8 @@ class RouteProposal(models.Model):
         indexes = [
             models.Index(fields=['shipment_id', 'status']),
         ]
+        constraints = [
+            # store_all_proposals upserts on this (ON CONFLICT (shipment_id) WHERE status = 'pending')
+            models.UniqueConstraint(fields=['shipment_id'], condition=models.Q(status='pending'),
+                                    name='one_pending_proposal_per_shipment'),
+        ]
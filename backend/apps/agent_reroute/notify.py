@@ -0,0 +1,97 @@
+"""
+Push notifications for shipments whose decision may have changed.
+
+On PostgreSQL, mark_dirty() also sends NOTIFY on the REEVALUATE_CHANNEL
+channel with each shipment id as payload, so every hook that marks a
+shipment dirty (Shipment edits, new VehiclePositions, route edits, alerts,
+weather) wakes the listen_reevaluate worker. NOTIFY is transactional: the
+worker hears about a shipment only once the change and its DirtyShipment row
+are committed. Notifications sent while no worker listens are lost, which is
+why the worker starts from (and periodically re-reads) the dirty set.
+
+The worker coalesces notifications: the first one opens a window of
+REEVALUATE_WINDOW_SECONDS, and everything arriving within it (or until
+REEVALUATE_MAX_BATCH distinct shipments) is re-decided as one batch.
+"""
+import select
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db import connection
+
+
+def channel() -> str:
+    return settings.ROUTE_AI.get("REEVALUATE_CHANNEL", "agent_reroute_dirty")
+
+
+def notify_dirty(shipment_ids: Iterable):
+    """NOTIFY each shipment id (no-op on databases without LISTEN/NOTIFY)."""
+    ids = sorted({str(i) for i in shipment_ids if i is not None})
+    if not ids or connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, id) FROM unnest(%s::text[]) AS id", [channel(), ids])
+
+
+class Coalescer:
+    """Collects shipment ids until the window since the first one has passed or the batch is full."""
+
+    def __init__(self, window_seconds: float, max_batch: int):
+        self.window_seconds = window_seconds
+        self.max_batch = max(1, max_batch)
+        self._ids = {}
+        self.opened_at: Optional[float] = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, shipment_ids: Iterable, now: float):
+        for sid in shipment_ids:
+            self._ids.setdefault(str(sid), None)
+        if self._ids and self.opened_at is None:
+            self.opened_at = now
+
+    def ready(self, now: float) -> bool:
+        return bool(self._ids) and (len(self._ids) >= self.max_batch or now - self.opened_at >= self.window_seconds)
+
+    def timeout(self, now: float, idle: float) -> float:
+        """How long to wait for more notifications before the batch is due (`idle` when empty)."""
+        if self.opened_at is None:
+            return idle
+        return max(0.0, self.opened_at + self.window_seconds - now)
+
+    def drain(self, now: float) -> List[str]:
+        """Up to max_batch ids in arrival order; the rest stay for the next batch."""
+        ids = list(self._ids)
+        batch, rest = ids[:self.max_batch], ids[self.max_batch:]
+        self._ids = dict.fromkeys(rest)
+        self.opened_at = now if rest else None
+        return batch
+
+
+class DirtyListener:
+    """LISTEN on the notification channel over Django's (psycopg2) connection."""
+
+    def __init__(self):
+        if connection.vendor != "postgresql":
+            raise RuntimeError("LISTEN/NOTIFY needs PostgreSQL")
+        self.channel = channel()
+
+    def listen(self):
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+
+    def wait(self, timeout: float) -> List[str]:
+        """Shipment ids notified within `timeout` seconds (empty if none arrived)."""
+        raw = connection.connection
+        with connection.wrap_database_errors:
+            if not raw.notifies and select.select([raw], [], [], timeout) == ([], [], []):
+                return []
+            raw.poll()
+        ids = [n.payload for n in raw.notifies if n.channel == self.channel]
+        raw.notifies.clear()
+        return ids
+
+    def close(self):
+        connection.close()
@@ -0,0 +1,93 @@
+"""
+Monthly range partitions of the AgentDecision table on created_at (PostgreSQL).
+
+Migration 0004 turns agent_reroute_agentdecision into a table partitioned by
+RANGE (created_at) with one partition per calendar month, named
+agent_reroute_agentdecision_pYYYYMM, plus a DEFAULT partition for rows
+outside every range. archive_decisions creates upcoming partitions and
+detaches and drops old ones after they are archived. On other databases
+(SQLite in development) the table is a plain table and the helpers below
+report no partitions.
+"""
+from datetime import datetime, timezone as dt_timezone
+from typing import List, Optional, Tuple
+
+from django.db import connection, transaction
+
+TABLE = "agent_reroute_agentdecision"
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+
+def month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1, tzinfo=dt.tzinfo or dt_timezone.utc)
+
+
+def add_months(month: datetime, n: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + n
+    return month.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{TABLE}_p{month.year:04d}{month.month:02d}"
+
+
+def is_partitioned() -> bool:
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+                       "WHERE c.relname = %s", [TABLE])
+        return cursor.fetchone() is not None
+
+
+def list_partitions() -> List[Tuple[str, Optional[datetime]]]:
+    """[(partition name, month start)] oldest first; month is None for the default partition."""
+    if not is_partitioned():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s ORDER BY c.relname", [TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+    out = []
+    for name in names:
+        suffix = name[len(TABLE) + 2:]
+        if name.startswith(f"{TABLE}_p") and len(suffix) == 6 and suffix.isdigit():
+            out.append((name, datetime(int(suffix[:4]), int(suffix[4:]), 1, tzinfo=dt_timezone.utc)))
+        else:
+            out.append((name, None))
+    return out
+
+
+def create_partition(month: datetime) -> bool:
+    """Create the partition for `month` unless it exists. Returns True if created."""
+    name = partition_name(month)
+    if any(existing == name for existing, _ in list_partitions()):
+        return False
+    start, end = month_start(month), add_months(month_start(month), 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Rows for this month that landed in the default partition must move into the new one
+        cursor.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)")
+        cursor.execute(f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s "
+                       f"RETURNING *) INSERT INTO {name} SELECT * FROM moved", [start, end])
+        cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", [start, end])
+    return True
+
+
+def ensure_partitions(now: datetime, months_ahead: int) -> List[str]:
+    """Partitions for the current month and the next `months_ahead`; returns the ones created."""
+    if not is_partitioned():
+        return []
+    created = []
+    for n in range(months_ahead + 1):
+        month = add_months(month_start(now), n)
+        if create_partition(month):
+            created.append(partition_name(month))
+    return created
+
+
+def drop_partition(name: str):
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+        cursor.execute(f"DROP TABLE {name}")
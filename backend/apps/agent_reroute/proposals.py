@@ -0,0 +1,314 @@
+"""
+Bulk ingestion of the route proposals n8n posts to store_all_proposals.
+
+The body is never loaded whole: iter_proposals() reads it in
+PROPOSAL_READ_BYTES pieces and yields the proposal items one at a time, so
+memory stays flat however many proposals are posted. Every item is
+validated on arrival: its shape, the shipment id and each value through the
+RouteProposal field it is stored in (types, UUIDs, integer ranges, decimal
+precision after rounding), so a bad item is reported by index instead of
+failing the batch. Valid items are upserted every PROPOSAL_CHUNK_SIZE
+proposals with INSERT ... ON CONFLICT statements (one per batch the
+database's parameter limit allows; a single one on PostgreSQL), all in one
+transaction that is rolled back if the body turns out not to be valid JSON.
+A shipment has at most one pending proposal (the
+one_pending_proposal_per_shipment partial unique constraint), so a repeated
+run refreshes the pending proposal instead of stacking duplicates; within
+one payload the last item for a shipment wins.
+"""
+import ast
+import codecs
+import json
+import re
+import uuid
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Any, Dict, IO, Iterable, Iterator, List, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .models import RouteProposal
+
+# Flat payload key -> RouteProposal field
+PAYLOAD_FIELDS = {
+    "route_id": "proposed_route_id",
+    "eta_minutes": "proposed_eta_minutes",
+    "toll_cost_usd": "proposed_toll_cost_usd",
+    "path": "proposed_path",
+    "p_delay": "proposed_p_delay",
+    "rationale": "rationale",
+}
+DEFAULT_RATIONALE = "Imported from n8n"
+_NUMBER_TAIL = re.compile(r"[0-9+\-.eE]*")
+
+# Columns written by the upsert, and the ones a conflicting pending proposal takes over
+INSERT_FIELDS = ("id", "shipment_id", "created_at", "updated_at", "action", "current_route_id",
+                 "current_eta_minutes", "current_toll_cost_usd", "current_path", "current_p_delay",
+                 "proposed_route_id", "proposed_eta_minutes", "proposed_toll_cost_usd", "proposed_path",
+                 "proposed_p_delay", "rationale", "requires_approval", "status")
+UPDATE_FIELDS = ("updated_at", "proposed_route_id", "proposed_eta_minutes", "proposed_toll_cost_usd",
+                 "proposed_path", "proposed_p_delay", "rationale")
+
+
+def parse_item(item):
+    """Items may arrive as JSON (or Python-literal) strings; returns the parsed value or raises ValueError."""
+    if not isinstance(item, str):
+        return item
+    try:
+        return json.loads(item)
+    except Exception:
+        try:
+            return ast.literal_eval(item)
+        except Exception:
+            raise ValueError("Proposal item is a string and could not be parsed")
+
+
+def _clean(field_name: str, value):
+    model_field = RouteProposal._meta.get_field(field_name)
+    value = model_field.to_python(value)
+    if value is None:
+        return None
+    if isinstance(model_field, models.DecimalField):
+        # stored rounded to the column's decimals, as save() would
+        value = value.quantize(Decimal(1).scaleb(-model_field.decimal_places))
+    model_field.run_validators(value)
+    return value
+
+
+def clean_proposal(item) -> Dict[str, Any]:
+    """RouteProposal field values for one payload item; raises ValueError with the reason."""
+    item = parse_item(item)
+    if not isinstance(item, dict):
+        raise ValueError("Proposal is not an object")
+    if not item.get("shipment_id"):
+        raise ValueError("Missing shipment_id")
+    values = {}
+    for key, name in (("shipment_id", "shipment_id"), *PAYLOAD_FIELDS.items()):
+        try:
+            values[name] = _clean(name, item.get(key))
+        except ValidationError as e:
+            raise ValueError(f"{key}: {'; '.join(e.messages)}")
+    if values["rationale"] is None:
+        values["rationale"] = DEFAULT_RATIONALE
+    return values
+
+
+def _row(values: Dict[str, Any], now) -> Dict[str, Any]:
+    return {
+        "id": uuid.uuid4(), "created_at": now, "updated_at": now, "action": "propose_switch",
+        # current is unknown for flat payloads
+        "current_route_id": None, "current_eta_minutes": None, "current_toll_cost_usd": None,
+        "current_path": None, "current_p_delay": None,
+        "requires_approval": True, "status": "pending", **values,
+    }
+
+
+def upsert_pending(rows: List[Dict[str, Any]]):
+    """INSERT ... ON CONFLICT (shipment_id) WHERE status = 'pending' DO UPDATE, in as few statements as allowed."""
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    fields = [RouteProposal._meta.get_field(name) for name in INSERT_FIELDS]
+    columns = ", ".join(qn(f.column) for f in fields)
+    updates = ", ".join(f"{qn(f.column)} = excluded.{qn(f.column)}" for f in fields if f.name in UPDATE_FIELDS)
+    row_sql = "(" + ", ".join(["%s"] * len(fields)) + ")"
+    batch_size = max(1, connection.ops.bulk_batch_size(fields, rows))
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f"INSERT INTO {qn(RouteProposal._meta.db_table)} ({columns}) VALUES {', '.join([row_sql] * len(batch))} "
+                f"ON CONFLICT ({qn('shipment_id')}) WHERE {qn('status')} = 'pending' DO UPDATE SET {updates}",
+                [f.get_db_prep_save(row[f.name], connection) for row in batch for f in fields],
+            )
+
+
+class PayloadError(ValueError):
+    """The body as a whole is unusable (not JSON, or not a proposal list)."""
+
+
+class _Reader:
+    """Text window over a byte stream; only the unread part of the last read is kept."""
+
+    def __init__(self, stream: IO[bytes], read_bytes: int):
+        self.stream = stream
+        self.read_bytes = read_bytes
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.decode = json.JSONDecoder().raw_decode
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        data = self.stream.read(self.read_bytes)
+        self.eof = not data
+        try:
+            self.buf = self.buf[self.pos:] + self.decoder.decode(data, final=self.eof)
+        except UnicodeDecodeError:
+            raise PayloadError("Invalid JSON")
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character ("" at the end of the body)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise PayloadError("Invalid JSON")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Incomplete or invalid: read on, but never hold more than Django would for a whole body
+                limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+                if limit is not None and len(self.buf) - self.pos > limit:
+                    raise PayloadError("Invalid JSON or a value larger than DATA_UPLOAD_MAX_MEMORY_SIZE")
+                if self.fill():
+                    continue
+                raise PayloadError("Invalid JSON")
+            # a number running to the end of the window ("2." of "2.5e3") may continue in the next read
+            if (isinstance(value, (int, float)) and _NUMBER_TAIL.match(self.buf, end).end() == len(self.buf)
+                    and self.fill()):
+                continue
+            self.pos = end
+            return value
+
+    def array(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+
+def _listed(proposals) -> List[Any]:
+    """A "proposals" value that is not a JSON array: n8n sometimes sends the list as a string."""
+    if isinstance(proposals, str):
+        try:
+            proposals = parse_item(proposals)
+        except ValueError:
+            raise PayloadError("'proposals' is a string and could not be parsed")
+    if not proposals:
+        return []
+    if not isinstance(proposals, list):
+        raise PayloadError("Expected { 'proposals': [...] } or an array")
+    return proposals
+
+
+def iter_proposals(stream: IO[bytes], read_bytes: int = None) -> Iterator[Any]:
+    """
+    Proposal items of a {"proposals": [...]} or [...] JSON body, read incrementally
+    from a file-like object (the request) read_bytes (PROPOSAL_READ_BYTES) at a time.
+    Raises PayloadError for an unusable body, possibly after items were yielded.
+    """
+    reader = _Reader(stream, max(1, read_bytes or settings.ROUTE_AI.get("PROPOSAL_READ_BYTES", 65536)))
+    char = reader.peek()
+    if char == "[":
+        yield from reader.array()
+    elif char == "{":
+        reader.pos += 1
+        empty = closed = reader.peek() == "}"
+        if empty:
+            reader.pos += 1
+        found = False
+        while not closed:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise PayloadError("Invalid JSON")
+            reader.expect(":")
+            if key == "proposals" and not found:
+                found = True
+                if reader.peek() == "[":
+                    yield from reader.array()
+                else:
+                    yield from _listed(reader.value())
+            else:
+                reader.value()
+            closed = reader.expect(",}") == "}"
+        if not (found or empty):
+            raise PayloadError("Expected { 'proposals': [...] } or an array")
+    else:
+        reader.value()   # invalid JSON is reported as such
+        raise PayloadError("Expected { 'proposals': [...] } or an array")
+    if reader.peek():
+        raise PayloadError("Invalid JSON")
+
+
+@dataclass
+class StoreResult:
+    stored: List[Dict[str, Any]] = field(default_factory=list)   # {"index", "id", "shipment_id", "created_at", "updated"}
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+    received: int = 0
+
+    @property
+    def created(self) -> int:
+        return sum(1 for p in self.stored if not p["updated"])
+
+
+def _flush(chunk: Dict[str, Tuple[int, Dict[str, Any]]], stored: Dict[str, Dict[str, Any]], now):
+    """Upsert one chunk (at most one item per shipment) and record what each item became."""
+    if not chunk:
+        return
+    upsert_pending([_row(values, now) for _, values in chunk.values()])
+    pending = RouteProposal.objects.filter(status="pending", shipment_id__in=list(chunk)).values_list(
+        "id", "shipment_id", "created_at")
+    for pk, shipment_id, created_at in pending:
+        sid = str(shipment_id)
+        stored[sid] = {"index": chunk[sid][0], "id": str(pk), "shipment_id": sid,
+                       "created_at": created_at.isoformat(), "updated": created_at != now}
+
+
+def store_proposals(items: Iterable, now=None, chunk_size: int = None) -> StoreResult:
+    """
+    Validate items as they arrive and upsert the valid ones every chunk_size
+    (PROPOSAL_CHUNK_SIZE) proposals, all in one transaction.
+    """
+    now = now or timezone.now()
+    chunk_size = max(1, chunk_size or settings.ROUTE_AI.get("PROPOSAL_CHUNK_SIZE", 500))
+    result = StoreResult()
+    chunk: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    stored: Dict[str, Dict[str, Any]] = {}   # by shipment, in payload order of the winning items
+    with transaction.atomic():
+        for idx, item in enumerate(items):
+            result.received += 1
+            try:
+                values = clean_proposal(item)
+            except ValueError as e:
+                error = {"index": idx, "error": str(e)}
+                shipment_id = item.get("shipment_id") if isinstance(item, dict) else None
+                if shipment_id:
+                    error = {"index": idx, "shipment_id": str(shipment_id), "error": str(e)}
+                result.errors.append(error)
+                continue
+            sid = str(values["shipment_id"])
+            earlier = chunk.pop(sid)[0] if sid in chunk else stored.pop(sid)["index"] if sid in stored else None
+            if earlier is not None:
+                result.errors.append({"index": earlier, "shipment_id": sid,
+                                      "error": f"Superseded by item {idx} for the same shipment"})
+            chunk[sid] = (idx, values)
+            if len(chunk) >= chunk_size:
+                _flush(chunk, stored, now)
+                chunk = {}
+        _flush(chunk, stored, now)
+    result.stored = sorted(stored.values(), key=lambda p: p["index"])
+    result.errors.sort(key=lambda e: e["index"])
+    return result
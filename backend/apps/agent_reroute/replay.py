@@ -0,0 +1,250 @@
+"""
+Offline replay of logged decisions under a candidate model and settings.
+
+Decisions are loaded as column arrays (from AgentDecision or from the
+Parquet files archive_decisions writes) and re-decided in bulk: one
+predict_proba call for the current routes and one for the recorded best
+alternatives per chunk, then the threshold gate and the scoring kernel as
+array operations. Nothing is written to the database.
+
+Only the best alternative a decision logged can be re-scored; shipments
+that were below the threshold when they were decided have none, so a lower
+candidate threshold cannot turn them into switches. They are counted as
+no_alternative in the summary.
+"""
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .ml import FEATURE_COLUMNS, predict_matrix
+from .scoring import OBJECTIVES, score_batch
+from .snapshots import FEATURE_SCHEMA_VERSION, FEATURE_SCHEMAS, feature_matrix
+
+# Per-option columns: the scoring objectives plus the distance used to re-derive alternative features
+OPTION_COLUMNS = OBJECTIVES + ("distance_km",)
+DISTANCE = OPTION_COLUMNS.index("distance_km")
+P_DELAY = OPTION_COLUMNS.index("p_delay")
+
+
+@dataclass
+class DecisionArrays:
+    ids: np.ndarray             # (n,) AgentDecision ids
+    shipment_ids: np.ndarray    # (n,) shipment ids as strings
+    X: np.ndarray               # (n, k) features in FEATURE_COLUMNS order
+    current: np.ndarray         # (n, 4) current route, OPTION_COLUMNS order
+    alt: np.ndarray             # (n, 4) logged best alternative, NaN rows where none
+    switched: np.ndarray        # (n,) bool: the logged action was propose_switch
+    current_score: np.ndarray   # (n,) logged score of the current route
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _option_array(options: Iterable[Optional[Dict[str, Any]]]) -> np.ndarray:
+    return np.array([[np.nan if (o or {}).get(k) is None else float(o[k]) for k in OPTION_COLUMNS]
+                     for o in options], dtype=float).reshape(-1, len(OPTION_COLUMNS))
+
+
+def iter_decision_arrays(queryset, chunk_size: int = 50000) -> Iterator[DecisionArrays]:
+    """AgentDecision rows in id order, chunk_size at a time (keyset pagination)."""
+    fields = ("id", "shipment_id", "feature_schema", "features", "input_snapshot", "output_decision")
+    last = None
+    while True:
+        page = queryset.order_by("id")
+        if last is not None:
+            page = page.filter(id__gt=last)
+        rows = list(page.values_list(*fields)[:chunk_size])
+        if not rows:
+            return
+        outputs = [r[5] or {} for r in rows]
+        yield DecisionArrays(
+            ids=np.array([r[0] for r in rows], dtype=np.int64),
+            shipment_ids=np.array([str(r[1]) for r in rows], dtype=object),
+            X=feature_matrix((r[2], r[3], r[4]) for r in rows).astype(float),
+            current=_option_array((r[4] or {}).get("current") for r in rows),
+            alt=_option_array(o.get("best_alt") for o in outputs),
+            switched=np.array([o.get("action") == "propose_switch" for o in outputs], dtype=bool),
+            current_score=np.array([np.nan if o.get("current_score") is None else o["current_score"]
+                                    for o in outputs], dtype=float),
+        )
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][0]
+
+
+def archive_files(paths: Iterable[str]) -> List[Path]:
+    """Parquet files named by `paths` (files, or directories of agent_decisions_*.parquet)."""
+    files = []
+    for p in map(Path, paths):
+        files.extend(sorted(p.glob("agent_decisions_*.parquet")) if p.is_dir() else [p])
+    return files
+
+
+def iter_archive_arrays(paths: Iterable[str], chunk_size: int = 50000) -> Iterator[DecisionArrays]:
+    """Decisions from archive_decisions Parquet files, column by column without per-row decoding."""
+    import pyarrow.parquet as pq
+    keys = FEATURE_SCHEMAS[FEATURE_SCHEMA_VERSION]
+    for path in archive_files(paths):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            df = batch.to_pandas()
+
+            def columns(names):
+                return np.column_stack([pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=float)
+                                        if c in df.columns else np.full(len(df), np.nan) for c in names])
+
+            yield DecisionArrays(
+                ids=df["id"].to_numpy(dtype=np.int64),
+                shipment_ids=df["shipment_id"].astype(str).to_numpy(dtype=object),
+                X=columns([f"feature_{k}" for k in keys]),
+                current=columns([f"current_{k}" for k in OPTION_COLUMNS]),
+                alt=columns([f"best_alt_{k}" for k in OPTION_COLUMNS]),
+                switched=(df["action"] == "propose_switch").to_numpy(dtype=bool),
+                current_score=columns(["current_score"])[:, 0],
+            )
+
+
+def alternative_features(X: np.ndarray, current: np.ndarray, alt: np.ndarray) -> np.ndarray:
+    """ml.route_feature_row for whole arrays: distance scales with the alternative's length."""
+    out = X.copy()
+    col = FEATURE_COLUMNS.index("haversine_km")
+    cur_km, alt_km = current[:, DISTANCE], alt[:, DISTANCE]
+    scale = (cur_km > 0) & (alt_km > 0)
+    out[scale, col] = X[scale, col] * alt_km[scale] / cur_km[scale]
+    return out
+
+
+@dataclass
+class ReplayResult:
+    ids: np.ndarray
+    switched: np.ndarray        # (n,) logged action was propose_switch
+    candidate: np.ndarray       # (n,) candidate action is propose_switch
+    p_delay: np.ndarray         # (n,) candidate p_delay of the current route
+    logged_p_delay: np.ndarray
+    current_score: np.ndarray   # (n,) candidate score of the current route
+    logged_score: np.ndarray
+    improvement: np.ndarray     # (n,) relative gain of the logged best alternative, -inf if none
+    high_risk: np.ndarray       # (n,) candidate p_delay >= threshold
+    has_alt: np.ndarray         # (n,)
+
+    def frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "id": self.ids,
+            "logged_action": np.where(self.switched, "propose_switch", "stick"),
+            "candidate_action": np.where(self.candidate, "propose_switch", "stick"),
+            "logged_p_delay": self.logged_p_delay,
+            "p_delay": self.p_delay,
+            "logged_score": self.logged_score,
+            "current_score": self.current_score,
+            "improvement": np.where(np.isfinite(self.improvement), self.improvement, np.nan),
+        })
+
+
+def has_alternative(arrays: DecisionArrays) -> np.ndarray:
+    return ~np.isnan(arrays.alt[:, :P_DELAY]).any(axis=1)
+
+
+def predict_options(arrays: DecisionArrays, model):
+    """(p_delay of the current routes, p_delay of the logged alternatives, NaN where none)."""
+    n = len(arrays)
+    has_alt = has_alternative(arrays)
+    p_current = predict_matrix(model, pd.DataFrame(arrays.X, columns=FEATURE_COLUMNS)) if n else np.zeros(0)
+    p_alt = np.full(n, np.nan)
+    if has_alt.any():
+        X_alt = alternative_features(arrays.X[has_alt], arrays.current[has_alt], arrays.alt[has_alt])
+        p_alt[has_alt] = predict_matrix(model, pd.DataFrame(X_alt, columns=FEATURE_COLUMNS))
+    return p_current, p_alt
+
+
+def replay(arrays: DecisionArrays, model, cfg: Dict[str, Any]) -> ReplayResult:
+    """Re-decide every logged decision with `model` and the ROUTE_AI-style `cfg`."""
+    has_alt = has_alternative(arrays)
+    p_current, p_alt = predict_options(arrays, model)
+
+    current = arrays.current[:, :len(OBJECTIVES)].copy()
+    current[:, P_DELAY] = p_current
+    alts = arrays.alt[:, None, :len(OBJECTIVES)].copy()
+    alts[:, 0, P_DELAY] = p_alt
+    alts[~has_alt] = np.nan
+    scored = score_batch(current, alts, cfg["SCORE_WEIGHTS"])
+
+    high_risk = p_current >= cfg["P_DELAY_THRESHOLD"]
+    candidate = high_risk & has_alt & (scored.improvement >= cfg["IMPROVEMENT_EPS"])
+    return ReplayResult(
+        ids=arrays.ids, switched=arrays.switched, candidate=candidate,
+        p_delay=p_current, logged_p_delay=arrays.current[:, P_DELAY],
+        current_score=scored.current_score, logged_score=arrays.current_score,
+        improvement=scored.improvement, high_risk=high_risk, has_alt=has_alt,
+    )
+
+
+@dataclass
+class ReplaySummary:
+    decisions: int = 0
+    logged_switches: int = 0
+    candidate_switches: int = 0
+    stick_to_switch: int = 0
+    switch_to_stick: int = 0
+    no_alternative: int = 0
+    seconds: float = 0.0
+    _p_delay_deltas: List[np.ndarray] = field(default_factory=list, repr=False)
+    _score_deltas: List[np.ndarray] = field(default_factory=list, repr=False)
+
+    def add(self, result: ReplayResult):
+        self.decisions += len(result.ids)
+        self.logged_switches += int(result.switched.sum())
+        self.candidate_switches += int(result.candidate.sum())
+        self.stick_to_switch += int((result.candidate & ~result.switched).sum())
+        self.switch_to_stick += int((result.switched & ~result.candidate).sum())
+        self.no_alternative += int((result.high_risk & ~result.has_alt).sum())
+        self._p_delay_deltas.append(result.p_delay - result.logged_p_delay)
+        self._score_deltas.append(result.current_score - result.logged_score)
+
+    @property
+    def flips(self) -> int:
+        return self.stick_to_switch + self.switch_to_stick
+
+    @property
+    def throughput(self) -> float:
+        return self.decisions / self.seconds if self.seconds > 0 else 0.0
+
+    @staticmethod
+    def _stats(chunks: List[np.ndarray]) -> Dict[str, Optional[float]]:
+        values = np.concatenate(chunks) if chunks else np.zeros(0)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return {"mean": None, "mean_abs": None, "p95_abs": None, "max_abs": None}
+        magnitude = np.abs(values)
+        return {"mean": float(values.mean()), "mean_abs": float(magnitude.mean()),
+                "p95_abs": float(np.percentile(magnitude, 95)), "max_abs": float(magnitude.max())}
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "decisions": self.decisions,
+            "logged_switches": self.logged_switches,
+            "candidate_switches": self.candidate_switches,
+            "flips": self.flips,
+            "stick_to_switch": self.stick_to_switch,
+            "switch_to_stick": self.switch_to_stick,
+            "no_alternative": self.no_alternative,
+            "p_delay_delta": self._stats(self._p_delay_deltas),
+            "score_delta": self._stats(self._score_deltas),
+            "seconds": round(self.seconds, 3),
+            "decisions_per_second": round(self.throughput, 1),
+        }
+
+
+def replay_all(chunks: Iterable[DecisionArrays], model, cfg: Dict[str, Any], on_result=None) -> ReplaySummary:
+    """Replay every chunk; on_result(ReplayResult) sees each chunk's per-decision results."""
+    summary = ReplaySummary()
+    started = time.perf_counter()
+    for arrays in chunks:
+        result = replay(arrays, model, cfg)
+        summary.add(result)
+        if on_result is not None:
+            on_result(result)
+    summary.seconds = time.perf_counter() - started
+    return summary
@@ -2,7 +2,8 @@ from abc import ABC, abstractmethod
 from typing import List, Dict, Any
 
 class RouteOption(dict):
-    """keys: route_id, eta_minutes, toll_cost_usd (opt), path (opt), p_delay (opt)"""
+    """keys: route_id, eta_minutes, toll_cost_usd (opt), path (opt), p_delay (opt),
+    distance_km (opt), segments (opt), weather (opt: corridor temp_c/wind_speed/humidity/precipitation/condition)"""
     pass
 
 class RoutingProvider(ABC):
@@ -10,3 +11,19 @@ class RoutingProvider(ABC):
     def get_current_option(self, shipment_id) -> RouteOption: ...
     @abstractmethod
     def get_alternatives(self, shipment_id, max_k: int) -> List[RouteOption]: ...
+
+    def get_current_options(self, shipments) -> List[RouteOption]:
+        """Current options for already-loaded shipments; providers may override to avoid per-shipment queries."""
+        return [self.get_current_option(s.id) for s in shipments]
+
+    def current_option_for(self, ctx) -> RouteOption:
+        """Current option from a loaded DecisionContext; override to avoid re-fetching the shipment."""
+        return self.get_current_option(ctx.shipment_id)
+
+    def alternatives_for(self, ctx, max_k: int) -> List[RouteOption]:
+        """Alternatives from a loaded DecisionContext; override to avoid re-fetching the shipment."""
+        return self.get_alternatives(ctx.shipment_id, max_k)
+
+    def fingerprint(self) -> str:
+        """Changes whenever the alternatives this provider returns may change; part of decision cache keys."""
+        return ""
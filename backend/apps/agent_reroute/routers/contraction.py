@@ -0,0 +1,256 @@
+"""
+Contraction hierarchy (CH) over the RoadGraph.
+
+Preprocessing (manage.py build_route_ch) orders nodes by edge difference,
+contracts them one by one and adds shortcuts where no witness path exists.
+The result is saved as a versioned .npz artifact (ROUTE_AI["CH_PATH"]) tagged
+with the fingerprint of the graph it was built from; a stale artifact is
+ignored and routing falls back to plain Dijkstra/Yen.
+
+Queries run a bidirectional Dijkstra over upward edges only. Alternatives use
+the via-node method: every node settled by both searches is a candidate
+s -> v -> t path, ordered by length.
+"""
+import heapq
+import logging
+import math
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .road_graph import RoadGraph
+
+logger = logging.getLogger(__name__)
+
+CH_FORMAT_VERSION = 1
+
+# Witness searches give up after settling this many nodes (adds a few extra shortcuts, never wrong)
+WITNESS_SETTLE_LIMIT = 60
+
+
+class ContractionHierarchy:
+    def __init__(self, rank, up: List[Dict[int, float]], middle: Dict[Tuple[int, int], int], graph_fingerprint: str):
+        self.rank = rank
+        self.up = up                  # node -> {higher-ranked neighbour: km}
+        self.middle = middle          # (min, max) -> contracted node of a shortcut
+        self.graph_fingerprint = graph_fingerprint
+
+    # -- preprocessing ------------------------------------------------------
+    @classmethod
+    def build(cls, graph: RoadGraph) -> "ContractionHierarchy":
+        n = len(graph)
+        adj = [dict(a) for a in graph.adj]
+        contracted = [False] * n
+        deleted_neighbours = [0] * n
+        middle: Dict[Tuple[int, int], int] = {}
+        up: List[Dict[int, float]] = [{} for _ in range(n)]
+        rank = np.zeros(n, dtype=np.int32)
+
+        def witness_distances(source, exclude, max_cost):
+            dist = {source: 0.0}
+            heap = [(0.0, source)]
+            settled = 0
+            while heap and settled < WITNESS_SETTLE_LIMIT:
+                d, u = heapq.heappop(heap)
+                if d > dist[u]:
+                    continue
+                if d > max_cost:
+                    break
+                settled += 1
+                for v, w in adj[u].items():
+                    if v == exclude or contracted[v]:
+                        continue
+                    nd = d + w
+                    if nd < dist.get(v, math.inf):
+                        dist[v] = nd
+                        heapq.heappush(heap, (nd, v))
+            return dist
+
+        def shortcuts_for(v):
+            neighbours = [u for u in adj[v] if not contracted[u]]
+            needed = []
+            for i, u in enumerate(neighbours):
+                targets = neighbours[i + 1:]
+                if not targets:
+                    continue
+                max_cost = adj[v][u] + max(adj[v][w] for w in targets)
+                dist = witness_distances(u, v, max_cost)
+                for w in targets:
+                    via = adj[v][u] + adj[v][w]
+                    if dist.get(w, math.inf) > via:
+                        needed.append((u, w, via))
+            return neighbours, needed
+
+        def priority(v):
+            neighbours, needed = shortcuts_for(v)
+            return len(needed) - len(neighbours) + deleted_neighbours[v]
+
+        heap = [(priority(v), v) for v in range(n)]
+        heapq.heapify(heap)
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            if contracted[v]:
+                continue
+            # Lazy update: re-evaluate and defer if no longer the cheapest
+            current = priority(v)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, v))
+                continue
+
+            neighbours, needed = shortcuts_for(v)
+            for u in neighbours:
+                up[v][u] = adj[v][u]
+                deleted_neighbours[u] += 1
+            for u, w, via in needed:
+                if via < adj[u].get(w, math.inf):
+                    adj[u][w] = adj[w][u] = via
+                    middle[(min(u, w), max(u, w))] = v
+            contracted[v] = True
+            rank[v] = order
+            order += 1
+
+        return cls(rank, up, middle, graph.fingerprint)
+
+    # -- persistence ----------------------------------------------------------
+    def save(self, path):
+        src, dst, weight, mid = [], [], [], []
+        for u, edges in enumerate(self.up):
+            for v, w in edges.items():
+                src.append(u)
+                dst.append(v)
+                weight.append(w)
+                mid.append(self.middle.get((min(u, v), max(u, v)), -1))
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp,
+            format_version=np.int32(CH_FORMAT_VERSION),
+            graph_fingerprint=np.array(self.graph_fingerprint),
+            rank=self.rank,
+            edge_src=np.array(src, dtype=np.int32),
+            edge_dst=np.array(dst, dtype=np.int32),
+            edge_km=np.array(weight, dtype=np.float64),
+            edge_mid=np.array(mid, dtype=np.int32),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path) -> "ContractionHierarchy":
+        with np.load(path) as data:
+            version = int(data["format_version"])
+            if version != CH_FORMAT_VERSION:
+                raise ValueError(f"CH artifact format v{version}, expected v{CH_FORMAT_VERSION}")
+            rank = data["rank"]
+            up: List[Dict[int, float]] = [{} for _ in range(len(rank))]
+            middle: Dict[Tuple[int, int], int] = {}
+            for u, v, w, m in zip(data["edge_src"].tolist(), data["edge_dst"].tolist(),
+                                  data["edge_km"].tolist(), data["edge_mid"].tolist()):
+                up[u][v] = w
+                if m >= 0:
+                    middle[(min(u, v), max(u, v))] = m
+            return cls(rank, up, middle, str(data["graph_fingerprint"]))
+
+    # -- queries --------------------------------------------------------------
+    def _upward_search(self, source) -> Tuple[Dict[int, float], Dict[int, int]]:
+        dist = {source: 0.0}
+        parent: Dict[int, int] = {}
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for v, w in self.up[u].items():
+                nd = d + w
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    parent[v] = u
+                    heapq.heappush(heap, (nd, v))
+        return dist, parent
+
+    def _unpack_edge(self, u, v, out: List[int]):
+        m = self.middle.get((min(u, v), max(u, v)))
+        if m is None:
+            out.append(v)
+        else:
+            self._unpack_edge(u, m, out)
+            self._unpack_edge(m, v, out)
+
+    def _unpack(self, chain: List[int]) -> List[int]:
+        path = [chain[0]]
+        for u, v in zip(chain, chain[1:]):
+            self._unpack_edge(u, v, path)
+        return path
+
+    @staticmethod
+    def _chain(parent, node) -> List[int]:
+        chain = [node]
+        while chain[-1] in parent:
+            chain.append(parent[chain[-1]])
+        return chain
+
+    def _via_path(self, fwd_parent, bwd_parent, via) -> List[int]:
+        up_chain = list(reversed(self._chain(fwd_parent, via)))   # s .. via
+        down_chain = self._chain(bwd_parent, via)                  # via .. t
+        return self._unpack(up_chain + down_chain[1:])
+
+    def shortest_path(self, src: int, dst: int) -> Optional[Tuple[float, List[int]]]:
+        return next(self.iter_via_paths(src, dst), None)
+
+    def iter_via_paths(self, src: int, dst: int) -> Iterator[Tuple[float, List[int]]]:
+        """
+        Loopless s -> v -> t paths through every meeting node v of the two
+        upward searches, in order of increasing length; the first is the
+        shortest path.
+        """
+        if src == dst:
+            return
+        fwd, fwd_parent = self._upward_search(src)
+        bwd, bwd_parent = self._upward_search(dst)
+        meeting = sorted((fwd[v] + bwd[v], v) for v in fwd.keys() & bwd.keys())
+        seen = set()
+        for km, via in meeting:
+            path = self._via_path(fwd_parent, bwd_parent, via)
+            key = tuple(path)
+            if key in seen or len(set(path)) != len(path):
+                continue
+            seen.add(key)
+            yield km, path
+
+
+_ch: Optional[ContractionHierarchy] = None
+_ch_mtime = None
+_ch_lock = threading.Lock()
+_stale_warned = set()
+
+
+def get_contraction_hierarchy(graph: RoadGraph) -> Optional[ContractionHierarchy]:
+    """
+    The CH artifact for `graph`, loaded once per process (reloaded when the
+    file changes), or None when there is no artifact or it was built from a
+    different graph.
+    """
+    global _ch, _ch_mtime
+    path = settings.ROUTE_AI.get("CH_PATH")
+    if not path or not os.path.exists(path):
+        return None
+    with _ch_lock:
+        mtime = os.path.getmtime(path)
+        if _ch is None or _ch_mtime != mtime:
+            try:
+                _ch = ContractionHierarchy.load(path)
+            except Exception as e:
+                logger.error(f"Failed to load contraction hierarchy: {e}")
+                _ch = None
+            _ch_mtime = mtime
+        ch = _ch
+    if ch is None:
+        return None
+    if ch.graph_fingerprint != graph.fingerprint:
+        if graph.fingerprint not in _stale_warned:
+            _stale_warned.add(graph.fingerprint)
+            logger.warning("Contraction hierarchy is stale (routes changed); run build_route_ch. Using Dijkstra.")
+        return None
+    return ch
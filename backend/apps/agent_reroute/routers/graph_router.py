@@ -1,60 +1,122 @@
+from itertools import islice
 from typing import Dict, List
-from apps.shipments.models import Shipment
-from apps.routes.models import Route, RouteSegment
-from .base import RoutingProvider, RouteOption
-import random
 import uuid
+from django.conf import settings
+from apps.routes.models import Route
+from apps.agent_reroute.context import DecisionContext
+from .base import RoutingProvider, RouteOption
+from .road_graph import RoadGraph, get_road_graph
+from .contraction import get_contraction_hierarchy
+
+# Namespace for deterministic alternative ids: the same path always gets the same route_id
+ALT_ROUTE_NAMESPACE = uuid.UUID("8f0e4a52-3b7e-4c55-9d43-6f7d2b1c9a10")
 
 class GraphRoutingProvider(RoutingProvider):
     """
-    Simplified routing provider that works with the current model structure.
-    This is a basic implementation that provides mock alternatives for testing.
+    Routing provider backed by the in-memory road graph built from stored
+    routes. Alternatives are loopless paths between the shipment's origin and
+    destination: via-node paths from the contraction hierarchy when a current
+    artifact exists, otherwise the k shortest paths (Yen).
     """
-    
+
+    def __init__(self, graph: RoadGraph = None):
+        self._graph = graph
+        self.cfg = settings.ROUTE_AI
+
+    @property
+    def graph(self) -> RoadGraph:
+        return self._graph if self._graph is not None else get_road_graph()
+
+    def fingerprint(self) -> str:
+        return self.graph.fingerprint
+
+    def _eta_minutes(self, km: float) -> float:
+        return km / self.cfg.get("AVG_SPEED_KMH", 50.0) * 60.0
+
+    def _toll(self, km: float) -> float:
+        return round(km * self.cfg.get("TOLL_USD_PER_KM", 0.03), 2)
+
     def get_current_option(self, shipment_id) -> RouteOption:
         """Get the current route option for a shipment"""
-        s = Shipment.objects.select_related("route").get(id=shipment_id)
-        r: Route = s.route
-        
-        # Calculate ETA from route segments if available
-        eta_minutes = 480  # Default 8 hours
-        toll_cost = 25.0   # Default toll cost
-        
-        # Try to get ETA from route segments
-        segments = r.segments.all().order_by('seq')
-        if segments.exists():
-            # Calculate total ETA from segments (simplified)
-            eta_minutes = len(segments) * 60  # 1 hour per segment as approximation
-        
-        # Create a simple path representation
-        path = [f"node_{i}" for i in range(len(segments) + 1)]
-        
+        return self.current_option_for(DecisionContext.load(shipment_id))
+
+    def get_current_options(self, shipments) -> List[RouteOption]:
+        """
+        Current route options for a batch of shipments.
+        Expects shipments loaded with prefetch_related("route__segments").
+        """
+        return [self.current_option_for(DecisionContext(s)) for s in shipments]
+
+    def current_option_for(self, ctx: DecisionContext) -> RouteOption:
+        r: Route = ctx.route
+        nodes = self.graph.route_nodes.get(str(r.id))
+        if nodes:
+            km = self.graph.path_km(nodes)
+            return RouteOption({
+                "route_id": str(r.id),
+                "eta_minutes": round(self._eta_minutes(km), 1),
+                "toll_cost_usd": self._toll(km),
+                "distance_km": round(km, 2),
+                "segments": len(nodes) - 1,
+                "path": self.graph.path_coordinates(nodes),
+            })
+
+        # Route geometry could not be parsed into the graph: fall back to defaults
+        segments = ctx.segments
+        eta_minutes = len(segments) * 60 if segments else 480
         return RouteOption({
-            "route_id": str(r.id), 
-            "eta_minutes": float(eta_minutes), 
-            "toll_cost_usd": toll_cost, 
-            "path": path
+            "route_id": str(r.id),
+            "eta_minutes": float(eta_minutes),
+            "toll_cost_usd": 25.0,
+            "path": [],
         })
 
+    def _candidate_paths(self, graph: RoadGraph, src: int, dst: int):
+        """Via-node paths from the contraction hierarchy when available, else Yen over the graph."""
+        ch = get_contraction_hierarchy(graph) if self.cfg.get("USE_CH", True) else None
+        if ch is not None:
+            return ch.iter_via_paths(src, dst)
+        return graph.iter_shortest_paths(src, dst)
+
     def get_alternatives(self, shipment_id, max_k: int) -> List[RouteOption]:
         """Get alternative route options for a shipment"""
-        s = Shipment.objects.select_related("route").get(id=shipment_id)
-        current = self.get_current_option(shipment_id)
-        
-        # Generate mock alternatives for testing
+        return self.alternatives_for(DecisionContext.load(shipment_id), max_k)
+
+    def alternatives_for(self, ctx: DecisionContext, max_k: int) -> List[RouteOption]:
+        s = ctx.shipment
+        graph = self.graph
+        max_snap = self.cfg.get("GRAPH_MAX_SNAP_KM", 25.0)
+        src = graph.nearest_node(s.origin.lat, s.origin.lng, max_snap)
+        dst = graph.nearest_node(s.destination.lat, s.destination.lng, max_snap)
+        if src is None or dst is None:
+            return []
+
+        # Alternatives must differ from the current route and from each other by
+        # at least GRAPH_MIN_DIVERSITY of their length, otherwise Yen returns
+        # near-copies that only detour through a junction node.
+        min_diversity = self.cfg.get("GRAPH_MIN_DIVERSITY", 0.2)
+        accepted = []
+        current = graph.route_nodes.get(str(s.route_id)) if s.route_id else None
+        if current:
+            accepted.append(graph.edge_set(current))
+
         alts: List[RouteOption] = []
-        
-        for i in range(max_k):
-            # Create alternative routes with slightly different ETAs and costs
-            alt_eta = current["eta_minutes"] + random.randint(-60, 120)  # ±1-2 hours
-            alt_toll = current["toll_cost_usd"] + random.randint(-10, 20)  # ±$10-20
-            alt_path = [f"alt_node_{j}" for j in range(len(current["path"]))]
-            
+        candidates = islice(self._candidate_paths(graph, src, dst), max_k * self.cfg.get("GRAPH_CANDIDATE_FACTOR", 10))
+        for km, path in candidates:
+            if km <= 0:
+                continue
+            if any(graph.shared_km(path, edges) > (1.0 - min_diversity) * km for edges in accepted):
+                continue
+            accepted.append(graph.edge_set(path))
+            coords = graph.path_coordinates(path)
             alts.append(RouteOption({
-                "route_id": str(uuid.uuid4()),  # Generate proper UUID
-                "eta_minutes": max(60, alt_eta),  # Minimum 1 hour
-                "toll_cost_usd": max(0, alt_toll),  # Minimum $0
-                "path": alt_path
+                "route_id": str(uuid.uuid5(ALT_ROUTE_NAMESPACE, repr(coords))),
+                "eta_minutes": round(self._eta_minutes(km), 1),
+                "toll_cost_usd": self._toll(km),
+                "distance_km": round(km, 2),
+                "segments": len(path) - 1,
+                "path": coords,
             }))
-        
+            if len(alts) >= max_k:
+                break
         return alts
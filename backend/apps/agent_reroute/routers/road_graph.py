@@ -0,0 +1,270 @@
+"""
+In-memory road graph built from stored Route / RouteSegment GeoJSON.
+
+Nodes are coordinates snapped to GRAPH_SNAP_DECIMALS, edges are weighted by
+haversine length (km). Nearby nodes of different routes are joined within
+GRAPH_JUNCTION_KM so routes that cross or touch can be combined into
+alternatives. The graph is built once per process and rebuilt when routes
+change (see signals.py) or when GRAPH_CACHE_TTL_SECONDS elapses, which picks
+up edits made by other processes. Shortest-path queries can be served from a
+precomputed contraction hierarchy (see contraction.py).
+"""
+import hashlib
+import heapq
+import json
+import math
+import threading
+import time
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from django.conf import settings
+
+EARTH_RADIUS_KM = 6371.0
+
+Path = List[int]
+
+
+def haversine_km(lat1, lng1, lat2, lng2) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def parse_coordinates(geometry) -> List[Tuple[float, float]]:
+    """
+    [(lng, lat), ...] from a GeoJSON LineString string or a bare JSON list of
+    [lng, lat] pairs (the form apply_proposal stores). Returns [] if unparseable.
+    """
+    try:
+        data = json.loads(geometry) if isinstance(geometry, str) else geometry
+    except (TypeError, ValueError):
+        return []
+    if isinstance(data, dict):
+        data = data.get("coordinates")
+    if not isinstance(data, list):
+        return []
+    coords = []
+    for pt in data:
+        try:
+            coords.append((float(pt[0]), float(pt[1])))
+        except (TypeError, ValueError, IndexError):
+            return []
+    return coords
+
+
+def _route_coordinates(route) -> List[Tuple[float, float]]:
+    coords = parse_coordinates(route.geometry)
+    if len(coords) >= 2:
+        return coords
+    # Fall back to stitching the (prefetched) segments together
+    stitched: List[Tuple[float, float]] = []
+    for seg in route.segments.all():
+        for pt in parse_coordinates(seg.geometry):
+            if not stitched or stitched[-1] != pt:
+                stitched.append(pt)
+    return stitched
+
+
+class RoadGraph:
+    def __init__(self, snap_decimals: int = 3):
+        self.snap_decimals = snap_decimals
+        self.coords: List[Tuple[float, float]] = []       # node -> (lng, lat)
+        self.adj: List[Dict[int, float]] = []             # node -> {neighbour: km}
+        self.route_nodes: Dict[str, Path] = {}            # route_id -> node sequence
+        self._index: Dict[Tuple[float, float], int] = {}
+        self._lat = np.empty(0)
+        self._lng = np.empty(0)
+        self.fingerprint = ""
+
+    # -- construction -------------------------------------------------------
+    def node_for(self, lng: float, lat: float) -> int:
+        key = (round(lng, self.snap_decimals), round(lat, self.snap_decimals))
+        node = self._index.get(key)
+        if node is None:
+            node = len(self.coords)
+            self._index[key] = node
+            self.coords.append(key)
+            self.adj.append({})
+        return node
+
+    def add_edge(self, u: int, v: int, km: Optional[float] = None):
+        if u == v:
+            return
+        if km is None:
+            (lng1, lat1), (lng2, lat2) = self.coords[u], self.coords[v]
+            km = haversine_km(lat1, lng1, lat2, lng2)
+        # Roads are two-way; keep the shortest of any parallel edges
+        if km < self.adj[u].get(v, math.inf):
+            self.adj[u][v] = km
+            self.adj[v][u] = km
+
+    def add_route(self, route_id: str, coords: Sequence[Tuple[float, float]]):
+        nodes: Path = []
+        for lng, lat in coords:
+            node = self.node_for(lng, lat)
+            if not nodes or nodes[-1] != node:
+                nodes.append(node)
+        for u, v in zip(nodes, nodes[1:]):
+            self.add_edge(u, v)
+        if len(nodes) >= 2:
+            self.route_nodes[str(route_id)] = nodes
+
+    def link_junctions(self, radius_km: float):
+        """Join nodes closer than radius_km that are not already adjacent."""
+        if radius_km <= 0 or not self.coords:
+            return
+        cell = radius_km / 111.0  # degrees of latitude per cell
+        grid: Dict[Tuple[int, int], List[int]] = {}
+        for node, (lng, lat) in enumerate(self.coords):
+            grid.setdefault((int(lat // cell), int(lng // cell)), []).append(node)
+        for (ci, cj), members in grid.items():
+            for di in (-1, 0, 1):
+                for dj in (-1, 0, 1):
+                    for v in grid.get((ci + di, cj + dj), ()):
+                        for u in members:
+                            if u < v and v not in self.adj[u]:
+                                (lng1, lat1), (lng2, lat2) = self.coords[u], self.coords[v]
+                                km = haversine_km(lat1, lng1, lat2, lng2)
+                                if km <= radius_km:
+                                    self.add_edge(u, v, km)
+
+    def finalize(self):
+        self._lng = np.array([c[0] for c in self.coords], dtype=float)
+        self._lat = np.array([c[1] for c in self.coords], dtype=float)
+        # Identifies this exact node numbering + edge set (CH artifacts are tied to it)
+        h = hashlib.sha1()
+        h.update(self._lng.tobytes())
+        h.update(self._lat.tobytes())
+        for u, edges in enumerate(self.adj):
+            for v in sorted(edges):
+                if u < v:
+                    h.update(f"{u}:{v}:{edges[v]:.6f};".encode())
+        self.fingerprint = h.hexdigest()
+
+    # -- queries ------------------------------------------------------------
+    def __len__(self):
+        return len(self.coords)
+
+    def nearest_node(self, lat: float, lng: float, max_km: Optional[float] = None) -> Optional[int]:
+        """Closest node, or None if the graph is empty or the node is further than max_km."""
+        if not len(self._lat):
+            return None
+        # Equirectangular distance is enough to pick the closest node
+        dx = np.radians(self._lng - lng) * math.cos(math.radians(lat))
+        dy = np.radians(self._lat - lat)
+        node = int(np.argmin(dx * dx + dy * dy))
+        if max_km is not None:
+            node_lng, node_lat = self.coords[node]
+            if haversine_km(lat, lng, node_lat, node_lng) > max_km:
+                return None
+        return node
+
+    def path_km(self, path: Path) -> float:
+        return sum(self.adj[u][v] for u, v in zip(path, path[1:]))
+
+    def path_coordinates(self, path: Path) -> List[List[float]]:
+        return [[self.coords[n][0], self.coords[n][1]] for n in path]
+
+    def shortest_path(self, src: int, dst: int, banned_nodes=frozenset(),
+                      banned_edges=frozenset()) -> Optional[Tuple[float, Path]]:
+        """Dijkstra; returns (km, node path) or None if unreachable."""
+        dist = {src: 0.0}
+        prev: Dict[int, int] = {}
+        heap = [(0.0, src)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u == dst:
+                break
+            if d > dist[u]:
+                continue
+            for v, w in self.adj[u].items():
+                if v in banned_nodes or (u, v) in banned_edges:
+                    continue
+                nd = d + w
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    prev[v] = u
+                    heapq.heappush(heap, (nd, v))
+        if dst not in dist:
+            return None
+        path = [dst]
+        while path[-1] != src:
+            path.append(prev[path[-1]])
+        path.reverse()
+        return dist[dst], path
+
+    def iter_shortest_paths(self, src: int, dst: int) -> Iterator[Tuple[float, Path]]:
+        """Yen's algorithm, lazily: loopless paths in order of increasing length."""
+        if src == dst:
+            return
+        first = self.shortest_path(src, dst)
+        if first is None:
+            return
+        found = [first]
+        seen = {tuple(first[1])}
+        candidates: List[Tuple[float, Path]] = []
+        yield first
+        while True:
+            _, last = found[-1]
+            for i in range(len(last) - 1):
+                spur, root = last[i], last[:i + 1]
+                banned_edges = {(p[i], p[i + 1]) for _, p in found if len(p) > i + 1 and p[:i + 1] == root}
+                spur_result = self.shortest_path(spur, dst, frozenset(root[:-1]), banned_edges)
+                if spur_result is None:
+                    continue
+                total = root[:-1] + spur_result[1]
+                key = tuple(total)
+                if key not in seen:
+                    seen.add(key)
+                    heapq.heappush(candidates, (self.path_km(root) + spur_result[0], total))
+            if not candidates:
+                return
+            found.append(heapq.heappop(candidates))
+            yield found[-1]
+
+    def k_shortest_paths(self, src: int, dst: int, k: int) -> List[Tuple[float, Path]]:
+        """Up to k loopless paths ordered by length."""
+        return list(islice(self.iter_shortest_paths(src, dst), max(k, 0)))
+
+    def shared_km(self, path: Path, edges: Set[frozenset]) -> float:
+        return sum(self.adj[u][v] for u, v in zip(path, path[1:]) if frozenset((u, v)) in edges)
+
+    @staticmethod
+    def edge_set(path: Path) -> Set[frozenset]:
+        return {frozenset((u, v)) for u, v in zip(path, path[1:])}
+
+
+def build_road_graph() -> RoadGraph:
+    from apps.routes.models import Route
+    cfg = settings.ROUTE_AI
+    graph = RoadGraph(cfg.get("GRAPH_SNAP_DECIMALS", 3))
+    # Deterministic order keeps node ids (and the CH artifact) stable between builds
+    for route in Route.objects.order_by("id").prefetch_related("segments"):
+        graph.add_route(str(route.id), _route_coordinates(route))
+    graph.link_junctions(cfg.get("GRAPH_JUNCTION_KM", 2.0))
+    graph.finalize()
+    return graph
+
+
+_graph: Optional[RoadGraph] = None
+_graph_built_at = 0.0
+_graph_lock = threading.Lock()
+
+
+def get_road_graph() -> RoadGraph:
+    global _graph, _graph_built_at
+    ttl = settings.ROUTE_AI.get("GRAPH_CACHE_TTL_SECONDS", 300)
+    with _graph_lock:
+        if _graph is None or time.monotonic() - _graph_built_at > ttl:
+            _graph = build_road_graph()
+            _graph_built_at = time.monotonic()
+        return _graph
+
+
+def invalidate_road_graph():
+    global _graph
+    with _graph_lock:
+        _graph = None
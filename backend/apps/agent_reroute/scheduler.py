@@ -0,0 +1,153 @@
+"""
+In-process scheduler for the periodic agent jobs (run_scheduler).
+
+Each job runs every `interval` seconds on a fixed grid of ticks, started a
+random fraction of SCHEDULER_JITTER x interval late so replicas and jobs do
+not fire in lockstep. Jobs run one at a time. When a run ends after one or
+more of the job's later ticks have passed (a long run, or other jobs
+running), those ticks are skipped rather than run back to back, and counted;
+a run longer than the job's interval also counts as an overrun. Counters and
+the last run of every job are kept in SchedulerJob rows; run times and start
+lag go to the latency metrics as "scheduler.<job>" and "scheduler.<job>.lag".
+
+Only one scheduler runs jobs at a time: the leader holds a session-level
+PostgreSQL advisory lock (SCHEDULER_LOCK_KEY) on its connection. The others
+stand by and take over when the leader's connection goes away. On other
+databases every scheduler leads.
+"""
+import math
+import random
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from .metrics import record_latency
+from .models import RouteProposal, SchedulerJob
+
+DEFAULT_INTERVALS = {"sweep": 300, "expire_proposals": 900, "retention": 86400}
+
+
+def expire_proposals(now=None) -> int:
+    """Mark proposals left pending for PROPOSAL_TTL_HOURS as expired; returns how many."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(hours=settings.ROUTE_AI.get("PROPOSAL_TTL_HOURS", 24))
+    return RouteProposal.objects.filter(status="pending", created_at__lt=cutoff).update(status="expired", updated_at=now)
+
+
+@dataclass
+class Job:
+    name: str
+    interval: float
+    run: Callable[[], object]
+    tick: float = 0.0       # current grid tick
+    next_run: float = 0.0   # tick plus jitter
+
+
+@dataclass
+class JobRun:
+    job: Job
+    lag: float              # seconds between next_run and the start
+    duration: float
+    skipped: int            # ticks that passed during the wait and the run
+    overrun: bool
+    error: Optional[str] = None
+
+
+class Scheduler:
+    def __init__(self, jobs: List[Job], jitter: float = 0.1, rng: Optional[random.Random] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.jobs = jobs
+        self.jitter = max(0.0, jitter)
+        self.rng = rng or random.Random()
+        self.clock = clock
+
+    def start(self, now: float):
+        """Every job's first tick is now (each with its own jitter)."""
+        for job in self.jobs:
+            self._schedule(job, now)
+
+    def _schedule(self, job: Job, tick: float):
+        job.tick = tick
+        job.next_run = tick + self.rng.uniform(0.0, self.jitter) * job.interval
+
+    def due(self, now: float) -> List[Job]:
+        return sorted((job for job in self.jobs if job.next_run <= now), key=lambda job: job.next_run)
+
+    def next_due(self) -> float:
+        return min(job.next_run for job in self.jobs)
+
+    def run(self, job: Job) -> JobRun:
+        started = self.clock()
+        error = None
+        try:
+            job.run()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finished = self.clock()
+        passed = int(math.floor((finished - job.tick) / job.interval))   # ticks after job.tick, up to now
+        duration = finished - started
+        result = JobRun(job, started - job.next_run, duration, passed, duration > job.interval, error)
+        self._schedule(job, job.tick + (passed + 1) * job.interval)
+        return result
+
+
+def record_run(result: JobRun, leader: str):
+    """Add a finished run to the job's SchedulerJob row and the latency metrics."""
+    job = result.job
+    record_latency(f"scheduler.{job.name}", result.duration * 1000.0)
+    record_latency(f"scheduler.{job.name}.lag", max(0.0, result.lag) * 1000.0)
+    SchedulerJob.objects.get_or_create(name=job.name, defaults={"interval_seconds": job.interval})
+    SchedulerJob.objects.filter(name=job.name).update(
+        interval_seconds=job.interval,
+        leader=leader,
+        last_started_at=timezone.now() - timedelta(seconds=result.duration),
+        last_duration_ms=result.duration * 1000.0,
+        last_error=result.error or "",
+        runs=F("runs") + 1,
+        failures=F("failures") + (1 if result.error else 0),
+        skipped_ticks=F("skipped_ticks") + result.skipped,
+        overruns=F("overruns") + (1 if result.overrun else 0),
+    )
+
+
+class AdvisoryLeader:
+    """Leadership through a session-level pg advisory lock on Django's connection."""
+
+    def __init__(self, key: Optional[int] = None):
+        self.key = key if key is not None else settings.ROUTE_AI.get("SCHEDULER_LOCK_KEY", 726354)
+        self.enabled = connection.vendor == "postgresql"
+
+    def acquire(self) -> bool:
+        if not self.enabled:
+            return True
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [self.key])
+            return bool(cursor.fetchone()[0])
+
+    def held(self) -> bool:
+        """Still leading? False once the connection (and with it the lock) was lost."""
+        if not self.enabled:
+            return True
+        if connection.connection is None:
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND granted "
+                "AND pid = pg_backend_pid() AND classid = %s::oid AND objid = %s::oid AND objsubid = 1)",
+                [self.key >> 32, self.key & 0xFFFFFFFF])
+            return bool(cursor.fetchone()[0])
+
+    def release(self):
+        if self.enabled and connection.connection is not None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock_all()")
+
+
+def job_intervals() -> Dict[str, float]:
+    return {**DEFAULT_INTERVALS, **settings.ROUTE_AI.get("SCHEDULER_INTERVALS", {})}
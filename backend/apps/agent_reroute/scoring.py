@@ -0,0 +1,87 @@
+"""
+Vectorized route scoring.
+
+Options are laid out as a (shipments x alternatives x objectives) float array
+with the objectives in OBJECTIVES order; shipments with fewer alternatives are
+padded with NaN rows. All objectives are costs (lower is better) and the score
+is the negated weighted sum used throughout the agent:
+
+    score = -(w_eta * eta_minutes + w_toll * toll_cost_usd + w_p * p_delay * 100)
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+OBJECTIVES = ("eta_minutes", "toll_cost_usd", "p_delay")
+
+
+def weight_vector(weights: Dict[str, float]) -> np.ndarray:
+    """SCORE_WEIGHTS as a vector in OBJECTIVES order (p_delay is scored in percent)."""
+    return np.array([weights["eta_minutes"], weights["toll_cost_usd"], weights["p_delay"] * 100.0], dtype=float)
+
+
+def objective_row(option: Dict[str, Any]) -> List[float]:
+    return [float(option["eta_minutes"]), float(option.get("toll_cost_usd", 0.0)), float(option.get("p_delay", 0.0))]
+
+
+def pack_options(option_lists: Sequence[Sequence[Dict[str, Any]]]) -> np.ndarray:
+    """(S, A_max, 3) objective array, NaN-padded, from per-shipment lists of option dicts."""
+    width = max((len(opts) for opts in option_lists), default=0)
+    out = np.full((len(option_lists), width, len(OBJECTIVES)), np.nan)
+    for i, opts in enumerate(option_lists):
+        if opts:
+            out[i, :len(opts)] = [objective_row(o) for o in opts]
+    return out
+
+
+def score(objectives: np.ndarray, weights: Dict[str, float]) -> np.ndarray:
+    """Scores over the last axis; padded (NaN) options score -inf."""
+    s = -(np.nan_to_num(objectives, nan=0.0) @ weight_vector(weights))
+    return np.where(np.isnan(objectives).any(axis=-1), -np.inf, s)
+
+
+def pareto_mask(alts: np.ndarray) -> np.ndarray:
+    """
+    (S, A) mask of non-dominated alternatives. b dominates a when it is no
+    worse on every objective and strictly better on at least one. Padded
+    options are never kept and never dominate.
+    """
+    valid = ~np.isnan(alts).any(axis=-1)
+    filled = np.where(valid[..., None], alts, np.inf)
+    # [s, a, b]: does alternative b dominate alternative a?
+    a, b = filled[:, :, None, :], filled[:, None, :, :]
+    dominated = ((b <= a).all(axis=-1) & (b < a).any(axis=-1) & valid[:, None, :]).any(axis=-1)
+    return valid & ~dominated
+
+
+@dataclass
+class ScoredBatch:
+    current_score: np.ndarray   # (S,)
+    best_index: np.ndarray      # (S,) index into each shipment's alternatives, -1 if none
+    best_score: np.ndarray      # (S,) -inf if no alternative
+    improvement: np.ndarray     # (S,) relative gain of the best alternative, -inf if none
+    pareto: np.ndarray          # (S, A) non-dominated mask
+
+
+def score_batch(current: np.ndarray, alts: np.ndarray, weights: Dict[str, float]) -> ScoredBatch:
+    """
+    Best non-dominated alternative per shipment.
+
+    current: (S, 3) objectives of each shipment's current route.
+    alts:    (S, A, 3) objectives of its alternatives (NaN-padded).
+    """
+    current_score = score(current, weights)
+    if alts.shape[1] == 0:
+        empty = np.full(len(current), -np.inf)
+        return ScoredBatch(current_score, np.full(len(current), -1), empty, empty.copy(),
+                           np.zeros(alts.shape[:2], dtype=bool))
+
+    pareto = pareto_mask(alts)
+    alt_scores = np.where(pareto, score(alts, weights), -np.inf)
+    best_index = alt_scores.argmax(axis=1)
+    best_score = alt_scores[np.arange(len(alts)), best_index]
+    has_alt = pareto.any(axis=1)
+    best_index = np.where(has_alt, best_index, -1)
+    improvement = np.where(has_alt, (best_score - current_score) / (np.abs(current_score) + 1e-6), -np.inf)
+    return ScoredBatch(current_score, best_index, best_score, improvement, pareto)
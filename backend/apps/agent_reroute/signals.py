@@ -0,0 +1,62 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from apps.alerts.models import Alert
+from apps.routes.models import Route, RouteSegment
+from apps.shipments.models import Shipment
+from apps.vehicles.models import VehiclePosition
+from .dirty import TRACKED_SHIPMENT_FIELDS, mark_dirty, mark_dirty_for_route, mark_dirty_for_vehicle
+from .routers.road_graph import invalidate_road_graph
+
+
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+@receiver(post_save, sender=RouteSegment)
+@receiver(post_delete, sender=RouteSegment)
+def routes_changed(sender, **kwargs):
+    invalidate_road_graph()
+
+
+@receiver(post_save, sender=Route)
+def route_saved(sender, instance, created, **kwargs):
+    if not created:
+        mark_dirty_for_route(instance.id)
+
+
+@receiver(post_save, sender=RouteSegment)
+@receiver(post_delete, sender=RouteSegment)
+def segment_changed(sender, instance, **kwargs):
+    mark_dirty_for_route(instance.route_id)
+
+
+def _tracked_state(instance):
+    # __dict__ lookups so deferred fields (.only()) are not fetched
+    return {f: instance.__dict__.get(f) for f in TRACKED_SHIPMENT_FIELDS if f in instance.__dict__}
+
+
+@receiver(post_init, sender=Shipment)
+def shipment_loaded(sender, instance, **kwargs):
+    instance._tracked_state = _tracked_state(instance)
+
+
+@receiver(post_save, sender=Shipment)
+def shipment_saved(sender, instance, created, **kwargs):
+    state = _tracked_state(instance)
+    if created:
+        mark_dirty([instance.id], "created")
+    else:
+        before = getattr(instance, "_tracked_state", {})
+        changed = [f.removesuffix("_id") for f, v in state.items() if f not in before or before[f] != v]
+        if changed:
+            mark_dirty([instance.id], ",".join(changed))
+    instance._tracked_state = state
+
+
+@receiver(post_save, sender=VehiclePosition)
+def position_recorded(sender, instance, **kwargs):
+    mark_dirty_for_vehicle(instance.vehicle_id)
+
+
+@receiver(post_save, sender=Alert)
+def alert_saved(sender, instance, created, **kwargs):
+    if created:
+        mark_dirty([instance.shipment_id], f"alert:{instance.type}")
@@ -0,0 +1,185 @@
+"""
+Monte Carlo fleet simulation of the rerouting policy.
+
+A FleetTemplate is built once from the shipment, location and route tables:
+every template shipment's current route and routing alternatives with their
+ETA, toll and model-predicted p_delay. Each trial is one synthetic fleet
+day: fleet_size shipments drawn from the template with replacement, with a
+day-level disruption shock shared by the whole fleet and a per-shipment
+shock, both applied to p_delay on the logit scale (alternatives of a
+shipment move with it). The RouteDecisionAgent policy is then applied (the
+P_DELAY_THRESHOLD gate and the scoring kernel with SCORE_WEIGHTS /
+IMPROVEMENT_EPS), proposals are approved with probability approval_rate,
+and each shipment's delay is drawn from the p_delay of the route it ends up
+on.
+
+Trials are vectorized (trials x fleet x alternatives arrays) in blocks of
+BLOCK_TRIALS with one seeded RNG stream per block, so results do not depend
+on how blocks are spread over worker processes. Every scenario uses the same
+streams (common random numbers), so differences between scenarios are not
+sampling noise.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .scoring import score_batch
+
+BLOCK_TRIALS = 250
+
+# Per-trial metrics returned by simulate_block, in this order
+METRICS = ("on_time_rate", "baseline_on_time_rate", "high_risk", "proposals", "notifications")
+
+
+@dataclass
+class FleetTemplate:
+    current: np.ndarray   # (S, 3) eta_minutes, toll_cost_usd, p_delay of each shipment's current route
+    alts: np.ndarray      # (S, A, 3) alternatives, NaN-padded
+
+    def __len__(self):
+        return len(self.current)
+
+
+@dataclass
+class Scenario:
+    threshold: float
+    improvement_eps: float
+    weights: Dict[str, float]
+    approval_rate: float = 1.0
+    fleet_size: Optional[int] = None      # default: the template size
+    day_sigma: float = 0.5                # std of the fleet-wide logit shock
+    shipment_sigma: float = 0.75          # std of the per-shipment logit shock
+
+    @classmethod
+    def from_settings(cls, cfg: Dict[str, Any], **overrides):
+        values = dict(threshold=cfg["P_DELAY_THRESHOLD"], improvement_eps=cfg["IMPROVEMENT_EPS"],
+                      weights=dict(cfg["SCORE_WEIGHTS"]))
+        values.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**values)
+
+
+def build_fleet_template(shipment_ids, agent=None) -> FleetTemplate:
+    """Current route and every alternative of each shipment, with model p_delay (two model calls)."""
+    from .context import DecisionContext
+    from .decision_maker import RouteDecisionAgent, _as_dict
+    from .ml import build_feature_matrix, predict_alternatives_many, predict_rows
+    from .scoring import pack_options
+
+    agent = agent or RouteDecisionAgent()
+    contexts = DecisionContext.load_many(shipment_ids)
+    shipments, currents, alternatives = [], [], []
+    for ctx in contexts.values():
+        if ctx.shipment.route_id is None:
+            continue
+        try:
+            currents.append(_as_dict(agent.routing.current_option_for(ctx)))
+            alternatives.append(agent._alternatives(ctx))
+        except Exception:
+            continue
+        shipments.append(ctx.shipment)
+    if not shipments:
+        return FleetTemplate(np.zeros((0, 3)), np.zeros((0, 0, 3)))
+
+    snaps, X = build_feature_matrix(shipments, currents)
+    for current, p in zip(currents, predict_rows(shipments, snaps, X)):
+        current["p_delay"] = p
+    alt_ps = predict_alternatives_many([(s, snap, c, alts) for s, snap, c, alts in
+                                        zip(shipments, snaps, currents, alternatives)])
+    for alts, ps in zip(alternatives, alt_ps):
+        for alt, p in zip(alts, ps):
+            alt["p_delay"] = p
+    return FleetTemplate(pack_options([[c] for c in currents])[:, 0], pack_options(alternatives))
+
+
+def _logit(p):
+    p = np.clip(p, 1e-6, 1 - 1e-6)
+    return np.log(p / (1 - p))
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def simulate_block(template: FleetTemplate, scenario: Scenario, trials: int, seed) -> np.ndarray:
+    """(trials, len(METRICS)) per-trial metrics for one RNG stream."""
+    rng = np.random.default_rng(seed)
+    fleet = scenario.fleet_size or len(template)
+    S, A = template.alts.shape[:2]
+    pick = rng.integers(0, len(template), size=(trials, fleet))
+    shock = rng.normal(0.0, scenario.day_sigma, size=(trials, 1)) + \
+        rng.normal(0.0, scenario.shipment_sigma, size=(trials, fleet))
+    approve_draw = rng.random((trials, fleet))
+    delay_draw = rng.random((trials, fleet))
+
+    current = template.current[pick].copy()                    # (T, F, 3)
+    current[..., 2] = _sigmoid(_logit(current[..., 2]) + shock)
+    alts = template.alts[pick].copy()                          # (T, F, A, 3)
+    alts[..., 2] = _sigmoid(_logit(alts[..., 2]) + shock[..., None])
+
+    high_risk = current[..., 2] >= scenario.threshold
+    scored = score_batch(current.reshape(-1, 3), alts.reshape(-1, A, 3), scenario.weights)
+    improvement = scored.improvement.reshape(trials, fleet)
+    proposed = high_risk & (improvement >= scenario.improvement_eps)
+    switched = proposed & (approve_draw < scenario.approval_rate)
+
+    best = np.clip(scored.best_index.reshape(trials, fleet), 0, max(A - 1, 0))
+    p_best = np.take_along_axis(alts[..., 2], best[..., None], axis=-1)[..., 0] if A else current[..., 2]
+    p_final = np.where(switched, p_best, current[..., 2])
+    # the same delay draw for both arms: a switch only changes the outcome through p_delay
+    on_time = delay_draw >= p_final
+    baseline_on_time = delay_draw >= current[..., 2]
+    return np.column_stack([on_time.mean(axis=1), baseline_on_time.mean(axis=1), high_risk.sum(axis=1),
+                            proposed.sum(axis=1), switched.sum(axis=1)]).astype(float)
+
+
+_template: Optional[FleetTemplate] = None
+
+
+def _init_worker(template: FleetTemplate):
+    global _template
+    _template = template
+
+
+def _simulate_task(scenario: Scenario, trials: int, seed) -> np.ndarray:
+    return simulate_block(_template, scenario, trials, seed)
+
+
+def _blocks(trials: int, seed: Optional[int]):
+    seeds = np.random.SeedSequence(seed).spawn(-(-trials // BLOCK_TRIALS))
+    return [(min(BLOCK_TRIALS, trials - i * BLOCK_TRIALS), s) for i, s in enumerate(seeds)]
+
+
+@dataclass
+class SimulationResult:
+    scenario: Scenario
+    trials: np.ndarray = field(repr=False)   # (trials, len(METRICS))
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for i, name in enumerate(METRICS):
+            values = self.trials[:, i]
+            out[name] = {"mean": float(values.mean()), "p5": float(np.percentile(values, 5)),
+                         "p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95))}
+        return out
+
+
+def simulate(template: FleetTemplate, scenarios: List[Scenario], trials: int, seed: Optional[int] = None,
+             workers: int = 1) -> List[SimulationResult]:
+    """Run `trials` fleet days per scenario; the same random streams are used for every scenario."""
+    if not len(template):
+        raise ValueError("The fleet template is empty")
+    blocks = _blocks(trials, seed)
+    tasks = [(scenario, n, s) for scenario in scenarios for n, s in blocks]
+    if workers <= 1 or len(tasks) < 2:
+        outputs = [simulate_block(template, scenario, n, s) for scenario, n, s in tasks]
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_init_worker, initargs=(template,)) as pool:
+            outputs = list(pool.map(_simulate_task, *zip(*tasks)))
+    per_scenario = len(blocks)
+    return [SimulationResult(scenario, np.vstack(outputs[i * per_scenario:(i + 1) * per_scenario]))
+            for i, scenario in enumerate(scenarios)]
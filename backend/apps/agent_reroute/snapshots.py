@@ -0,0 +1,162 @@
+"""
+Compact encoding of AgentDecision inputs.
+
+Features are stored as a little-endian float32 vector in AgentDecision.features
+with the feature-schema id in AgentDecision.feature_schema. The schema maps
+vector positions to snapshot keys. input_snapshot keeps only the current
+option without its path (the route row has it). The best alternative's path
+lives once per alternative in DecisionPath, keyed by its route_id.
+
+Rows written before this encoding (feature_schema is NULL) keep the verbose
+JSON. The decoder below handles both formats, so admin, replay and training
+code never read the columns directly.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .ml import FEATURE_COLUMNS, SNAPSHOT_KEYS
+
+# Append-only: a new feature set gets a new id, old ids stay decodable
+FEATURE_SCHEMAS: Dict[int, Tuple[str, ...]] = {
+    1: tuple(SNAPSHOT_KEYS),
+}
+FEATURE_SCHEMA_VERSION = 1
+
+FEATURE_DTYPE = np.dtype("<f4")
+
+# Option fields kept inline and the decimals they keep (the precision RouteProposal stores);
+# everything else (path, weather, ...) is dropped or referenced
+OPTION_KEYS = {"route_id": None, "eta_minutes": 2, "toll_cost_usd": 2, "distance_km": 2, "segments": None,
+               "p_delay": 4}
+
+
+def encode_features(snap: Dict[str, Any], schema: int = FEATURE_SCHEMA_VERSION) -> bytes:
+    return np.array([snap.get(k, np.nan) for k in FEATURE_SCHEMAS[schema]], dtype=FEATURE_DTYPE).tobytes()
+
+
+def decode_features(schema: Optional[int], blob, legacy_snapshot=None) -> Dict[str, float]:
+    if schema is None:
+        return dict((legacy_snapshot or {}).get("features") or {})
+    values = np.frombuffer(bytes(blob), dtype=FEATURE_DTYPE)
+    return {k: float(v) for k, v in zip(FEATURE_SCHEMAS[schema], values)}
+
+
+def compact_option(option: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not option:
+        return None
+    return {k: option[k] if places is None else round(float(option[k]), places)
+            for k, places in OPTION_KEYS.items() if option.get(k) is not None}
+
+
+def decision_paths(best: Optional[Dict[str, Any]]) -> Dict[str, list]:
+    """{route_id: path} to store by reference for a decision's best alternative."""
+    if best and best.get("route_id") and best.get("path"):
+        return {str(best["route_id"]): best["path"]}
+    return {}
+
+
+def store_paths(paths: Dict[str, list]):
+    from .models import DecisionPath
+    if paths:
+        DecisionPath.objects.bulk_create(
+            [DecisionPath(route_id=rid, coordinates=path) for rid, path in paths.items()],
+            ignore_conflicts=True,
+        )
+
+
+def resolve_paths(route_ids: Iterable) -> Dict[str, list]:
+    """Paths for route ids: stored alternatives first, then routes' own geometry."""
+    from apps.routes.models import Route
+    from .models import DecisionPath
+    from .routers.road_graph import parse_coordinates
+    ids = {str(r) for r in route_ids if r}
+    if not ids:
+        return {}
+    out = {str(p.route_id): p.coordinates for p in DecisionPath.objects.filter(route_id__in=ids)}
+    missing = ids - out.keys()
+    if missing:
+        for route in Route.objects.filter(id__in=missing).only("id", "geometry"):
+            out[str(route.id)] = [list(pt) for pt in parse_coordinates(route.geometry)]
+    return out
+
+
+def decode_decision(decision, paths: Optional[Dict[str, list]] = None) -> Dict[str, Any]:
+    """
+    The verbose form of one AgentDecision:
+    {"features": {...}, "current": {...}, "best_alt": {...} | None, "action",
+     "current_score", "best_alt_score", "rationale"}.
+    With `paths` (see resolve_paths) options get their "path" back.
+    """
+    snapshot = decision.input_snapshot or {}
+    output = dict(decision.output_decision or {})
+    current = dict(snapshot.get("current") or {})
+    best = dict(output.pop("best_alt", None) or {}) or None
+    if paths is not None:
+        for option in (current, best):
+            if option and "path" not in option and option.get("route_id"):
+                option["path"] = paths.get(str(option["route_id"]), [])
+    return {
+        "features": decode_features(decision.feature_schema, decision.features, snapshot),
+        "current": current,
+        "best_alt": best,
+        **output,
+    }
+
+
+def decode_decisions(decisions, include_paths: bool = False) -> List[Dict[str, Any]]:
+    """decode_decision for many rows, resolving every referenced path with two queries."""
+    decisions = list(decisions)
+    paths = None
+    if include_paths:
+        ids = []
+        for d in decisions:
+            ids.append(((d.input_snapshot or {}).get("current") or {}).get("route_id"))
+            ids.append(((d.output_decision or {}).get("best_alt") or {}).get("route_id"))
+        paths = resolve_paths(ids)
+    return [decode_decision(d, paths) for d in decisions]
+
+
+def feature_matrix(rows: Iterable[Tuple[Optional[int], Any, Any]],
+                   schema: int = FEATURE_SCHEMA_VERSION) -> np.ndarray:
+    """
+    (n, k) float32 matrix in FEATURE_SCHEMAS[schema] order from
+    (feature_schema, features, input_snapshot) tuples. Rows in `schema` are
+    decoded with one frombuffer over the concatenated vectors; other schemas
+    and legacy JSON rows are mapped by key (missing features are NaN).
+    """
+    keys = FEATURE_SCHEMAS[schema]
+    rows = list(rows)
+    out = np.full((len(rows), len(keys)), np.nan, dtype=FEATURE_DTYPE)
+    fast = [i for i, (s, _, _) in enumerate(rows) if s == schema]
+    if fast:
+        blob = b"".join(bytes(rows[i][1]) for i in fast)
+        out[fast] = np.frombuffer(blob, dtype=FEATURE_DTYPE).reshape(len(fast), len(keys))
+    for i, (s, blob, snapshot) in enumerate(rows):
+        if s != schema:
+            feats = decode_features(s, blob, snapshot)
+            out[i] = [feats.get(k, np.nan) for k in keys]
+    return out
+
+
+def load_training_frame(queryset) -> pd.DataFrame:
+    """
+    Logged decisions as a model-ready frame: FEATURE_COLUMNS plus id,
+    shipment_id, created_at, action and approved. Features come from the
+    packed vectors; only legacy rows need their JSON read.
+    """
+    rows = list(queryset.order_by("id").values_list(
+        "id", "shipment_id", "created_at", "approved", "feature_schema", "features", "output_decision__action"))
+    legacy_ids = [r[0] for r in rows if r[4] is None]
+    legacy = {}
+    if legacy_ids:
+        legacy = dict(queryset.model.objects.filter(id__in=legacy_ids).values_list("id", "input_snapshot"))
+    X = feature_matrix((r[4], r[5], legacy.get(r[0])) for r in rows)
+    frame = pd.DataFrame(X.astype(float), columns=FEATURE_COLUMNS)
+    frame.insert(0, "id", [r[0] for r in rows])
+    frame.insert(1, "shipment_id", [str(r[1]) for r in rows])
+    frame.insert(2, "created_at", [r[2] for r in rows])
+    frame["action"] = [r[6] for r in rows]
+    frame["approved"] = [r[3] for r in rows]
+    return frame
@@ -0,0 +1,60 @@
+"""
+Helpers shared by the offline commands (agent_eval_file, replay_decisions,
+tune_policy, archive_decisions): CSV / Parquet output and --since/--until
+parsing. pyarrow is optional and only needed for Parquet.
+"""
+from pathlib import Path
+
+from django.core.management.base import CommandError
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+def require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise CommandError("Parquet support needs pyarrow (pip install pyarrow)")
+    return pq
+
+
+def parse_when(value, name):
+    """A --since/--until option as a datetime or date (None when not given)."""
+    if value is None:
+        return None
+    parsed = parse_datetime(value) or parse_date(value)
+    if parsed is None:
+        raise CommandError(f"--{name} must be a date or datetime, got '{value}'")
+    return parsed
+
+
+class ChunkWriter:
+    """Append scored chunks to a CSV or Parquet file as they are produced"""
+
+    def __init__(self, path):
+        self.path = path
+        self.ext = Path(path).suffix.lower()
+        if self.ext not in (".csv", ".parquet", ".pq"):
+            raise CommandError(f"Unsupported output format '{self.ext}' (use .csv or .parquet)")
+        self._pq_writer = None
+        self._schema = None
+        self._first = True
+
+    def write(self, df):
+        if self.ext == ".csv":
+            df.to_csv(self.path, mode="w" if self._first else "a", header=self._first, index=False)
+        else:
+            import pyarrow as pa
+            pq = require_pyarrow()
+            if self._pq_writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self._schema = table.schema
+                self._pq_writer = pq.ParquetWriter(self.path, self._schema, compression="zstd")
+            else:
+                table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            self._pq_writer.write_table(table)
+        self._first = False
+
+    def close(self):
+        if self._pq_writer is not None:
+            self._pq_writer.close()
@@ -1,3 +1,1576 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from unittest import mock
+from io import StringIO
+from django.core.management import CommandError, call_command
+from asgiref.sync import async_to_sync
+from datetime import datetime, timedelta, timezone
+import asyncio
+import json
+import os
+import tempfile
+import uuid
+import pandas as pd
+import numpy as np
+from apps.geo.models import Location
+from apps.routes.models import Route, RouteSegment
+from apps.shipments.models import Shipment
+from apps.agent_reroute.models import (AgentDecision, DecisionPath, DirtyShipment, RouteProposal, SchedulerJob,
+                                       SweepLease)
+from apps.agent_reroute import dirty
+from apps.vehicles.models import Vehicle, VehiclePosition
+from apps.alerts.models import Alert
+from apps.agent_reroute.decision_maker import RouteDecisionAgent
+from apps.agent_reroute.context import DecisionContext
+from apps.agent_reroute.decision_log import DecisionLogWriter
+from apps.agent_reroute.partitions import add_months, month_start
+from apps.agent_reroute import admission, executors, leases, ml, notify, scheduler, scoring, metrics, replay, simulation, snapshots, tuning
+from apps.agent_reroute.decision_cache import DecisionCache, get_decision_cache
+from apps.agent_reroute.routers import road_graph
+from apps.agent_reroute.routers.road_graph import RoadGraph
+from apps.agent_reroute.routers.graph_router import GraphRoutingProvider
+from apps.agent_reroute.routers.contraction import ContractionHierarchy
+import random
+import threading
+import time
 
-# Create your tests here.
+
+class CountingModel:
+    """Stand-in for the joblib pipeline that records how often it is called"""
+
+    def __init__(self, p=0.1):
+        self.p = p
+        self.calls = 0
+
+    def predict_proba(self, X):
+        self.calls += 1
+        return np.column_stack([np.full(len(X), 1 - self.p), np.full(len(X), self.p)])
+
+
+class DistanceModel:
+    """p_delay grows with the (route-scaled) distance feature"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict_proba(self, X):
+        self.calls += 1
+        p = np.clip(X["haversine_km"].to_numpy(dtype=float) / 1500.0, 0.0, 1.0)
+        return np.column_stack([1 - p, p])
+
+
+class FleetFixture:
+    def setUp(self):
+        """Set up a small fleet on a single segmented route"""
+        get_decision_cache().clear()
+        self.origin = Location.objects.create(name="Pune", lat=18.75, lng=73.87)
+        self.destination = Location.objects.create(name="Chennai", lat=13.10, lng=80.19)
+        coords = [[73.87, 18.75], [75.0, 17.5], [77.0, 15.0], [79.0, 13.5], [80.19, 13.10]]
+        self.route = Route.objects.create(
+            name="Pune → Chennai",
+            geometry=json.dumps({"type": "LineString", "coordinates": coords}),
+        )
+        for seq in range(1, len(coords)):
+            RouteSegment.objects.create(
+                route=self.route, seq=seq,
+                geometry=json.dumps({"type": "LineString", "coordinates": coords[seq - 1:seq + 1]}),
+            )
+        self.shipments = [
+            Shipment.objects.create(
+                ref_no=f"TEST{i:03d}",
+                status="ENROUTE",
+                origin=self.origin,
+                destination=self.destination,
+                route=self.route,
+                scheduled_at=datetime.now(timezone.utc) + timedelta(hours=i),
+            )
+            for i in range(3)
+        ]
+
+        self.client = Client()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='tester', email='tester@example.com', password='pass1234')
+        self.client.login(username='tester', password='pass1234')
+
+
+@override_settings(ROUTE_AI={**settings.ROUTE_AI, "DECISION_LOG_ASYNC": False})
+class AgentRerouteTestCase(FleetFixture, TestCase):
+    pass
+
+
+class DecideManyTestCase(AgentRerouteTestCase):
+    def test_single_model_call_for_batch(self):
+        """The whole batch is scored with one predict_proba call"""
+        model = CountingModel(p=0.1)
+        with mock.patch.object(ml, "get_model", return_value=model):
+            results, errors = RouteDecisionAgent().decide_many([s.id for s in self.shipments])
+
+        self.assertEqual(model.calls, 1)
+        self.assertEqual(errors, {})
+        self.assertEqual([r.shipment_id for r in results], [str(s.id) for s in self.shipments])
+        self.assertTrue(all(r.action == "stick" for r in results))
+        self.assertEqual(AgentDecision.objects.count(), len(self.shipments))
+
+    def test_matches_single_decide(self):
+        """decide_many gives the same p_delay as decide for each shipment"""
+        model = CountingModel(p=0.2)
+        with mock.patch.object(ml, "get_model", return_value=model):
+            single = RouteDecisionAgent().decide(self.shipments[0].id)
+            get_decision_cache().clear()
+            results, _ = RouteDecisionAgent().decide_many([self.shipments[0].id])
+        self.assertEqual(single.current["p_delay"], results[0].current["p_delay"])
+        self.assertEqual(single.action, results[0].action)
+
+    def test_missing_shipment_reported(self):
+        """Unknown ids are reported per item instead of failing the batch"""
+        missing = uuid.uuid4()
+        with mock.patch.object(ml, "get_model", return_value=CountingModel()):
+            results, errors = RouteDecisionAgent().decide_many([self.shipments[0].id, missing])
+        self.assertEqual(len(results), 1)
+        self.assertIn(str(missing), errors)
+
+    def test_evaluate_batch_endpoint(self):
+        """POST /api/agentic/shipments/evaluate-batch/ evaluates every active shipment"""
+        with mock.patch.object(ml, "get_model", return_value=CountingModel()):
+            response = self.client.post(
+                '/api/agentic/shipments/evaluate-batch/', data="{}", content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data["count"], len(self.shipments))
+        self.assertEqual(data["errors"], [])
+
+    def test_evaluate_batch_rejects_bad_ids(self):
+        """Malformed ids are returned as errors"""
+        with mock.patch.object(ml, "get_model", return_value=CountingModel()):
+            response = self.client.post(
+                '/api/agentic/shipments/evaluate-batch/',
+                data=json.dumps({"shipment_ids": ["not-a-uuid", str(self.shipments[0].id)]}),
+                content_type="application/json",
+            )
+        data = json.loads(response.content)
+        self.assertEqual(data["count"], 1)
+        self.assertEqual(data["errors"][0]["shipment_id"], "not-a-uuid")
+
+
+class EvaluateShipmentsCommandTestCase(AgentRerouteTestCase):
+    def test_sweep_skips_inactive_and_logs_per_shipment(self):
+        """Sweep evaluates active shipments in chunks and reports throughput"""
+        Shipment.objects.filter(id=self.shipments[0].id).update(status="DELIVERED")
+        out = StringIO()
+        with mock.patch.object(ml, "get_model", return_value=CountingModel()):
+            call_command("evaluate_shipments", "--chunk-size", "1", stdout=out)
+
+        self.assertEqual(AgentDecision.objects.count(), 2)
+        self.assertFalse(AgentDecision.objects.filter(shipment_id=self.shipments[0].id).exists())
+        self.assertIn("Evaluated 2 shipments", out.getvalue())
+        self.assertIn("shipments/s", out.getvalue())
+
+
+class DirtyTrackingTestCase(AgentRerouteTestCase):
+    def _sweep(self, *args):
+        out = StringIO()
+        with mock.patch.object(ml, "get_model", return_value=CountingModel()):
+            call_command("evaluate_shipments", *args, stdout=out)
+        return out.getvalue()
+
+    def test_tracked_changes_mark_dirty(self):
+        DirtyShipment.objects.all().delete()
+        s = Shipment.objects.get(id=self.shipments[0].id)
+        s.carrier_name = "ACME"
+        s.save()
+        self.assertFalse(DirtyShipment.objects.exists())
+
+        s.status = "PLANNED"
+        s.current_location = self.destination
+        s.save()
+        self.assertEqual(DirtyShipment.objects.get(shipment_id=s.id).reason, "status,current_location")
+
+        vehicle = Vehicle.objects.create(plate_number="MH12AB1234")
+        Shipment.objects.filter(id=self.shipments[1].id).update(vehicle=vehicle)
+        VehiclePosition.objects.create(vehicle=vehicle, recorded_at=datetime.now(timezone.utc),
+                                       lat=17.0, lng=76.0, source="gps")
+        self.assertEqual(DirtyShipment.objects.get(shipment_id=self.shipments[1].id).reason, "position")
+
+        dirty.mark_dirty_for_locations([self.origin.id])
+        self.assertEqual(DirtyShipment.objects.count(), 3)
+        self.assertEqual(DirtyShipment.objects.get(shipment_id=self.shipments[2].id).reason, "weather")
+
+    def test_sweep_scales_with_changes(self):
+        """After a full sweep only changed shipments are re-evaluated"""
+        self.assertIn("Evaluated 3 shipments", self._sweep())
+        self.assertFalse(DirtyShipment.objects.exists())
+        self.assertIn("Evaluated 0 shipments", self._sweep())
+
+        s = Shipment.objects.get(id=self.shipments[1].id)
+        s.scheduled_at += timedelta(hours=6)
+        s.save()
+        self.assertIn("Evaluated 1 shipments", self._sweep())
+        self.assertIn("Evaluated 3 shipments", self._sweep("--all"))
+
+    def test_stale_decisions_are_swept(self):
+        self._sweep()
+        AgentDecision.objects.filter(shipment_id=self.shipments[0].id).update(
+            created_at=datetime.now(timezone.utc) - timedelta(hours=2))
+        with override_settings(ROUTE_AI={**settings.ROUTE_AI, "SWEEP_STALE_SECONDS": 3600}):
+            ids = list(dirty.sweep_shipments().values_list("id", flat=True))
+        self.assertEqual(ids, [self.shipments[0].id])
+
+    def test_marks_added_during_sweep_survive(self):
+        started_at = datetime.now(timezone.utc)
+        dirty.mark_dirty([self.shipments[0].id], "weather")
+        dirty.clear_dirty([self.shipments[0].id], started_at)
+        self.assertTrue(DirtyShipment.objects.filter(shipment_id=self.shipments[0].id).exists())
+
+    def test_batch_endpoint_defaults_to_changed_shipments(self):
+        with mock.patch.object(ml, "get_model", return_value=CountingModel()):
+            post = lambda body: json.loads(self.client.post(
+                '/api/agentic/shipments/evaluate-batch/', data=json.dumps(body), content_type="application/json").content)
+            self.assertEqual(post({})["count"], 3)
+            self.assertEqual(post({})["count"], 0)
+            self.assertEqual(post({"all": True})["count"], 3)
+
+
+class AgentEvalFileCommandTestCase(TestCase):
+    def test_scores_csv_in_chunks(self):
+        """Trips are scored chunk by chunk and appended to the output file"""
+        trips = pd.DataFrame({
+            "BookingID": [f"BK{i}" for i in range(5)],
+            "Org_lat_lon": ["13.1550,80.1960"] * 5,
+            "Dest_lat_lon": ["12.7400,77.8200"] * 5,
+            "trip_start_date": ["2020-08-17 14:59:01"] * 5,
+            "BookingID_Date": ["2020-08-16 14:59:01"] * 5,
+            "condition": ["Rain", "Clear", None, "Clouds", "Snow"],
+            "delay_hours": [1.0, 0.0, 3.0, None, 0.0],
+        })
+        model = CountingModel(p=0.5)
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = os.path.join(tmp, "trips.csv"), os.path.join(tmp, "scored.csv")
+            trips.to_csv(src, index=False)
+            with mock.patch("apps.agent_reroute.management.commands.agent_eval_file.get_model", return_value=model):
+                call_command("agent_eval_file", "--input", src, "--output", dst, "--chunk-size", "2", stdout=StringIO())
+            scored = pd.read_csv(dst)
+
+        self.assertEqual(model.calls, 3)
+        self.assertEqual(list(scored["BookingID"]), list(trips["BookingID"]))
+        self.assertEqual(list(scored["condition"]), [2, 0, 0, 1, 3])
+        self.assertEqual(list(scored["lead_time_hours"]), [24.0] * 5)
+        self.assertTrue((scored["flagged"] == 1).all())
+
+
+class RoadGraphTestCase(TestCase):
+    def setUp(self):
+        """Three corridors between (0, 0) and (0, 2): direct, north detour, far north detour"""
+        self.graph = RoadGraph(snap_decimals=3)
+        self.graph.add_route("direct", [(0.0, 0.0), (0.0, 1.0), (0.0, 2.0)])
+        self.graph.add_route("north", [(0.0, 0.0), (0.5, 1.0), (0.0, 2.0)])
+        self.graph.add_route("far", [(0.0, 0.0), (2.0, 1.0), (0.0, 2.0)])
+        self.graph.finalize()
+        self.src = self.graph.nearest_node(0.0, 0.0)
+        self.dst = self.graph.nearest_node(2.0, 0.0)
+
+    def test_k_shortest_paths_are_ordered_and_loopless(self):
+        paths = self.graph.k_shortest_paths(self.src, self.dst, 5)
+        self.assertEqual(len(paths), 3)
+        lengths = [km for km, _ in paths]
+        self.assertEqual(lengths, sorted(lengths))
+        self.assertEqual(paths[0][1], self.graph.route_nodes["direct"])
+        for _, path in paths:
+            self.assertEqual(len(path), len(set(path)))
+
+    def test_nearest_node_respects_max_distance(self):
+        self.assertIsNone(self.graph.nearest_node(10.0, 10.0, max_km=25))
+        self.assertEqual(self.graph.nearest_node(0.001, 0.001, max_km=25), self.src)
+
+
+class GraphRoutingProviderTestCase(AgentRerouteTestCase):
+    def setUp(self):
+        super().setUp()
+        road_graph.invalidate_road_graph()
+        coords = [[73.87, 18.75], [76.0, 19.5], [78.5, 16.0], [80.19, 13.10]]
+        self.detour = Route.objects.create(
+            name="Pune → Chennai (north)",
+            geometry=json.dumps({"type": "LineString", "coordinates": coords}),
+        )
+
+    def test_alternatives_exclude_current_route(self):
+        provider = GraphRoutingProvider()
+        current = provider.get_current_option(self.shipments[0].id)
+        alts = provider.get_alternatives(self.shipments[0].id, 3)
+
+        self.assertGreater(current["distance_km"], 0)
+        self.assertEqual(len(alts), 1)
+        self.assertEqual(alts[0]["path"][1], [76.0, 19.5])
+        self.assertGreater(alts[0]["eta_minutes"], current["eta_minutes"])
+        # Deterministic ids: re-evaluating yields the same alternative id
+        self.assertEqual(alts[0]["route_id"], provider.get_alternatives(self.shipments[0].id, 3)[0]["route_id"])
+
+    def test_graph_rebuilt_when_routes_change(self):
+        first = road_graph.get_road_graph()
+        self.assertIs(first, road_graph.get_road_graph())
+        self.detour.delete()
+        self.assertIsNot(first, road_graph.get_road_graph())
+        self.assertEqual(GraphRoutingProvider().get_alternatives(self.shipments[0].id, 3), [])
+
+
+class ContractionHierarchyTestCase(TestCase):
+    def setUp(self):
+        """A 6x6 grid with random weights and a few diagonals"""
+        rng = random.Random(7)
+        self.graph = RoadGraph(snap_decimals=3)
+        for i in range(6):
+            for j in range(6):
+                self.graph.node_for(float(i), float(j))
+        for i in range(6):
+            for j in range(6):
+                u = self.graph.node_for(float(i), float(j))
+                for di, dj in ((1, 0), (0, 1), (1, 1)):
+                    if i + di < 6 and j + dj < 6 and rng.random() < 0.8:
+                        self.graph.add_edge(u, self.graph.node_for(float(i + di), float(j + dj)), rng.uniform(1, 10))
+        self.graph.finalize()
+        self.ch = ContractionHierarchy.build(self.graph)
+
+    def test_queries_match_dijkstra(self):
+        n = len(self.graph)
+        for src in range(n):
+            for dst in range(n):
+                if src == dst:
+                    continue
+                expected = self.graph.shortest_path(src, dst)
+                got = self.ch.shortest_path(src, dst)
+                if expected is None:
+                    self.assertIsNone(got)
+                    continue
+                self.assertAlmostEqual(got[0], expected[0])
+                self.assertEqual(got[1][0], src)
+                self.assertEqual(got[1][-1], dst)
+                self.assertAlmostEqual(self.graph.path_km(got[1]), expected[0])
+
+    def test_round_trip_and_staleness(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "route_ch.npz")
+            self.ch.save(path)
+            loaded = ContractionHierarchy.load(path)
+            self.assertEqual(loaded.graph_fingerprint, self.graph.fingerprint)
+            self.assertEqual(loaded.shortest_path(0, len(self.graph) - 1), self.ch.shortest_path(0, len(self.graph) - 1))
+
+            with override_settings(ROUTE_AI={**settings.ROUTE_AI, "CH_PATH": path}):
+                from apps.agent_reroute.routers.contraction import get_contraction_hierarchy
+                self.assertIsNotNone(get_contraction_hierarchy(self.graph))
+                self.graph.add_edge(0, len(self.graph) - 1, 1.0)
+                self.graph.finalize()
+                self.assertIsNone(get_contraction_hierarchy(self.graph))
+
+    def test_via_paths_are_ordered_and_loopless(self):
+        paths = list(self.ch.iter_via_paths(0, len(self.graph) - 1))
+        self.assertGreater(len(paths), 1)
+        lengths = [km for km, _ in paths]
+        self.assertEqual(lengths, sorted(lengths))
+        for km, path in paths:
+            self.assertEqual(len(path), len(set(path)))
+            self.assertAlmostEqual(self.graph.path_km(path), km)
+
+
+class PerAlternativePredictionTestCase(AgentRerouteTestCase):
+    def setUp(self):
+        super().setUp()
+        road_graph.invalidate_road_graph()
+        # Two detours of different length between the same endpoints
+        for name, via in (("north", [[76.0, 19.5], [78.5, 16.0]]), ("far north", [[76.0, 21.5], [79.5, 17.0]])):
+            coords = [[73.87, 18.75]] + via + [[80.19, 13.10]]
+            Route.objects.create(name=name, geometry=json.dumps({"type": "LineString", "coordinates": coords}))
+
+    def test_alternatives_scored_in_one_call(self):
+        """Current + every alternative cost two model calls no matter how many alternatives"""
+        model = DistanceModel()
+        with mock.patch.object(ml, "get_model", return_value=model), \
+                override_settings(ROUTE_AI={**settings.ROUTE_AI, "MAX_ALTERNATIVES": 20, "P_DELAY_THRESHOLD": 0.1}):
+            agent = RouteDecisionAgent()
+            result = agent.decide(self.shipments[0].id)
+            alts = agent._alternatives(DecisionContext.load(self.shipments[0].id))
+        self.assertEqual(model.calls, 2)
+        self.assertEqual(len(alts), 2)
+        self.assertEqual(result.action, "stick")
+        self.assertIn("improvement", result.rationale)
+
+    def test_longer_alternatives_get_higher_p_delay(self):
+        snap = {k: 0 for k in ml.SNAPSHOT_KEYS}
+        snap["haversine_km"] = 800.0
+        current = {"distance_km": 1000.0}
+        _, short_row = ml.route_feature_row(snap, current, {"distance_km": 900.0})
+        _, long_row = ml.route_feature_row(snap, current, {"distance_km": 1500.0, "weather": {"condition": "Rain"}})
+        columns = ml.FEATURE_COLUMNS
+        self.assertAlmostEqual(short_row[columns.index("haversine_km")], 720.0)
+        self.assertAlmostEqual(long_row[columns.index("haversine_km")], 1200.0)
+        self.assertEqual(long_row[columns.index("condition")], 2)
+
+    def test_batch_scores_all_alternatives_together(self):
+        model = DistanceModel()
+        with mock.patch.object(ml, "get_model", return_value=model), \
+                override_settings(ROUTE_AI={**settings.ROUTE_AI, "P_DELAY_THRESHOLD": 0.1}):
+            results, errors = RouteDecisionAgent().decide_many([s.id for s in self.shipments])
+        self.assertEqual(errors, {})
+        self.assertEqual(len(results), 3)
+        self.assertEqual(model.calls, 2)
+
+
+class ScoringKernelTestCase(TestCase):
+    weights = {"eta_minutes": 1.0, "toll_cost_usd": 0.2, "p_delay": 2.0}
+
+    def _scalar_score(self, row):
+        eta, toll, p = row
+        return -(self.weights["eta_minutes"] * eta + self.weights["toll_cost_usd"] * toll
+                 + self.weights["p_delay"] * p * 100.0)
+
+    def test_pareto_mask_matches_pairwise_check(self):
+        rng = np.random.default_rng(7)
+        # Integer grid so ties and exact domination both occur
+        alts = rng.integers(0, 4, size=(20, 8, 3)).astype(float)
+        alts[3, 5:] = np.nan
+        mask = scoring.pareto_mask(alts)
+        for s in range(alts.shape[0]):
+            for a in range(alts.shape[1]):
+                if np.isnan(alts[s, a]).any():
+                    self.assertFalse(mask[s, a])
+                    continue
+                dominated = any(
+                    not np.isnan(alts[s, b]).any()
+                    and (alts[s, b] <= alts[s, a]).all() and (alts[s, b] < alts[s, a]).any()
+                    for b in range(alts.shape[1])
+                )
+                self.assertEqual(mask[s, a], not dominated)
+
+    def test_best_matches_scalar_loop(self):
+        rng = np.random.default_rng(11)
+        current = np.column_stack([rng.uniform(300, 900, 50), rng.uniform(0, 40, 50), rng.uniform(0, 1, 50)])
+        alts = np.stack([rng.uniform(300, 900, (50, 6)), rng.uniform(0, 40, (50, 6)), rng.uniform(0, 1, (50, 6))], axis=-1)
+        alts[0] = np.nan          # no alternatives at all
+        alts[1, 2:] = np.nan      # fewer alternatives than the widest shipment
+        scored = scoring.score_batch(current, alts, self.weights)
+
+        self.assertEqual(scored.best_index[0], -1)
+        self.assertEqual(scored.improvement[0], -np.inf)
+        for s in range(1, 50):
+            rows = [r for r in alts[s] if not np.isnan(r).any()]
+            scores = [self._scalar_score(r) for r in rows]
+            cur = self._scalar_score(current[s])
+            self.assertEqual(scored.best_index[s], int(np.argmax(scores)))
+            self.assertAlmostEqual(scored.best_score[s], max(scores))
+            self.assertAlmostEqual(scored.current_score[s], cur)
+            self.assertAlmostEqual(scored.improvement[s], (max(scores) - cur) / (abs(cur) + 1e-6))
+
+    def test_pack_options_pads_ragged_lists(self):
+        packed = scoring.pack_options([
+            [{"eta_minutes": 10, "toll_cost_usd": 1.0, "p_delay": 0.5}],
+            [],
+            [{"eta_minutes": 20, "p_delay": 0.1}, {"eta_minutes": 30, "toll_cost_usd": 2.0, "p_delay": 0.2}],
+        ])
+        self.assertEqual(packed.shape, (3, 2, 3))
+        self.assertTrue(np.isnan(packed[1]).all())
+        self.assertEqual(packed[2, 0].tolist(), [20.0, 0.0, 0.1])
+
+
+class DecisionCacheTestCase(AgentRerouteTestCase):
+    def test_unchanged_shipment_is_served_from_cache(self):
+        """Second evaluation costs no model call and writes no AgentDecision"""
+        model = CountingModel(p=0.1)
+        with mock.patch.object(ml, "get_model", return_value=model):
+            first = RouteDecisionAgent().decide(self.shipments[0].id)
+            second = RouteDecisionAgent().decide(self.shipments[0].id)
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        self.assertEqual(second.rationale, first.rationale)
+        self.assertEqual(model.calls, 1)
+        self.assertEqual(AgentDecision.objects.count(), 1)
+
+    def test_changed_inputs_miss(self):
+        model = CountingModel(p=0.1)
+        with mock.patch.object(ml, "get_model", return_value=model):
+            RouteDecisionAgent().decide(self.shipments[0].id)
+            Shipment.objects.filter(id=self.shipments[0].id).update(status="PLANNED")
+            RouteDecisionAgent().decide(self.shipments[0].id)
+            with override_settings(ROUTE_AI={**settings.ROUTE_AI, "P_DELAY_THRESHOLD": 0.05}):
+                RouteDecisionAgent().decide(self.shipments[0].id)
+            with mock.patch("apps.agent_reroute.decision_maker.model_version", return_value="retrained"):
+                RouteDecisionAgent().decide(self.shipments[0].id)
+        self.assertEqual(AgentDecision.objects.count(), 4)
+
+    def test_batch_only_scores_misses(self):
+        model = CountingModel(p=0.1)
+        with mock.patch.object(ml, "get_model", return_value=model):
+            RouteDecisionAgent().decide(self.shipments[0].id)
+            results, errors = RouteDecisionAgent().decide_many([s.id for s in self.shipments])
+            self.assertEqual([r.cached for r in results], [True, False, False])
+            results, errors = RouteDecisionAgent().decide_many([s.id for s in self.shipments])
+        self.assertTrue(all(r.cached for r in results))
+        self.assertEqual(model.calls, 2)
+        self.assertEqual(AgentDecision.objects.count(), 3)
+
+    def test_endpoint_reports_cache_hit(self):
+        with mock.patch.object(ml, "get_model", return_value=CountingModel()):
+            url = f'/api/agentic/shipments/{self.shipments[0].id}/evaluate/'
+            self.assertFalse(json.loads(self.client.post(url).content)["cached"])
+            self.assertTrue(json.loads(self.client.post(url).content)["cached"])
+
+    def test_lru_and_ttl_bounds(self):
+        cache = DecisionCache(maxsize=2, ttl_seconds=60)
+        cache.put("a", "fa", 1)
+        cache.put("b", "fb", 2)
+        self.assertEqual(cache.get("a", "fa"), 1)   # refreshes a
+        cache.put("c", "fc", 3)                     # evicts b
+        self.assertIsNone(cache.get("b", "fb"))
+        self.assertIsNone(cache.get("a", "other"))  # fingerprint mismatch drops the entry
+        self.assertEqual(len(cache), 1)
+
+        expired = DecisionCache(maxsize=2, ttl_seconds=0)
+        expired.put("a", "fa", 1)
+        self.assertIsNone(expired.get("a", "fa"))
+
+
+class LatencyMetricsTestCase(AgentRerouteTestCase):
+    stages = {"fetch", "current_option", "features", "cache", "predict", "log", "total"}
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset_latency()
+
+    def test_decide_records_every_stage(self):
+        with mock.patch.object(ml, "get_model", return_value=CountingModel(p=0.9)):
+            agent = RouteDecisionAgent()
+            agent.decide(self.shipments[0].id)
+        self.assertTrue(self.stages | {"alternatives", "predict_alternatives", "score"} <= set(agent.timings.ms))
+        snapshot = metrics.latency_snapshot()
+        self.assertEqual(snapshot["decide.total"]["count"], 1)
+        self.assertLessEqual(snapshot["decide.predict"]["p50_ms"], snapshot["decide.total"]["p99_ms"])
+
+    def test_percentiles_over_rolling_window(self):
+        with override_settings(ROUTE_AI={**settings.ROUTE_AI, "LATENCY_WINDOW": 100}):
+            for ms in range(1, 201):
+                metrics.record_latency("decide.predict", float(ms))
+        stats = metrics.latency_snapshot()["decide.predict"]
+        self.assertEqual((stats["count"], stats["window"]), (200, 100))
+        self.assertAlmostEqual(stats["p50_ms"], 150.5)
+        self.assertAlmostEqual(stats["p99_ms"], 199.01)
+        self.assertEqual(stats["max_ms"], 200.0)
+
+    def test_debug_flag_attaches_timings(self):
+        with mock.patch.object(ml, "get_model", return_value=CountingModel()):
+            url = f'/api/agentic/shipments/{self.shipments[0].id}/evaluate/'
+            self.assertNotIn("timings_ms", json.loads(self.client.post(url).content))
+            get_decision_cache().clear()
+            data = json.loads(self.client.post(url + "?debug=1").content)
+            batch = json.loads(self.client.post('/api/agentic/shipments/evaluate-batch/?debug=1',
+                                                data="{}", content_type="application/json").content)
+        self.assertTrue(self.stages <= set(data["timings_ms"]))
+        self.assertIn("total", batch["timings_ms"])
+
+    def test_latency_endpoint_is_staff_only(self):
+        with mock.patch.object(ml, "get_model", return_value=CountingModel()):
+            RouteDecisionAgent().decide(self.shipments[0].id)
+        self.assertEqual(self.client.get('/api/agentic/metrics/latency/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        data = json.loads(self.client.get('/api/agentic/metrics/latency/').content)
+        self.assertIn("decide.total", data["stages"])
+
+
+class QueryBudgetTestCase(AgentRerouteTestCase):
+    """A decision costs a fixed number of queries however many alternatives exist"""
+
+    def setUp(self):
+        super().setUp()
+        road_graph.invalidate_road_graph()
+        for i in range(4):
+            coords = [[73.87, 18.75], [76.0, 19.5 + i], [78.5, 16.0 + i], [80.19, 13.10]]
+            Route.objects.create(name=f"detour {i}", geometry=json.dumps({"type": "LineString", "coordinates": coords}))
+        road_graph.get_road_graph()   # built once per process, not per decision
+        self.high_risk = override_settings(ROUTE_AI={**settings.ROUTE_AI, "P_DELAY_THRESHOLD": 0.1, "USE_CH": False})
+        self.high_risk.enable()
+        self.addCleanup(self.high_risk.disable)
+        get_decision_cache().clear()
+
+    def test_decide_budget(self):
+        for k in (1, 5):
+            get_decision_cache().clear()
+            with override_settings(ROUTE_AI={**settings.ROUTE_AI, "MAX_ALTERNATIVES": k}), \
+                    mock.patch.object(ml, "get_model", return_value=CountingModel(p=0.9)):
+                # shipment (+ route, origin, destination, vehicle), the best alternative's path
+                # and the AgentDecision insert
+                with self.assertNumQueries(3):
+                    result = RouteDecisionAgent().decide(self.shipments[0].id)
+            self.assertNotEqual(result.rationale, "High risk but no alternatives; stay.")
+
+    def test_decide_many_budget(self):
+        ids = [s.id for s in self.shipments]
+        with mock.patch.object(ml, "get_model", return_value=CountingModel(p=0.9)):
+            # shipments, prefetched segments, one bulk path insert, one bulk decision insert
+            with self.assertNumQueries(4):
+                results, errors = RouteDecisionAgent().decide_many(ids)
+        self.assertEqual((len(results), errors), (3, {}))
+
+    def test_unparsed_route_loads_segments_once(self):
+        Route.objects.filter(id=self.route.id).update(geometry="")
+        RouteSegment.objects.filter(route=self.route).update(geometry="")
+        road_graph.invalidate_road_graph()
+        road_graph.get_road_graph()
+        ctx = DecisionContext.load(self.shipments[0].id)
+        provider = GraphRoutingProvider()
+        with self.assertNumQueries(1):
+            option = provider.current_option_for(ctx)
+            provider.current_option_for(ctx)
+        self.assertEqual(option["eta_minutes"], 4 * 60)
+
+
+class DetourTestCase(AgentRerouteTestCase):
+    def setUp(self):
+        super().setUp()
+        road_graph.invalidate_road_graph()
+        # Shipments ride a long detour, so the direct route is a better alternative
+        corners = [[73.87, 18.75], [76.0, 21.5], [79.5, 17.0], [80.19, 13.10]]
+        coords = [[round(a[0] + (b[0] - a[0]) * t / 50, 5), round(a[1] + (b[1] - a[1]) * t / 50, 5)]
+                  for a, b in zip(corners, corners[1:]) for t in range(50)] + [corners[-1]]
+        detour = Route.objects.create(name="far north", geometry=json.dumps({"type": "LineString", "coordinates": coords}))
+        Shipment.objects.update(route=detour)
+
+    def _decide(self, ids, **cfg):
+        with mock.patch.object(ml, "get_model", return_value=DistanceModel()), \
+                override_settings(ROUTE_AI={**settings.ROUTE_AI, "P_DELAY_THRESHOLD": 0.1, **cfg}):
+            results, _ = RouteDecisionAgent().decide_many(ids)
+        return results
+
+
+class SnapshotEncodingTestCase(DetourTestCase):
+
+    def test_round_trip(self):
+        snap = {k: float(i) + 0.5 for i, k in enumerate(ml.SNAPSHOT_KEYS)}
+        blob = snapshots.encode_features(snap)
+        self.assertEqual(len(blob), 4 * len(ml.SNAPSHOT_KEYS))
+        self.assertEqual(snapshots.decode_features(snapshots.FEATURE_SCHEMA_VERSION, blob), snap)
+
+    def test_decisions_are_compact_and_decode_to_verbose_form(self):
+        result = self._decide([self.shipments[0].id])[0]
+        row = AgentDecision.objects.get()
+        self.assertEqual(row.feature_schema, snapshots.FEATURE_SCHEMA_VERSION)
+        self.assertNotIn("path", row.output_decision["best_alt"])
+        self.assertNotIn("features", row.input_snapshot)
+
+        decoded = snapshots.decode_decisions(AgentDecision.objects.all(), include_paths=True)[0]
+        self.assertEqual(decoded["action"], result.action)
+        self.assertEqual(decoded["best_alt"]["path"], result.best_alt["path"])
+        # the current path comes back from the route's own geometry
+        self.assertEqual(len(decoded["current"]["path"]), len(result.current["path"]))
+        snap, _ = ml.build_features_from_shipment(self.shipments[0], result.current)
+        self.assertAlmostEqual(decoded["features"]["haversine_km"], snap["haversine_km"], places=3)
+
+        verbose = json.dumps({"features": decoded["features"], "current": result.current,
+                              "best_alt": result.best_alt})
+        compact = len(bytes(row.features)) + len(json.dumps(row.input_snapshot)) + \
+            len(json.dumps(row.output_decision["best_alt"]))
+        self.assertLess(compact * 5, len(verbose))
+
+    def test_paths_stored_once(self):
+        self._decide([s.id for s in self.shipments])
+        get_decision_cache().clear()
+        self._decide([s.id for s in self.shipments])
+        proposed = set(AgentDecision.objects.values_list("output_decision__best_alt__route_id", flat=True))
+        self.assertEqual(DecisionPath.objects.count(), len(proposed))
+
+    def test_feature_matrix_mixes_packed_and_legacy_rows(self):
+        self._decide([s.id for s in self.shipments])
+        AgentDecision.objects.create(shipment_id=self.shipments[0].id,
+                                     input_snapshot={"features": {"haversine_km": 5.0}},
+                                     output_decision={"action": "stick"})
+        frame = snapshots.load_training_frame(AgentDecision.objects.all())
+        self.assertEqual(list(frame.columns[3:-2]), ml.FEATURE_COLUMNS)
+        self.assertEqual(len(frame), 4)
+        self.assertEqual(frame["haversine_km"].iloc[-1], 5.0)
+        self.assertTrue(np.isnan(frame["temp_c"].iloc[-1]))
+        self.assertFalse(frame[ml.FEATURE_COLUMNS].iloc[:3].isna().any().any())
+        self.assertEqual(frame["action"].iloc[-1], "stick")
+
+
+class ReplayTestCase(DetourTestCase):
+    def setUp(self):
+        super().setUp()
+        self._decide([s.id for s in self.shipments])
+        self.cfg = {**settings.ROUTE_AI, "P_DELAY_THRESHOLD": 0.1}
+
+    def test_same_model_and_settings_reproduce_decisions(self):
+        self.assertTrue(AgentDecision.objects.filter(output_decision__action="propose_switch").exists())
+        with self.assertNumQueries(2):   # a full page and the short page that ends it
+            summary = replay.replay_all(replay.iter_decision_arrays(AgentDecision.objects.all(), 2),
+                                        DistanceModel(), self.cfg)
+        self.assertEqual((summary.decisions, summary.flips), (3, 0))
+        self.assertEqual(summary.candidate_switches, summary.logged_switches)
+        self.assertLess(summary.as_dict()["p_delay_delta"]["max_abs"], 1e-4)
+
+    def test_stricter_settings_flip_switches(self):
+        cfg = {**self.cfg, "IMPROVEMENT_EPS": 10.0}
+        summary = replay.replay_all(replay.iter_decision_arrays(AgentDecision.objects.all()), DistanceModel(), cfg)
+        self.assertEqual(summary.candidate_switches, 0)
+        self.assertEqual(summary.switch_to_stick, summary.logged_switches)
+
+    def test_sticks_with_logged_alternatives_can_flip(self):
+        AgentDecision.objects.all().delete()
+        get_decision_cache().clear()
+        self._decide([s.id for s in self.shipments], IMPROVEMENT_EPS=10.0)
+        self.assertFalse(AgentDecision.objects.filter(proposed_route_id__isnull=False).exists())
+        summary = replay.replay_all(replay.iter_decision_arrays(AgentDecision.objects.all()), DistanceModel(), self.cfg)
+        self.assertEqual(summary.stick_to_switch, 3)
+
+    def test_archive_replay_matches_database(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        from apps.agent_reroute.management.commands.archive_decisions import archive_schema, flatten_decisions
+        rows = list(AgentDecision.objects.order_by("id").values(
+            "id", "created_at", "shipment_id", "current_route_id", "proposed_route_id",
+            "input_snapshot", "output_decision", "approved", "feature_schema", "features"))
+        from_db = replay.replay_all(replay.iter_decision_arrays(AgentDecision.objects.all()), DistanceModel(), self.cfg)
+        with tempfile.TemporaryDirectory() as tmp:
+            pq.write_table(pa.Table.from_pylist(flatten_decisions(rows), schema=archive_schema()),
+                           os.path.join(tmp, "agent_decisions_2025_01.parquet"))
+            from_archive = replay.replay_all(replay.iter_archive_arrays([tmp]), DistanceModel(), self.cfg)
+        for key in ("decisions", "logged_switches", "candidate_switches", "flips"):
+            self.assertEqual(getattr(from_archive, key), getattr(from_db, key))
+
+    def test_command_reports_flips(self):
+        out = StringIO()
+        with mock.patch.object(ml, "get_model", return_value=DistanceModel()), \
+                tempfile.TemporaryDirectory() as tmp:
+            call_command("replay_decisions", "--set", "P_DELAY_THRESHOLD=0.99",
+                         "--output", os.path.join(tmp, "flips.csv"), "--flips-only", stdout=out)
+            flips = pd.read_csv(os.path.join(tmp, "flips.csv"))
+        switches = AgentDecision.objects.filter(output_decision__action="propose_switch").count()
+        self.assertEqual(len(flips), switches)
+        self.assertTrue((flips["candidate_action"] == "stick").all())
+        self.assertIn(f"Flips: {switches} (0 stick→switch, {switches} switch→stick)", out.getvalue())
+        self.assertEqual(AgentDecision.objects.count(), 3)
+
+
+class PolicyTuningTestCase(DetourTestCase):
+    def setUp(self):
+        super().setUp()
+        self._decide([s.id for s in self.shipments])
+        # the first shipment was delivered 10 hours after its logged ETA
+        current = AgentDecision.objects.filter(shipment_id=self.shipments[0].id).get().input_snapshot["current"]
+        delivered = self.shipments[0].scheduled_at + timedelta(minutes=current["eta_minutes"] + 600)
+        Shipment.objects.filter(id=self.shipments[0].id).update(status="DELIVERED", delivered_at=delivered)
+        chunks = list(replay.iter_decision_arrays(AgentDecision.objects.all()))
+        outcomes = {str(self.shipments[0].id): {"scheduled_at": self.shipments[0].scheduled_at,
+                                                "delivered_at": delivered}}
+        self.history = tuning.build_history(chunks, DistanceModel(), outcomes)
+        self.chunks = chunks
+
+    def _candidate(self, threshold=0.1, eps=None, weights=None):
+        w = weights or settings.ROUTE_AI["SCORE_WEIGHTS"]
+        eps = settings.ROUTE_AI["IMPROVEMENT_EPS"] if eps is None else eps
+        return [threshold, eps, w["eta_minutes"], w["toll_cost_usd"], w["p_delay"]]
+
+    def test_matches_replay_for_the_same_policy(self):
+        cfg = {**settings.ROUTE_AI, "P_DELAY_THRESHOLD": 0.1}
+        replayed = replay.replay_all(self.chunks, DistanceModel(), cfg)
+        switches, _ = tuning.evaluate_candidates(self.history, np.array([self._candidate()]))
+        self.assertEqual(int(switches[0]), replayed.candidate_switches)
+
+    def test_avoided_delay_counts_first_switch_per_shipment(self):
+        get_decision_cache().clear()
+        self._decide([self.shipments[0].id])   # a second decision for the delivered shipment
+        chunks = list(replay.iter_decision_arrays(AgentDecision.objects.all()))
+        outcomes = {str(self.shipments[0].id): {"scheduled_at": self.shipments[0].scheduled_at,
+                                                "delivered_at": Shipment.objects.get(id=self.shipments[0].id).delivered_at}}
+        history = tuning.build_history(chunks, DistanceModel(), outcomes)
+        switches, avoided = tuning.evaluate_candidates(history, np.array([self._candidate(), self._candidate(0.999)]))
+        self.assertEqual(switches.tolist(), [AgentDecision.objects.count(), 0])
+        delivered = history.group[np.flatnonzero(history.gain)[0]]
+        self.assertEqual((history.group == delivered).sum(), 2)
+        self.assertAlmostEqual(avoided[0], history.gain[history.group_start[delivered]])
+        self.assertGreater(avoided[0], 0)
+        self.assertEqual(avoided[1], 0)
+
+    def test_pareto_front(self):
+        rate = np.array([0.1, 0.2, 0.2, 0.3, 0.05])
+        avoided = np.array([5.0, 9.0, 7.0, 8.0, 5.0])
+        self.assertEqual(tuning.pareto_front(rate, avoided).tolist(), [False, True, False, False, True])
+
+    def test_pool_matches_inline(self):
+        candidates = tuning.grid_candidates([0.1, 0.5, 0.95], [0.0, 0.05, 0.5], [0.6], [0.1], [0.1, 0.3])
+        inline = tuning.search(self.history, candidates)
+        pooled = tuning.search(self.history, candidates, workers=2)
+        pd.testing.assert_frame_equal(inline, pooled)
+        self.assertEqual(len(inline), 18)
+
+    def test_blocks_follow_the_memory_budget(self):
+        candidates = tuning.grid_candidates([0.1, 0.5, 0.95], [0.0, 0.05, 0.5], [0.6], [0.1], [0.1, 0.3])
+        whole = tuning.evaluate_candidates(self.history, candidates)
+        one_at_a_time = tuning.evaluate_candidates(self.history, candidates, cells=1)
+        np.testing.assert_array_equal(whole[0], one_at_a_time[0])
+        np.testing.assert_allclose(whole[1], one_at_a_time[1])
+        with override_settings(ROUTE_AI={**settings.ROUTE_AI, "TUNING_BLOCK_MB": 64}):
+            self.assertEqual(tuning.block_cells(), 64 * 2 ** 20 // tuning.BYTES_PER_CELL)
+
+    def test_command_prints_pareto_table(self):
+        out = StringIO()
+        with mock.patch.object(ml, "get_model", return_value=DistanceModel()), \
+                tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "candidates.csv")
+            call_command("tune_policy", "--thresholds", "0.1,0.9", "--eps", "0.05", "--output", path, stdout=out)
+            table = pd.read_csv(path)
+        self.assertEqual(len(table), 10)
+        self.assertIn("3 decisions, 1 delivered shipment(s)", out.getvalue())
+        self.assertIn("switch_rate", out.getvalue())
+        self.assertTrue(table["pareto"].any())
+
+
+class FleetSimulationTestCase(DetourTestCase):
+    def setUp(self):
+        super().setUp()
+        with mock.patch.object(ml, "get_model", return_value=DistanceModel()):
+            self.template = simulation.build_fleet_template([s.id for s in self.shipments])
+
+    def _scenario(self, **overrides):
+        return simulation.Scenario.from_settings(settings.ROUTE_AI, **{"threshold": 0.1, "fleet_size": 50, **overrides})
+
+    def test_template_has_predicted_alternatives(self):
+        self.assertEqual(len(self.template), 3)
+        self.assertGreater(self.template.alts.shape[1], 0)
+        self.assertFalse(np.isnan(self.template.current).any())
+        # the direct route is shorter than the detour, so DistanceModel rates it safer
+        self.assertLess(np.nanmin(self.template.alts[0, :, 2]), self.template.current[0, 2])
+
+    def test_seeded_runs_repeat_across_worker_counts(self):
+        scenario = self._scenario()
+        trials = simulation.BLOCK_TRIALS + 10   # two blocks
+        inline = simulation.simulate(self.template, [scenario], trials, seed=7)[0]
+        again = simulation.simulate(self.template, [scenario], trials, seed=7)[0]
+        pooled = simulation.simulate(self.template, [scenario], trials, seed=7, workers=2)[0]
+        self.assertEqual(inline.trials.shape, (trials, len(simulation.METRICS)))
+        np.testing.assert_array_equal(inline.trials, again.trials)
+        np.testing.assert_array_equal(inline.trials, pooled.trials)
+
+    def test_policy_changes_outcomes_only_through_switches(self):
+        never, always, unapproved = simulation.simulate(
+            self.template, [self._scenario(threshold=1.01), self._scenario(), self._scenario(approval_rate=0.0)],
+            500, seed=3)
+        col = {name: i for i, name in enumerate(simulation.METRICS)}
+        for result in (never, unapproved):
+            np.testing.assert_array_equal(result.trials[:, col["on_time_rate"]],
+                                          result.trials[:, col["baseline_on_time_rate"]])
+            self.assertEqual(result.trials[:, col["notifications"]].sum(), 0)
+        self.assertEqual(never.trials[:, col["proposals"]].sum(), 0)
+        self.assertGreater(unapproved.trials[:, col["proposals"]].sum(), 0)
+        np.testing.assert_array_equal(always.trials[:, col["proposals"]],
+                                      always.trials[:, col["notifications"]])
+        self.assertGreater(always.summary()["on_time_rate"]["mean"], always.summary()["baseline_on_time_rate"]["mean"])
+
+    def test_command_sweeps_thresholds(self):
+        out = StringIO()
+        with mock.patch.object(ml, "get_model", return_value=DistanceModel()):
+            call_command("simulate_fleet", "--trials", "50", "--seed", "1", "--thresholds", "0.1,1.01",
+                         "--json", stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual([r["threshold"] for r in report], [0.1, 1.01])
+        self.assertEqual(report[1]["proposals"]["mean"], 0.0)
+        self.assertEqual(AgentDecision.objects.count(), 0)
+
+
+@override_settings(ROUTE_AI={**settings.ROUTE_AI, "DECISION_LOG_ASYNC": False, "SWEEP_SHARDS": 4,
+                             "SWEEP_LEASE_SECONDS": 60, "SWEEP_INTERVAL_SECONDS": 300})
+class ShardLeaseTestCase(AgentRerouteTestCase):
+    def setUp(self):
+        super().setUp()
+        leases.ensure_shards(4)
+        self.now = datetime(2025, 1, 1, 12, 1, tzinfo=timezone.utc)
+
+    def test_shards_partition_the_fleet(self):
+        ids = [uuid.uuid4() for _ in range(2000)]
+        counts = np.bincount([leases.shard_of(i, 4) for i in ids], minlength=4)
+        self.assertTrue((counts > 400).all())
+        parts = [set(leases.filter_shard(Shipment.objects.all(), k, 4).values_list("id", flat=True)) for k in range(4)]
+        self.assertEqual(set().union(*parts), {s.id for s in self.shipments})
+        self.assertEqual(sum(len(p) for p in parts), len(self.shipments))
+
+    def test_claims_are_exclusive_and_once_per_round(self):
+        a, b = leases.ShardLeaser(owner="a"), leases.ShardLeaser(owner="b")
+        claimed = [a.claim(self.now), b.claim(self.now), a.claim(self.now), b.claim(self.now)]
+        self.assertEqual(sorted(lease.shard for lease in claimed), [0, 1, 2, 3])
+        self.assertIsNone(b.claim(self.now))
+        for lease in claimed:
+            self.assertTrue((a if lease.owner == "a" else b).release(lease, now=self.now))
+        self.assertIsNone(a.claim(self.now + timedelta(minutes=1)))   # same round: already swept
+        self.assertIsNotNone(a.claim(self.now + timedelta(minutes=5)))   # next round
+
+    def test_expired_lease_is_taken_over(self):
+        a, b = leases.ShardLeaser(owner="a", shard_count=1), leases.ShardLeaser(owner="b", shard_count=1)
+        lease = a.claim(self.now)
+        self.assertIsNone(b.claim(self.now + timedelta(seconds=30)))
+        a.renew(lease, now=self.now + timedelta(seconds=30))
+        self.assertIsNone(b.claim(self.now + timedelta(seconds=80)))   # renewed until +90s
+        takeover = b.claim(self.now + timedelta(seconds=91))
+        self.assertEqual((takeover.shard, takeover.generation), (0, lease.generation + 1))
+        with self.assertRaises(leases.LeaseLost):
+            a.renew(lease)
+        self.assertFalse(a.release(lease))
+        self.assertIsNone(SweepLease.objects.get(shard=0).swept_at)
+
+    def test_sharded_sweeps_evaluate_each_shipment_once(self):
+        # a fixed clock keeps both runs in the same sweep round
+        with mock.patch.object(ml, "get_model", return_value=CountingModel(p=0.1)), \
+                mock.patch("django.utils.timezone.now", return_value=self.now):
+            out = StringIO()
+            call_command("evaluate_shipments", "--sharded", "--owner", "node-1", "--chunk-size", "1", stdout=out)
+            call_command("evaluate_shipments", "--sharded", "--owner", "node-2", "--all", stdout=out)
+        self.assertEqual(AgentDecision.objects.count(), len(self.shipments))
+        self.assertEqual(sorted(map(str, AgentDecision.objects.values_list("shipment_id", flat=True))),
+                         sorted(str(s.id) for s in self.shipments))
+        self.assertFalse(SweepLease.objects.filter(owner__isnull=False).exists())
+        self.assertEqual(SweepLease.objects.filter(swept_at__isnull=False).count(), 4)
+
+    def test_lost_lease_stops_in_flight_chunks(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from apps.agent_reroute.management.commands import evaluate_shipments as command
+        submitted, renewals = [], []
+
+        def slow_chunk(chunk, started_at=None):
+            time.sleep(0.05)
+            return len(chunk), 0, 0
+
+        def renew():
+            renewals.append(len(submitted))
+            if len(renewals) == 2:
+                raise leases.LeaseLost("Lease on shard 0 was taken over")
+
+        with ThreadPoolExecutor(max_workers=1) as pool, mock.patch.object(command, "evaluate_chunk", slow_chunk):
+            submit = pool.submit
+
+            def recording_submit(*args):
+                submitted.append(submit(*args))
+                return submitted[-1]
+
+            pool.submit = recording_submit
+            # renewed after every finished chunk, including the tail after the last submit
+            self.assertEqual(command.run_chunks([[1]] * 3, None, pool, workers=1, renew=lambda: renewals.append(0)),
+                             (3, 0, 0))
+            self.assertEqual(len(renewals), 3)
+            submitted.clear()
+            renewals.clear()
+            with self.assertRaises(leases.LeaseLost):
+                command.run_chunks([[1]] * 10, None, pool, workers=2, renew=renew)
+            self.assertTrue(all(f.done() for f in submitted))
+            self.assertTrue(any(f.cancelled() for f in submitted))
+            self.assertLess(len(submitted), 10)
+
+    def test_release_after_takeover_is_not_reported_as_swept(self):
+        with mock.patch.object(ml, "get_model", return_value=CountingModel(p=0.1)), \
+                mock.patch("django.utils.timezone.now", return_value=self.now), \
+                mock.patch.object(leases.ShardLeaser, "release", return_value=False):
+            out, err = StringIO(), StringIO()
+            call_command("evaluate_shipments", "--sharded", "--owner", "node-1", stdout=out, stderr=err)
+        self.assertNotIn("Shard ", out.getvalue())
+        self.assertIn("not recorded as swept", err.getvalue())
+
+
+class ReevaluateListenerTestCase(AgentRerouteTestCase):
+    def test_coalescer_window_and_batch_cap(self):
+        c = notify.Coalescer(window_seconds=2.0, max_batch=3)
+        self.assertEqual(c.timeout(100.0, idle=30.0), 30.0)
+        c.add(["a", "b"], now=100.0)
+        c.add(["a"], now=101.0)
+        self.assertFalse(c.ready(101.0))
+        self.assertEqual(c.timeout(101.5, idle=30.0), 0.5)
+        self.assertTrue(c.ready(102.0))
+        self.assertEqual(c.drain(102.0), ["a", "b"])
+        self.assertEqual((len(c), c.opened_at), (0, None))
+
+        c.add(["c", "d", "e", "f"], now=200.0)
+        self.assertTrue(c.ready(200.0))   # full before the window ends
+        self.assertEqual(c.drain(200.0), ["c", "d", "e"])
+        self.assertEqual((len(c), c.opened_at), (1, 200.0))
+
+    def test_alert_marks_shipment_dirty(self):
+        DirtyShipment.objects.all().delete()
+        vehicle = Vehicle.objects.create(plate_number="MH12AB1234")
+        Alert.objects.create(type="DELAY", severity="HIGH", message="Stuck at toll plaza",
+                             shipment=self.shipments[0], vehicle=vehicle, route=self.route)
+        self.assertEqual(DirtyShipment.objects.get(shipment_id=self.shipments[0].id).reason, "alert:DELAY")
+
+    def test_mark_dirty_notifies_on_postgresql(self):
+        ids = [self.shipments[1].id, self.shipments[0].id]
+        with mock.patch.object(notify, "connection") as conn:
+            conn.vendor = "sqlite"
+            notify.notify_dirty(ids)
+            conn.cursor.assert_not_called()
+            conn.vendor = "postgresql"
+            notify.notify_dirty(ids + [None])
+        cursor = conn.cursor.return_value.__enter__.return_value
+        sql, params = cursor.execute.call_args.args
+        self.assertIn("pg_notify", sql)
+        self.assertEqual(params, ["agent_reroute_dirty", sorted(str(i) for i in ids)])
+
+    def test_once_reevaluates_dirty_shipments(self):
+        DirtyShipment.objects.all().delete()
+        dirty.mark_dirty([self.shipments[0].id, self.shipments[1].id], "test")
+        Shipment.objects.filter(id=self.shipments[1].id).update(status="DELIVERED")
+        out = StringIO()
+        with mock.patch.object(ml, "get_model", return_value=CountingModel()):
+            call_command("listen_reevaluate", "--once", stdout=out)
+        self.assertIn("Re-evaluated 1 of 1", out.getvalue())
+        self.assertEqual(list(AgentDecision.objects.values_list("shipment_id", flat=True)), [self.shipments[0].id])
+        self.assertFalse(DirtyShipment.objects.filter(shipment_id=self.shipments[0].id).exists())
+        self.assertIn("reevaluate.reaction", metrics.latency_snapshot())
+
+    def test_listen_needs_postgresql(self):
+        with self.assertRaisesMessage(CommandError, "PostgreSQL"):
+            call_command("listen_reevaluate")
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SchedulerTestCase(AgentRerouteTestCase):
+    def _scheduler(self, durations, jitter=0.0):
+        clock = FakeClock()
+
+        def work():
+            clock.now += durations.pop(0)
+        job = scheduler.Job("sweep", 60.0, work)
+        return scheduler.Scheduler([job], jitter=jitter, clock=clock), job, clock
+
+    def test_ticks_follow_the_grid(self):
+        sched, job, clock = self._scheduler([5.0, 5.0])
+        sched.start(clock())
+        self.assertEqual(sched.due(clock()), [job])
+        first = sched.run(job)
+        self.assertEqual((first.skipped, first.overrun, job.tick), (0, False, 1060.0))
+        self.assertEqual(sched.due(clock()), [])
+        clock.now = 1061.0
+        second = sched.run(job)
+        self.assertAlmostEqual(second.lag, 1.0)
+        self.assertEqual(job.next_run, 1120.0)
+
+    def test_overrun_skips_ticks(self):
+        sched, job, clock = self._scheduler([150.0])
+        sched.start(clock())
+        result = sched.run(job)
+        # ran from 1000 to 1150: the 1060 and 1120 ticks passed meanwhile
+        self.assertEqual((result.skipped, result.overrun), (2, True))
+        self.assertEqual(job.next_run, 1180.0)
+
+    def test_jitter_stays_within_bounds(self):
+        sched, job, clock = self._scheduler([], jitter=0.25)
+        for _ in range(50):
+            sched.start(clock())
+            self.assertTrue(1000.0 <= job.next_run <= 1015.0)
+            self.assertEqual(job.tick, 1000.0)
+
+    def test_failures_and_counters_are_recorded(self):
+        clock = FakeClock()
+
+        def broken():
+            clock.now += 90.0
+            raise RuntimeError("retention disk full")
+        job = scheduler.Job("retention", 60.0, broken)
+        sched = scheduler.Scheduler([job], jitter=0.0, clock=clock)
+        sched.start(clock())
+        scheduler.record_run(sched.run(job), "node-a")
+        clock.now = job.next_run
+        scheduler.record_run(sched.run(job), "node-a")
+        row = SchedulerJob.objects.get(name="retention")
+        self.assertEqual((row.runs, row.failures, row.skipped_ticks, row.overruns), (2, 2, 2, 2))
+        self.assertEqual(row.last_error, "RuntimeError: retention disk full")
+        self.assertIn("scheduler.retention.lag", metrics.latency_snapshot())
+
+    def test_expire_proposals(self):
+        now = datetime.now(timezone.utc)
+        old = RouteProposal.objects.create(shipment_id=self.shipments[0].id, action="propose_switch", rationale="old")
+        fresh = RouteProposal.objects.create(shipment_id=self.shipments[1].id, action="propose_switch", rationale="new")
+        approved = RouteProposal.objects.create(shipment_id=self.shipments[2].id, action="propose_switch",
+                                                rationale="ok", status="approved")
+        RouteProposal.objects.filter(id__in=[old.id, approved.id]).update(created_at=now - timedelta(hours=30))
+        self.assertEqual(scheduler.expire_proposals(now), 1)
+        statuses = dict(RouteProposal.objects.values_list("id", "status"))
+        self.assertEqual((statuses[old.id], statuses[fresh.id], statuses[approved.id]), ("expired", "pending", "approved"))
+
+    def test_command_once_runs_every_job(self):
+        out = StringIO()
+        with mock.patch.object(ml, "get_model", return_value=CountingModel()), tempfile.TemporaryDirectory() as tmp, \
+                override_settings(ROUTE_AI={**settings.ROUTE_AI, "DECISION_ARCHIVE_DIR": tmp}):
+            call_command("run_scheduler", "--once", "--owner", "node-a", stdout=out, stderr=StringIO())
+        self.assertIn("Evaluated 3 shipments", out.getvalue())
+        self.assertEqual(AgentDecision.objects.count(), 3)
+        rows = {row.name: row for row in SchedulerJob.objects.all()}
+        self.assertEqual(set(rows), {"sweep", "expire_proposals", "retention"})
+        self.assertTrue(all(row.runs == 1 and row.failures == 0 and row.leader == "node-a" for row in rows.values()))
+
+        self.assertEqual(self.client.get('/api/agentic/metrics/scheduler/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        jobs = json.loads(self.client.get('/api/agentic/metrics/scheduler/').content)["jobs"]
+        self.assertEqual([job["name"] for job in jobs], ["expire_proposals", "retention", "sweep"])
+
+    def test_unknown_job(self):
+        with self.assertRaisesMessage(CommandError, "Unknown job"):
+            call_command("run_scheduler", "--once", "--jobs", "sweep,vacuum")
+
+
+@override_settings(ROUTE_AI={**settings.ROUTE_AI, "DECISION_LOG_ASYNC": False, "FEED_OVERLAP_SECONDS": 0})
+class ActiveShipmentFeedTestCase(AgentRerouteTestCase):
+    url = '/api/agentic/shipments/active/'
+
+    def _get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def build(self, since=None):
+        from apps.agent_reroute.feed import build_feed
+        return build_feed(since)
+
+    def test_full_feed_is_columnar(self):
+        with self.assertNumQueries(2):   # version, shipments with origin and destination
+            feed = self.build()
+        data = self._get()
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(sorted(data["columns"]["id"]), sorted(str(s.id) for s in self.shipments))
+        self.assertTrue(all(len(values) == 3 for values in data["columns"].values()))
+        self.assertEqual(list(data["features"]), ml.SNAPSHOT_KEYS)
+        self.assertEqual(data["feature_schema"], snapshots.FEATURE_SCHEMA_VERSION)
+        i = data["columns"]["id"].index(str(self.shipments[0].id))
+        snap, _ = ml.build_features_from_shipment(self.shipments[0], None)
+        self.assertAlmostEqual(data["features"]["haversine_km"][i], snap["haversine_km"], places=3)
+        self.assertEqual(data["columns"]["route_id"][i], str(self.route.id))
+        self.assertNotEqual(data["version"], "0")
+        self.assertEqual(feed["version"], data["version"])
+
+    def test_since_returns_changes_and_removals(self):
+        version = self._get()["version"]
+        self.assertEqual(self._get(since=version)["count"], 0)
+
+        time.sleep(0.002)
+        s = Shipment.objects.get(id=self.shipments[0].id)
+        s.status = "PLANNED"
+        s.save()
+        delivered = Shipment.objects.get(id=self.shipments[1].id)
+        delivered.status = "DELIVERED"
+        delivered.save()
+        s = Shipment.objects.get(id=self.shipments[2].id)
+        s.carrier_name = "ACME"   # not decision-relevant
+        s.save()
+
+        data = self._get(since=version)
+        self.assertEqual(data["columns"]["id"], [str(self.shipments[0].id)])
+        self.assertEqual(data["columns"]["status"], ["PLANNED"])
+        self.assertEqual(data["removed"], [str(self.shipments[1].id)])
+        self.assertGreater(int(data["version"]), int(version))
+        self.assertEqual(data["since"], version)
+        self.assertEqual(self._get(since=data["version"])["count"], 0)
+
+    def test_since_accepts_datetimes_and_rejects_garbage(self):
+        before = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+        self.assertEqual(self._get(since=before)["count"], 3)
+        self.assertEqual(self.client.get(self.url, {"since": "yesterday"}).status_code, 400)
+
+
+class StoreProposalsTestCase(AgentRerouteTestCase):
+    url = '/api/agentic/proposals/store/'
+
+    def _post(self, payload):
+        response = self.client.post(self.url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def _item(self, shipment, **extra):
+        return {"shipment_id": str(shipment.id), "route_id": str(self.route.id), "eta_minutes": 420,
+                "toll_cost_usd": 12.3456, "path": [[73.87, 18.75], [80.19, 13.10]], "p_delay": 0.12345, **extra}
+
+    def test_repeat_runs_upsert_the_pending_proposal(self):
+        data = self._post({"proposals": [self._item(s) for s in self.shipments]})
+        self.assertEqual((data["proposals_created"], data["proposals_updated"], data["errors"]), (3, 0, []))
+        first = RouteProposal.objects.get(shipment_id=self.shipments[0].id)
+        self.assertEqual(str(first.proposed_toll_cost_usd), "12.35")
+        self.assertEqual(first.rationale, "Imported from n8n")
+
+        data = self._post([self._item(s, eta_minutes=300, rationale="Rerun") for s in self.shipments])
+        self.assertEqual((data["proposals_created"], data["proposals_updated"]), (0, 3))
+        self.assertEqual(RouteProposal.objects.filter(status="pending").count(), 3)
+        refreshed = RouteProposal.objects.get(id=first.id)
+        self.assertEqual((refreshed.proposed_eta_minutes, refreshed.rationale), (300, "Rerun"))
+        self.assertEqual(refreshed.created_at, first.created_at)
+
+        # a decided proposal does not block a new pending one
+        RouteProposal.objects.filter(id=first.id).update(status="rejected")
+        data = self._post([self._item(self.shipments[0])])
+        self.assertEqual(data["proposals_created"], 1)
+        self.assertEqual(RouteProposal.objects.filter(shipment_id=self.shipments[0].id).count(), 2)
+
+    def test_invalid_items_are_reported_and_skipped(self):
+        s0, s1, s2 = self.shipments
+        data = self._post({"proposals": [
+            "not json at all {",
+            42,
+            {"route_id": str(self.route.id)},
+            self._item(s0, eta_minutes="soon"),
+            self._item(s1, p_delay=12.5),
+            json.dumps(self._item(s1)),
+            {"shipment_id": "not-a-uuid"},
+            self._item(s2, eta_minutes=100),
+            self._item(s2, eta_minutes=200),
+        ]})
+        self.assertEqual([e["index"] for e in data["errors"]], [0, 1, 2, 3, 4, 6, 7])
+        self.assertIn("eta_minutes", data["errors"][3]["error"])
+        self.assertIn("p_delay", data["errors"][4]["error"])
+        self.assertEqual(data["errors"][6]["shipment_id"], str(s2.id))
+        self.assertEqual(data["proposals_created"], 2)
+        self.assertEqual([p["shipment_id"] for p in data["proposals"]], [str(s1.id), str(s2.id)])
+        self.assertEqual(RouteProposal.objects.get(shipment_id=s2.id).proposed_eta_minutes, 200)
+        self.assertFalse(RouteProposal.objects.filter(shipment_id=s0.id).exists())
+
+    def test_bulk_payload_is_one_statement(self):
+        from apps.agent_reroute.proposals import store_proposals
+        items = [self._item(self.shipments[0], shipment_id=str(uuid.uuid4())) for _ in range(200)]
+        # savepoint, insert, read back, release (bulk_batch_size allows far more on PostgreSQL)
+        with mock.patch("django.db.backends.sqlite3.operations.DatabaseOperations.bulk_batch_size",
+                        return_value=1000), self.assertNumQueries(4):
+            result = store_proposals(items)
+        self.assertEqual(result.created, 200)
+        self.assertEqual(RouteProposal.objects.filter(status="pending").count(), 200)
+
+    def test_body_is_streamed_in_chunks(self):
+        s0, s1, s2 = self.shipments
+        items = [self._item(s0), self._item(s1), self._item(s0, eta_minutes=99), self._item(s2)]
+        body = json.dumps({"source": {"run": [1, 2.5e3]}, "proposals": items, "count": 4})
+        with override_settings(ROUTE_AI={**settings.ROUTE_AI, "PROPOSAL_READ_BYTES": 7, "PROPOSAL_CHUNK_SIZE": 2}):
+            response = self.client.post(self.url, body, content_type='application/json')
+        data = json.loads(response.content)
+        # s0 was upserted with the first chunk, then superseded from the second
+        self.assertEqual(data["errors"], [{"index": 0, "shipment_id": str(s0.id),
+                                           "error": "Superseded by item 2 for the same shipment"}])
+        self.assertEqual([p["shipment_id"] for p in data["proposals"]], [str(s1.id), str(s0.id), str(s2.id)])
+        self.assertEqual((data["proposals_created"], data["proposals_updated"]), (3, 0))
+        self.assertEqual(RouteProposal.objects.get(shipment_id=s0.id).proposed_eta_minutes, 99)
+
+    def test_malformed_bodies_store_nothing(self):
+        items = json.dumps([self._item(s) for s in self.shipments])
+        with override_settings(ROUTE_AI={**settings.ROUTE_AI, "PROPOSAL_CHUNK_SIZE": 1}):
+            for body, detail in [(items[:-5], "Invalid JSON"), (items + "]", "Invalid JSON"), ("", "Invalid JSON"),
+                                 ('{"items": []}', "Expected { 'proposals': [...] } or an array"),
+                                 ('{"proposals": "[oops"}', "'proposals' is a string and could not be parsed"),
+                                 ("[]", "No proposals provided")]:
+                response = self.client.post(self.url, body, content_type='application/json')
+                self.assertEqual((response.status_code, json.loads(response.content)["detail"]), (400, detail))
+        self.assertFalse(RouteProposal.objects.exists())
+        data = self._post({"proposals": json.dumps([self._item(self.shipments[0])])})
+        self.assertEqual(data["proposals_created"], 1)
+
+    def test_parser_memory_does_not_grow_with_the_payload(self):
+        from io import BytesIO
+        import tracemalloc
+        from apps.agent_reroute.proposals import PayloadError, iter_proposals
+
+        def peak(n):
+            body = BytesIO(json.dumps({"proposals": [self._item(self.shipments[0])] * n}).encode())
+            tracemalloc.start()
+            try:
+                self.assertEqual(sum(1 for _ in iter_proposals(body, 4096)), n)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        small, large = peak(100), peak(10000)   # ~20 KB and ~2 MB bodies
+        self.assertLess(large, small + 64 * 1024)
+
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1024), self.assertRaises(PayloadError):
+            list(iter_proposals(BytesIO(b'[{"path": "' + b"x" * 10 ** 6), 256))
+
+
+class AdmissionControlTestCase(AgentRerouteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.limits = override_settings(ROUTE_AI={**settings.ROUTE_AI, "ADMISSION_MAX_CONCURRENT": 1,
+                                                  "ADMISSION_MAX_QUEUE": 1, "ADMISSION_QUEUE_TIMEOUT_SECONDS": 0.2,
+                                                  "ADMISSION_RETRY_AFTER_SECONDS": 7})
+        self.limits.enable()
+        self.addCleanup(self.limits.disable)
+        admission.reset_admission()
+        self.addCleanup(admission.reset_admission)
+        self.limiter = admission.get_admission_limiter()
+
+    def test_queue_full_then_timeout(self):
+        self.limiter.acquire()
+        waiter_started, results = threading.Event(), []
+
+        def wait():
+            waiter_started.set()
+            try:
+                self.limiter.acquire()
+                results.append("admitted")
+            except admission.Rejected as e:
+                results.append(e.status)
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        waiter_started.wait()
+        while self.limiter.snapshot()["queue_depth"] < 1:
+            time.sleep(0.001)
+        with self.assertRaises(admission.Rejected) as ctx:
+            self.limiter.acquire()
+        self.assertEqual(ctx.exception.status, 429)
+        thread.join()
+        self.assertEqual(results, [503])
+        snapshot = self.limiter.snapshot()
+        self.assertEqual((snapshot["in_flight"], snapshot["queue_depth"], snapshot["max_queue_depth"]), (1, 0, 1))
+        self.assertEqual((snapshot["rejected_queue_full"], snapshot["rejected_timeout"]), (1, 1))
+
+    def test_waiter_admitted_on_release(self):
+        self.limiter.acquire()
+        thread = threading.Thread(target=self.limiter.acquire)
+        thread.start()
+        while self.limiter.snapshot()["queue_depth"] < 1:
+            time.sleep(0.001)
+        self.limiter.release()
+        thread.join()
+        snapshot = self.limiter.snapshot()
+        self.assertEqual((snapshot["admitted"], snapshot["in_flight"], snapshot["rejected_timeout"]), (2, 1, 0))
+
+    def test_async_waiters_hold_no_threads(self):
+        limiter = admission.AdmissionLimiter(max_concurrent=1, max_queue=64, queue_timeout=2.0)
+        order = []
+
+        async def request(i):
+            await limiter.acquire_async()
+            order.append(i)
+            await asyncio.sleep(0)
+            limiter.release()
+
+        async def main():
+            await limiter.acquire_async()
+            before = threading.active_count()
+            tasks = [asyncio.ensure_future(request(i)) for i in range(64)]
+            while limiter.snapshot()["queue_depth"] < 64:
+                await asyncio.sleep(0.001)
+            self.assertEqual(threading.active_count(), before)
+            with self.assertRaises(admission.Rejected):
+                await limiter.acquire_async()   # queue full
+            # released from another thread, as a sync view would
+            await asyncio.get_running_loop().run_in_executor(None, limiter.release)
+            await asyncio.gather(*tasks)
+
+        asyncio.run(main())
+        self.assertEqual(sorted(order), list(range(64)))
+        snapshot = limiter.snapshot()
+        self.assertEqual((snapshot["in_flight"], snapshot["queue_depth"], snapshot["admitted"]), (0, 0, 65))
+        self.assertEqual(snapshot["rejected_queue_full"], 1)
+
+    def test_async_waiter_timeout_and_cancellation(self):
+        limiter = admission.AdmissionLimiter(max_concurrent=1, max_queue=2, queue_timeout=0.05)
+
+        async def main():
+            await limiter.acquire_async()
+            started = time.perf_counter()
+            with self.assertRaises(admission.Rejected) as ctx:
+                await limiter.acquire_async()
+            self.assertEqual(ctx.exception.status, 503)
+            self.assertLess(time.perf_counter() - started, 1.0)
+            # a cancelled waiter leaves the queue and does not take the slot released meanwhile
+            waiter = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0.01)
+            limiter.release()
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            if not waiter.cancelled():
+                limiter.release()
+
+        asyncio.run(main())
+        snapshot = limiter.snapshot()
+        self.assertEqual((snapshot["in_flight"], snapshot["queue_depth"], snapshot["rejected_timeout"]), (0, 0, 1))
+
+    def test_saturated_endpoint_sheds_with_retry_after(self):
+        admission.reset_admission()
+        with override_settings(ROUTE_AI={**settings.ROUTE_AI, "ADMISSION_MAX_QUEUE": 0}):
+            admission.get_admission_limiter().acquire()
+            response = self.client.post(f'/api/agentic/shipments/{self.shipments[0].id}/evaluate/')
+            batch = self.client.post('/api/agentic/shipments/evaluate-batch/', data="{}",
+                                     content_type="application/json")
+        self.assertEqual((response.status_code, batch.status_code), (429, 429))
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertEqual(json.loads(response.content)["reason"], "queue_full")
+        # other endpoints are not limited
+        self.assertEqual(self.client.get('/api/agentic/proposals/').status_code, 200)
+
+    def test_slot_released_when_view_fails(self):
+        with mock.patch.object(RouteDecisionAgent, "decide", side_effect=RuntimeError("boom")):
+            response = self.client.post(f'/api/agentic/shipments/{self.shipments[0].id}/evaluate/')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.limiter.snapshot()["in_flight"], 0)
+        self.user.is_staff = True
+        self.user.save()
+        data = json.loads(self.client.get('/api/agentic/metrics/latency/').content)
+        self.assertEqual(data["admission"]["admitted"], 1)
+        self.assertIn("admission.wait", data["stages"])
+
+
+class ThreadRecordingModel(CountingModel):
+    def __init__(self, p=0.9):
+        super().__init__(p)
+        self.threads = set()
+
+    def predict_proba(self, X):
+        self.threads.add(threading.current_thread().name)
+        return super().predict_proba(X)
+
+
+@override_settings(ROUTE_AI={**settings.ROUTE_AI, "DECISION_LOG_ASYNC": False, "P_DELAY_THRESHOLD": 0.1})
+class AsyncEvaluateTestCase(FleetFixture, TransactionTestCase):
+    """Async views do their DB work on pool threads, so fixture rows must really be committed"""
+
+    def setUp(self):
+        super().setUp()
+        admission.reset_admission()
+        self.addCleanup(admission.reset_admission)
+        self.addCleanup(executors.shutdown_executors)
+
+    def test_async_evaluate_matches_sync(self):
+        url = f'shipments/{self.shipments[0].id}/evaluate/'
+        with mock.patch.object(ml, "get_model", return_value=CountingModel(p=0.9)):
+            data = json.loads(self.client.post('/api/agentic/async/' + url + '?debug=1').content)
+            get_decision_cache().clear()
+            expected = json.loads(self.client.post('/api/agentic/' + url).content)
+        self.assertEqual({k: data[k] for k in expected}, expected)
+        self.assertTrue({"fetch", "predict", "log", "total"} <= set(data["timings_ms"]))
+        self.assertEqual(AgentDecision.objects.count(), 2)
+
+    def test_batch_runs_model_on_inference_pool(self):
+        model = ThreadRecordingModel()
+        ids = [str(s.id) for s in self.shipments] + ["not-a-uuid", str(uuid.uuid4())]
+        with mock.patch.object(ml, "get_model", return_value=model):
+            data = json.loads(self.client.post('/api/agentic/async/shipments/evaluate-batch/',
+                                               data=json.dumps({"shipment_ids": ids}),
+                                               content_type="application/json").content)
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(len(data["errors"]), 2)
+        self.assertEqual(model.calls, 1)   # one predict_proba for the batch
+        self.assertTrue(model.threads)
+        self.assertTrue(all(name.startswith("agentic-infer") for name in model.threads))
+        self.assertEqual(AgentDecision.objects.count(), 3)
+        self.assertFalse(DirtyShipment.objects.filter(shipment_id__in=[s.id for s in self.shipments]).exists())
+
+    def test_batch_validation(self):
+        url = '/api/agentic/async/shipments/evaluate-batch/'
+        self.assertEqual(self.client.post(url, data="[", content_type="application/json").status_code, 400)
+        self.assertEqual(self.client.post(url, data=json.dumps({"shipment_ids": "x"}),
+                                          content_type="application/json").status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+    def test_model_errors_reach_the_pipeline(self):
+        def boom(*args):
+            raise RuntimeError("inference failed")
+        steps = RouteDecisionAgent()._decide(self.shipments[0].id, metrics.StageTimings("decide"))
+        with mock.patch.object(executors, "run_inference", side_effect=lambda fn, *args: boom()):
+            with self.assertRaisesMessage(RuntimeError, "inference failed"):
+                async_to_sync(executors.arun_steps)(steps)
+
+
+class DecisionLogWriterTestCase(TransactionTestCase):
+    """The writer thread uses its own connection, so rows must really be committed"""
+
+    def _records(self, n):
+        return [AgentDecision(shipment_id=uuid.uuid4(), input_snapshot={"features": {}},
+                              output_decision={"action": "stick"}) for _ in range(n)]
+
+    def test_flushes_by_size_and_on_close(self):
+        writer = DecisionLogWriter(batch_size=4, flush_ms=60000)
+        with mock.patch.object(AgentDecision.objects, "bulk_create", wraps=AgentDecision.objects.bulk_create) as bulk:
+            writer.submit(self._records(10))
+            writer.close()
+        self.assertEqual(AgentDecision.objects.count(), 10)
+        self.assertEqual([len(c.args[0]) for c in bulk.call_args_list], [4, 4, 2])
+        self.assertEqual(writer.written, 10)
+
+    def test_flushes_after_interval(self):
+        writer = DecisionLogWriter(batch_size=1000, flush_ms=20)
+        writer.submit(self._records(3))
+        for _ in range(200):
+            if writer.written == 3:
+                break
+            time.sleep(0.01)
+        self.assertEqual(AgentDecision.objects.count(), 3)
+        writer.close()
+
+    def test_drop_policy_bounds_the_queue(self):
+        writer = DecisionLogWriter(batch_size=10, max_queue=2, policy="drop")
+        with mock.patch.object(writer, "_ensure_thread"):
+            writer.submit(self._records(5))   # no consumer yet: only 2 fit
+        self.assertEqual((writer.pending, writer.dropped), (2, 3))
+        writer._ensure_thread()
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(AgentDecision.objects.count(), 2)
+        writer.close()
+
+    def test_block_policy_waits_for_room(self):
+        writer = DecisionLogWriter(batch_size=1, max_queue=1, policy="block", block_timeout=5)
+        writer.submit(self._records(20))
+        writer.close()
+        self.assertEqual((writer.dropped, AgentDecision.objects.count()), (0, 20))
+
+    def test_block_timeout_covers_the_whole_batch(self):
+        writer = DecisionLogWriter(batch_size=10, max_queue=2, policy="block", block_timeout=0.1)
+        with mock.patch.object(writer, "_ensure_thread"):
+            started = time.perf_counter()
+            writer.submit(self._records(10))   # no consumer: 2 fit, the rest wait out one timeout
+            elapsed = time.perf_counter() - started
+        self.assertEqual((writer.pending, writer.dropped), (2, 8))
+        self.assertLess(elapsed, 0.5)
+        writer._ensure_thread()
+        writer.close()
+
+
+class ArchiveDecisionsCommandTestCase(AgentRerouteTestCase):
+    def _decision(self, created_at, action="stick"):
+        d = AgentDecision.objects.create(
+            shipment_id=self.shipments[0].id, current_route_id=self.route.id,
+            input_snapshot={"features": {k: 1.0 for k in ml.SNAPSHOT_KEYS},
+                            "current": {"route_id": str(self.route.id), "eta_minutes": 600.0, "p_delay": 0.4}},
+            output_decision={"action": action, "current_score": -10.0, "best_alt_score": None,
+                             "best_alt": None, "rationale": "test"},
+        )
+        AgentDecision.objects.filter(id=d.id).update(created_at=created_at)
+        return d
+
+    def test_archives_old_months_to_parquet(self):
+        import pyarrow.parquet as pq
+        this_month = month_start(datetime.now(timezone.utc))
+        old = add_months(this_month, -5)
+        for day in (2, 10, 20):
+            self._decision(old.replace(day=day))
+        self._decision(add_months(this_month, -4).replace(day=3), action="propose_switch")
+        recent = self._decision(datetime.now(timezone.utc))
+
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as tmp:
+            call_command("archive_decisions", "--retention-months", "3", "--output-dir", tmp,
+                         "--chunk-size", "2", stdout=out)
+            files = sorted(os.listdir(tmp))
+            table = pq.read_table(os.path.join(tmp, f"agent_decisions_{old:%Y_%m}.parquet"))
+
+        self.assertEqual(files, [f"agent_decisions_{old:%Y_%m}.parquet",
+                                 f"agent_decisions_{add_months(old, 1):%Y_%m}.parquet"])
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(table.column("feature_haversine_km").to_pylist(), [1.0, 1.0, 1.0])
+        self.assertEqual(table.column("current_eta_minutes").to_pylist(), [600.0] * 3)
+        self.assertEqual(table.column("best_alt_route_id").to_pylist(), [None] * 3)
+        self.assertEqual(list(AgentDecision.objects.values_list("id", flat=True)), [recent.id])
+        self.assertIn("Archived 4 decisions from 2 month(s)", out.getvalue())
+
+    def test_dry_run_keeps_rows(self):
+        self._decision(add_months(month_start(datetime.now(timezone.utc)), -6))
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as tmp:
+            call_command("archive_decisions", "--output-dir", tmp, "--dry-run", stdout=out)
+            self.assertEqual(os.listdir(tmp), [])
+        self.assertIn("1 decisions would be archived", out.getvalue())
+        self.assertEqual(AgentDecision.objects.count(), 1)
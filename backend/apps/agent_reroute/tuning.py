@@ -0,0 +1,204 @@
+"""
+Policy search over P_DELAY_THRESHOLD, IMPROVEMENT_EPS and SCORE_WEIGHTS.
+
+The logged decision history is loaded once (replay.py loaders; p_delay of
+every current route and logged alternative predicted once with the current
+model) and joined with realised outcomes of delivered shipments. Each
+candidate policy is then a row of a (C, 5) parameter array and all of them
+are evaluated against every decision as broadcast (decisions x candidates)
+array operations, in blocks spread over a process pool. A block holds at most
+TUNING_BLOCK_MB of intermediates, so each worker needs about that much
+memory on top of the history.
+
+For every candidate the search reports:
+
+  switch_rate     share of logged decisions that would propose a switch
+                  (the proposal / notification volume)
+  avoided_delay   expected minutes of delay avoided per delivered shipment
+
+A shipment counts once, at its first proposed switch. The delay avoided by
+that switch is estimated from the shipment's realised lateness (delivery
+after scheduled_at + the logged ETA) scaled by the relative drop in
+predicted delay risk, plus the ETA gained (negative for slower
+alternatives). Shipments without an outcome only count towards the switch
+rate.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .replay import DecisionArrays, has_alternative, predict_options
+
+# Columns of a candidate array; weights as in SCORE_WEIGHTS (p_delay weight per unit probability)
+PARAMS = ("P_DELAY_THRESHOLD", "IMPROVEMENT_EPS", "eta_minutes", "toll_cost_usd", "p_delay")
+
+# Peak bytes per decision x candidate cell of a block: two float64 scores, the int32 running
+# switch count and its per-shipment gather, and a few bool masks
+BYTES_PER_CELL = 32
+
+
+def block_cells() -> int:
+    """Decision x candidate cells one worker evaluates at once, from ROUTE_AI TUNING_BLOCK_MB."""
+    return max(1, int(settings.ROUTE_AI.get("TUNING_BLOCK_MB", 64) * 2 ** 20) // BYTES_PER_CELL)
+
+
+@dataclass
+class PolicyHistory:
+    """Decisions sorted by shipment (then id), with everything a candidate needs precomputed."""
+    objectives_current: np.ndarray   # (n, 3) eta, toll, predicted p_delay
+    objectives_alt: np.ndarray       # (n, 3) logged best alternative; NaN rows where none
+    group: np.ndarray                # (n,) shipment index of each decision
+    group_start: np.ndarray          # (shipments,) first row of each shipment
+    gain: np.ndarray                 # (n,) expected minutes avoided by switching here; 0 without an outcome
+    delivered_shipments: int
+
+    def __len__(self):
+        return len(self.group)
+
+
+def build_history(chunks: Iterable[DecisionArrays], model, outcomes: Dict[str, Dict[str, object]]) -> PolicyHistory:
+    """
+    chunks: DecisionArrays from replay.iter_decision_arrays / iter_archive_arrays.
+    outcomes: {shipment_id: {"scheduled_at", "delivered_at"}} for delivered shipments.
+    """
+    parts = []
+    for arrays in chunks:
+        p_current, p_alt = predict_options(arrays, model)
+        parts.append((arrays, p_current, p_alt))
+    if not parts:
+        empty = np.zeros((0, 3))
+        return PolicyHistory(empty, empty.copy(), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                             np.zeros(0), 0)
+
+    ids = np.concatenate([a.ids for a, _, _ in parts])
+    shipments = np.concatenate([a.shipment_ids for a, _, _ in parts]).astype(str)
+    current = np.concatenate([a.current[:, :3] for a, _, _ in parts])
+    alt = np.concatenate([a.alt[:, :3] for a, _, _ in parts])
+    has_alt = np.concatenate([has_alternative(a) for a, _, _ in parts])
+    current[:, 2] = np.concatenate([p for _, p, _ in parts])
+    alt[:, 2] = np.concatenate([p for _, _, p in parts])
+    alt[~has_alt] = np.nan
+
+    order = np.lexsort((ids, shipments))
+    shipments, current, alt = shipments[order], current[order], alt[order]
+    names, group_start, group = np.unique(shipments, return_index=True, return_inverse=True)
+
+    # Realised lateness per decision: delivery after scheduled_at + the ETA logged with it
+    delivered_minutes = np.full(len(names), np.nan)
+    for i, name in enumerate(names):
+        outcome = outcomes.get(name)
+        if outcome and outcome.get("delivered_at") and outcome.get("scheduled_at"):
+            delivered_minutes[i] = (outcome["delivered_at"] - outcome["scheduled_at"]).total_seconds() / 60.0
+    lateness = np.maximum(delivered_minutes[group] - current[:, 0], 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        risk_drop = np.clip(1.0 - alt[:, 2] / current[:, 2], 0.0, 1.0)
+    gain = lateness * np.nan_to_num(risk_drop) + (current[:, 0] - alt[:, 0])
+    gain = np.where(np.isnan(delivered_minutes[group]) | ~has_alt[order], 0.0, np.nan_to_num(gain))
+    return PolicyHistory(current, alt, group.astype(np.int64), group_start.astype(np.int64), gain,
+                         int((~np.isnan(delivered_minutes)).sum()))
+
+
+def grid_candidates(thresholds: Sequence[float], eps: Sequence[float], eta_weights: Sequence[float],
+                    toll_weights: Sequence[float], p_weights: Sequence[float]) -> np.ndarray:
+    """Every combination, as a (C, 5) array in PARAMS order."""
+    mesh = np.meshgrid(thresholds, eps, eta_weights, toll_weights, p_weights, indexing="ij")
+    return np.stack([m.ravel() for m in mesh], axis=1).astype(float)
+
+
+def random_candidates(n: int, ranges: Sequence[Sequence[float]], seed: Optional[int] = None) -> np.ndarray:
+    """n candidates drawn uniformly from the [min, max] of each PARAMS range."""
+    rng = np.random.default_rng(seed)
+    lo = np.array([min(r) for r in ranges], dtype=float)
+    hi = np.array([max(r) for r in ranges], dtype=float)
+    return lo + rng.random((n, len(PARAMS))) * (hi - lo)
+
+
+def evaluate_candidates(history: PolicyHistory, candidates: np.ndarray, cells: Optional[int] = None):
+    """(switches, avoided delay minutes in total) per candidate, as (C,) arrays; cells as block_cells()."""
+    n = len(history)
+    switches = np.zeros(len(candidates), dtype=np.int64)
+    avoided = np.zeros(len(candidates))
+    if n == 0:
+        return switches, avoided
+    has_alt = ~np.isnan(history.objectives_alt).any(axis=1)
+    cur = history.objectives_current
+    alt = np.nan_to_num(history.objectives_alt)
+    block = max(1, (cells or block_cells()) // n)
+    for start in range(0, len(candidates), block):
+        c = candidates[start:start + block]
+        weights = c[:, 2:] * np.array([1.0, 1.0, 100.0])   # scoring.weight_vector per candidate
+        # relative improvement of the (negated) scores, (alt - cur) / (|cur| + 1e-6), in place
+        cost = cur @ weights.T                               # (n, C)
+        improvement = alt @ weights.T
+        np.subtract(cost, improvement, out=improvement)
+        np.abs(cost, out=cost)
+        cost += 1e-6
+        improvement /= cost
+        del cost
+        switch = (cur[:, 2:3] >= c[None, :, 0]) & has_alt[:, None]
+        switch &= improvement >= c[None, :, 1]
+        del improvement
+        # first switch per shipment: no earlier switch among the shipment's decisions
+        before = np.cumsum(switch, axis=0, dtype=np.int32)
+        before -= switch
+        before -= before[history.group_start][history.group]
+        switches[start:start + len(c)] = switch.sum(axis=0)
+        avoided[start:start + len(c)] = history.gain @ (switch & (before == 0))
+    return switches, avoided
+
+
+_history: Optional[PolicyHistory] = None
+
+
+_cells: Optional[int] = None
+
+
+def _init_worker(history: PolicyHistory, cells: int):
+    global _history, _cells
+    _history, _cells = history, cells
+
+
+def _evaluate_block(candidates: np.ndarray):
+    return evaluate_candidates(_history, candidates, _cells)
+
+
+def search(history: PolicyHistory, candidates: np.ndarray, workers: int = 1) -> pd.DataFrame:
+    """Evaluate every candidate; one row per candidate with its metrics and Pareto membership."""
+    if workers <= 1 or len(candidates) < 2:
+        switches, avoided = evaluate_candidates(history, candidates)
+    else:
+        blocks = np.array_split(candidates, min(len(candidates), workers * 4))
+        ctx = multiprocessing.get_context("spawn")
+        # The history is shipped to each worker once, not with every block
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_init_worker, initargs=(history, block_cells())) as pool:
+            results = list(pool.map(_evaluate_block, blocks))
+        switches = np.concatenate([s for s, _ in results])
+        avoided = np.concatenate([a for _, a in results])
+
+    table = pd.DataFrame(candidates, columns=PARAMS)
+    table["switches"] = switches
+    table["switch_rate"] = switches / max(len(history), 1)
+    table["avoided_delay_minutes"] = avoided / max(history.delivered_shipments, 1)
+    table["pareto"] = pareto_front(table["switch_rate"].to_numpy(), table["avoided_delay_minutes"].to_numpy())
+    return table
+
+
+def pareto_front(switch_rate: np.ndarray, avoided: np.ndarray) -> np.ndarray:
+    """Candidates no other candidate beats on both fewer switches and more avoided delay."""
+    order = np.lexsort((-avoided, switch_rate))
+    best = np.maximum.accumulate(avoided[order])
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = avoided[order][1:] > best[:-1]
+    mask = np.zeros(len(order), dtype=bool)
+    mask[order[keep]] = True
+    return mask
+
+
+def parse_values(text: str) -> List[float]:
+    return [float(v) for v in text.split(",") if v.strip()]
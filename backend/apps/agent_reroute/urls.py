@@ -1,9 +1,16 @@
 from django.urls import path
-from .views import evaluate_route, apply_proposal, get_all_proposals, store_all_proposals
+from .views import (active_shipments_feed, evaluate_route, evaluate_batch, aevaluate_route, aevaluate_batch,
+                    apply_proposal, get_all_proposals, store_all_proposals, latency_metrics, scheduler_metrics)
 
 urlpatterns = [
+    path("shipments/active/", active_shipments_feed),  # GET columnar feed of active shipments (?since=)
+    path("shipments/evaluate-batch/", evaluate_batch),  # POST evaluate many shipments at once
     path("shipments/<uuid:shipment_id>/evaluate/", evaluate_route),
+    path("async/shipments/evaluate-batch/", aevaluate_batch),  # async views for ASGI servers
+    path("async/shipments/<uuid:shipment_id>/evaluate/", aevaluate_route),
     path("shipments/<uuid:shipment_id>/apply/", apply_proposal),
     path("proposals/", get_all_proposals),  # GET all proposals
     path("proposals/store/", store_all_proposals),  # POST all proposals from n8n
+    path("metrics/latency/", latency_metrics),  # GET per-stage p50/p95/p99 (staff)
+    path("metrics/scheduler/", scheduler_metrics),  # GET run_scheduler job counters (staff)
 ]
@@ -4,32 +4,182 @@ from django.views.decorators.csrf import csrf_protect, csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
-import ast
+from django.utils import timezone
 import json
+import uuid
 from apps.shipments.models import Shipment
 from apps.routes.models import Route
-from .decision_maker import RouteDecisionAgent
-from .models import RouteProposal
+from .admission import admission_controlled, admission_snapshot
+from .decision_maker import RouteDecisionAgent, active_shipments
+from .dirty import clear_dirty, sweep_shipments
+from .executors import run_db
+from .feed import build_feed, parse_since
+from .metrics import latency_snapshot
+from .models import RouteProposal, SchedulerJob
+from .proposals import PayloadError, iter_proposals, store_proposals
 from .onesignal_service import OneSignalService
 
+def _decision_payload(shipment_id, result):
+    return {
+        "shipment_id": str(shipment_id),
+        "action": result.action,
+        "current": result.current,
+        "proposal": result.best_alt,
+        "rationale": result.rationale,
+        "requires_approval": result.action == "propose_switch",
+        "cached": result.cached,
+    }
+
+def _debug_requested(request):
+    """?debug=1 attaches per-stage timings to evaluate responses"""
+    return request.GET.get("debug", "").lower() in ("1", "true", "yes")
+
+def _evaluate_payload(request, shipment_id, result, agent):
+    payload = _decision_payload(shipment_id, result)
+    if _debug_requested(request):
+        payload["timings_ms"] = agent.timings.as_dict()
+    return payload
+
+def _parse_batch(request):
+    """(evaluate-batch body, None) or (None, 400 response)"""
+    try:
+        data = json.loads(request.body or "{}")
+    except json.JSONDecodeError:
+        return None, JsonResponse({"detail": "Invalid JSON"}, status=400)
+    if not isinstance(data, dict):
+        return None, JsonResponse({"detail": "Expected a JSON object"}, status=400)
+    if data.get("shipment_ids") is not None and not isinstance(data["shipment_ids"], list):
+        return None, JsonResponse({"detail": "'shipment_ids' must be an array"}, status=400)
+    return data, None
+
+def _batch_ids(data, started_at):
+    """(valid shipment ids, errors) for an evaluate-batch body"""
+    shipment_ids = data.get("shipment_ids")
+    if shipment_ids is None:
+        queryset = active_shipments() if data.get("all") else sweep_shipments(started_at)
+        shipment_ids = list(queryset.values_list("id", flat=True))
+
+    valid_ids, errors = [], []
+    for sid in shipment_ids:
+        try:
+            valid_ids.append(uuid.UUID(str(sid)))
+        except ValueError:
+            errors.append({"shipment_id": str(sid), "error": "Invalid shipment id"})
+    return valid_ids, errors
+
+def _batch_payload(request, results, failed, errors, agent):
+    errors.extend({"shipment_id": sid, "error": err} for sid, err in failed.items())
+    payload = {
+        "count": len(results),
+        "results": [_decision_payload(r.shipment_id, r) for r in results],
+        "errors": errors,
+    }
+    if _debug_requested(request):
+        payload["timings_ms"] = agent.timings.as_dict()
+    return payload
+
 @require_POST
 @csrf_protect
 @login_required
+@admission_controlled
 def evaluate_route(request, shipment_id):
     """
     Evaluate route for a shipment and return decision
-    POST /agent_reroute/shipments/<uuid:shipment_id>/evaluate/
+    POST /agent_reroute/shipments/<uuid:shipment_id>/evaluate/[?debug=1]
     """
     try:
-        result = RouteDecisionAgent().decide(shipment_id)
-        return JsonResponse({
-            "shipment_id": str(shipment_id),
-            "action": result.action,
-            "current": result.current,
-            "proposal": result.best_alt,
-            "rationale": result.rationale,
-            "requires_approval": result.action == "propose_switch",
-        })
+        started_at = timezone.now()
+        agent = RouteDecisionAgent()
+        result = agent.decide(shipment_id)
+        clear_dirty([shipment_id], started_at)
+        return JsonResponse(_evaluate_payload(request, shipment_id, result, agent))
+    except Exception as e:
+        return JsonResponse({"detail": "Internal server error", "error": str(e)}, status=500)
+
+@require_POST
+@csrf_protect
+@login_required
+@admission_controlled
+def evaluate_batch(request):
+    """
+    Evaluate routes for many shipments in a single request
+    POST /agent_reroute/shipments/evaluate-batch/[?debug=1]
+    Body: { "shipment_ids": [...] }  (omit to evaluate changed or stale shipments,
+          or send { "all": true } to evaluate every active shipment)
+    """
+    try:
+        data, error = _parse_batch(request)
+        if error is not None:
+            return error
+
+        started_at = timezone.now()
+        valid_ids, errors = _batch_ids(data, started_at)
+        agent = RouteDecisionAgent()
+        results, failed = agent.decide_many(valid_ids)
+        clear_dirty([r.shipment_id for r in results], started_at)
+        return JsonResponse(_batch_payload(request, results, failed, errors, agent))
+    except Exception as e:
+        return JsonResponse({"detail": "Internal server error", "error": str(e)}, status=500)
+
+@require_POST
+@csrf_protect
+@login_required
+@admission_controlled
+async def aevaluate_route(request, shipment_id):
+    """
+    Async evaluate_route for ASGI servers: the DB work runs on a bounded thread
+    pool and the model call on the inference executor, so one worker keeps
+    many evaluations in flight
+    POST /agent_reroute/async/shipments/<uuid:shipment_id>/evaluate/[?debug=1]
+    """
+    try:
+        started_at = timezone.now()
+        agent = RouteDecisionAgent()
+        result = await agent.adecide(shipment_id)
+        await run_db(clear_dirty, [shipment_id], started_at)
+        return JsonResponse(_evaluate_payload(request, shipment_id, result, agent))
+    except Exception as e:
+        return JsonResponse({"detail": "Internal server error", "error": str(e)}, status=500)
+
+@require_POST
+@csrf_protect
+@login_required
+@admission_controlled
+async def aevaluate_batch(request):
+    """
+    Async evaluate_batch for ASGI servers (same body and response)
+    POST /agent_reroute/async/shipments/evaluate-batch/[?debug=1]
+    """
+    try:
+        data, error = _parse_batch(request)
+        if error is not None:
+            return error
+
+        started_at = timezone.now()
+        valid_ids, errors = await run_db(_batch_ids, data, started_at)
+        agent = RouteDecisionAgent()
+        results, failed = await agent.adecide_many(valid_ids)
+        await run_db(clear_dirty, [r.shipment_id for r in results], started_at)
+        return JsonResponse(_batch_payload(request, results, failed, errors, agent))
+    except Exception as e:
+        return JsonResponse({"detail": "Internal server error", "error": str(e)}, status=500)
+
+@require_GET
+@login_required
+def active_shipments_feed(request):
+    """
+    Active shipments with their decision-relevant fields and model features
+    as parallel arrays; pass the returned version back as since= to get only
+    what changed (see feed.py)
+    GET /agent_reroute/shipments/active/[?since=<version or ISO datetime>]
+    """
+    try:
+        since = request.GET.get("since")
+        try:
+            since = parse_since(since) if since else None
+        except ValueError as e:
+            return JsonResponse({"detail": str(e)}, status=400)
+        return JsonResponse(build_feed(since))
     except Exception as e:
         return JsonResponse({"detail": "Internal server error", "error": str(e)}, status=500)
 
@@ -56,18 +206,21 @@ def apply_proposal(request, shipment_id):
         # Always create a new route for alternatives since they don't exist in DB
         import uuid
         if proposed_route_id:
-            # Use the proposed_route_id as the new route ID
-            new_route = Route.objects.create(
+            # Alternative ids are derived from the path, so the same alternative
+            # may already have been applied to another shipment
+            new_route, _ = Route.objects.get_or_create(
                 id=proposed_route_id,
-                name=f"Alternative Route {uuid.uuid4().hex[:8]}",
-                geometry=f"Alternative route for shipment {shipment_id}"
+                defaults={
+                    "name": f"Alternative Route {uuid.uuid4().hex[:8]}",
+                    "geometry": json.dumps(path) if path else f"Alternative route for shipment {shipment_id}",
+                },
             )
         elif path:
             # Create a new route with the given path
             new_route = Route.objects.create(
                 id=uuid.uuid4(),
                 name=f"Alternative Route {uuid.uuid4().hex[:8]}",
-                geometry=str(path)  # Store path as string in geometry field
+                geometry=json.dumps(path)  # Store path as JSON in geometry field
             )
         else:
             return JsonResponse({"detail": "Missing proposed_route_id or path"}, status=400)
@@ -200,101 +353,56 @@ def get_all_proposals(request):
     except Exception as e:
         return JsonResponse({"detail": "Internal server error", "error": str(e)}, status=500)
 
+@require_GET
+@login_required
+def latency_metrics(request):
+    """
+    Rolling per-stage latency percentiles of the decision pipeline and the
+    admission limiter's queue depth and rejections (this process only)
+    GET /agent_reroute/metrics/latency/   (staff only)
+    """
+    if not request.user.is_staff:
+        return JsonResponse({"detail": "Forbidden"}, status=403)
+    return JsonResponse({"stages": latency_snapshot(), "admission": admission_snapshot()})
+
+@require_GET
+@login_required
+def scheduler_metrics(request):
+    """
+    Runs, failures, skipped ticks and overruns of every run_scheduler job
+    GET /agent_reroute/metrics/scheduler/   (staff only)
+    """
+    if not request.user.is_staff:
+        return JsonResponse({"detail": "Forbidden"}, status=403)
+    jobs = SchedulerJob.objects.order_by("name").values()
+    return JsonResponse({"jobs": [{**job, "last_started_at": job["last_started_at"].isoformat()
+                                   if job["last_started_at"] else None} for job in jobs]})
+
 @require_POST
 def store_all_proposals(request):
+    """
+    Store the proposals n8n built: { "proposals": [...] } or an array
+    POST /agent_reroute/proposals/store/
+    The body is parsed as it is read (see proposals.iter_proposals), never loaded whole.
+    """
     try:
-        # 1) Parse and normalize payload into a list
+        # 1) Stream items from the body; validate and upsert them in chunks (one pending proposal per shipment)
         try:
-            payload = json.loads(request.body)
-        except json.JSONDecodeError:
-            return JsonResponse({"detail": "Invalid JSON"}, status=400)
-
-        if not payload:
+            result = store_proposals(iter_proposals(request))
+        except PayloadError as e:
+            return JsonResponse({"detail": str(e)}, status=400)
+        if not result.received:
             return JsonResponse({"detail": "No proposals provided"}, status=400)
 
-        proposals = []
-        if isinstance(payload, dict) and "proposals" in payload:
-            proposals = payload.get("proposals") or []
-        elif isinstance(payload, list):
-            proposals = payload
-        else:
-            return JsonResponse({"detail": "Expected { 'proposals': [...] } or an array"}, status=400)
-
-        # If proposals itself is a string, try parsing JSON, then Python-literal as fallback
-        if isinstance(proposals, str):
-            try:
-                proposals = json.loads(proposals)
-            except Exception:
-                try:
-                    proposals = ast.literal_eval(proposals)
-                except Exception:
-                    return JsonResponse({"detail": "'proposals' is a string and could not be parsed"}, status=400)
-
-        # 2) Persist proposals (flat shape expected)
-        created = []
-        errors = []
-        for idx, item in enumerate(proposals):
-            # If the item is a JSON string, try to parse it
-            if isinstance(item, str):
-                try:
-                    item = json.loads(item)
-                except Exception:
-                    try:
-                        item = ast.literal_eval(item)
-                    except Exception:
-                        errors.append({"index": idx, "error": "Proposal item is a string and could not be parsed"})
-                        continue
-
-            if not isinstance(item, dict):
-                errors.append({"index": idx, "error": "Proposal is not an object"})
-                continue
-
-            shipment_id = item.get("shipment_id")
-            if not shipment_id:
-                errors.append({"index": idx, "error": "Missing shipment_id"})
-                continue
-
-            try:
-                rp = RouteProposal.objects.create(
-                    shipment_id=shipment_id,
-                    action="propose_switch",
-
-                    # current is unknown for flat payloads
-                    current_route_id=None,
-                    current_eta_minutes=None,
-                    current_toll_cost_usd=None,
-                    current_path=None,
-                    current_p_delay=None,
-
-                    # proposed route from flat fields
-                    proposed_route_id=item.get("route_id"),
-                    proposed_eta_minutes=item.get("eta_minutes"),
-                    proposed_toll_cost_usd=item.get("toll_cost_usd"),
-                    proposed_path=item.get("path"),
-                    proposed_p_delay=item.get("p_delay"),
-
-                    rationale=item.get("rationale", "Imported from n8n"),
-                    requires_approval=True,
-                    status='pending'
-                )
-
-                created.append({
-                    "id": str(rp.id),
-                    "shipment_id": str(rp.shipment_id),
-                    "created_at": rp.created_at.isoformat(),
-                })
-            except Exception as e:
-                errors.append({
-                    "index": idx,
-                    "shipment_id": str(shipment_id),
-                    "error": str(e)
-                })
+        # 2) Report what every item became
+        stored = [{k: p[k] for k in ("id", "shipment_id", "created_at")} for p in result.stored]
 
         return JsonResponse({
             "status": "success",
-            "proposals_created": len(created),
-            "proposals": created,
-            "errors": errors,
+            "proposals_created": result.created,
+            "proposals_updated": len(stored) - result.created,
+            "proposals": stored,
+            "errors": result.errors,
         })
     except Exception as e:
         return JsonResponse({"detail": "Internal server error", "error": str(e)}, status=500)
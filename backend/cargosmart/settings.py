@@ -148,6 +148,83 @@ ROUTE_AI = {
     "IMPROVEMENT_EPS": 0.05,
     "MAX_ALTERNATIVES": 3,
     "MODEL_PATH": BASE_DIR / "models" / "delay_classifier.joblib",
+
+    # Road graph used by GraphRoutingProvider
+    "AVG_SPEED_KMH": 50.0,           # ETA = distance / speed
+    "TOLL_USD_PER_KM": 0.03,
+    "GRAPH_SNAP_DECIMALS": 3,        # ~100 m node snapping
+    "GRAPH_JUNCTION_KM": 2.0,        # join nearby nodes of different routes
+    "GRAPH_MAX_SNAP_KM": 25.0,       # origin/destination must be this close to the graph
+    "GRAPH_MIN_DIVERSITY": 0.2,      # alternatives share at most 80% of their length
+    "GRAPH_CANDIDATE_FACTOR": 10,    # Yen paths examined per requested alternative
+    "USE_CH": True,                  # answer path queries from the contraction hierarchy
+    "CH_PATH": BASE_DIR / "models" / "route_ch.npz",  # built by manage.py build_route_ch
+    "GRAPH_CACHE_TTL_SECONDS": 300,  # rebuild to pick up edits from other processes
+
+    # Decision memoization: unchanged shipments reuse their last decision
+    "DECISION_CACHE_SIZE": 10000,            # shipments kept per process (0 disables)
+    "DECISION_CACHE_TTL_SECONDS": 900,
+    "DECISION_CACHE_LEAD_TIME_BUCKET_HOURS": 1.0,  # lead time changes below this don't invalidate
+
+    # Sweeps re-evaluate dirty shipments plus those without a decision this recent
+    "SWEEP_STALE_SECONDS": 3600,
+    # evaluate_shipments --sharded: shipments are split into SWEEP_SHARDS shards leased to
+    # workers for SWEEP_LEASE_SECONDS at a time; each shard is swept once per interval
+    "SWEEP_SHARDS": 16,
+    "SWEEP_LEASE_SECONDS": 120,
+    "SWEEP_INTERVAL_SECONDS": 300,
+    # listen_reevaluate: NOTIFY channel, coalescing window, batch cap and how often
+    # the dirty set is re-read for notifications missed while disconnected
+    "REEVALUATE_CHANNEL": "agent_reroute_dirty",
+    "REEVALUATE_WINDOW_SECONDS": 2.0,
+    "REEVALUATE_MAX_BATCH": 500,
+    "REEVALUATE_RESYNC_SECONDS": 300,
+
+    # run_scheduler: seconds between runs of each job, started up to JITTER x interval
+    # late; only the holder of the LOCK_KEY advisory lock runs jobs
+    "SCHEDULER_INTERVALS": {"sweep": 300, "expire_proposals": 900, "retention": 86400},
+    "SCHEDULER_JITTER": 0.1,
+    "SCHEDULER_LOCK_KEY": 726354,
+    # Pending proposals older than this are marked expired
+    "PROPOSAL_TTL_HOURS": 24,
+
+    # /proposals/store/ reads the body in READ_BYTES pieces and upserts every CHUNK_SIZE proposals
+    "PROPOSAL_READ_BYTES": 65536,
+    "PROPOSAL_CHUNK_SIZE": 500,
+
+    # /shipments/active/?since=: changes this close before the token are sent again
+    "FEED_OVERLAP_SECONDS": 5,
+
+    # Rolling window (samples per stage) behind /metrics/latency/
+    "LATENCY_WINDOW": 1024,
+
+    # Admission control for the evaluate endpoints (per process): requests beyond
+    # MAX_CONCURRENT wait in a queue of MAX_QUEUE for up to QUEUE_TIMEOUT_SECONDS,
+    # then get 429 (queue full) / 503 (timed out) with Retry-After
+    "ADMISSION_MAX_CONCURRENT": 4,
+    "ADMISSION_MAX_QUEUE": 16,
+    "ADMISSION_QUEUE_TIMEOUT_SECONDS": 5.0,
+    "ADMISSION_RETRY_AFTER_SECONDS": 2,
+
+    # Async evaluate views (ASGI): threads for blocking DB work, and for model
+    # inference (None: one per core)
+    "ASYNC_DB_THREADS": 8,
+    "ASYNC_INFERENCE_WORKERS": None,
+
+    # AgentDecision rows are written off the request path in batches
+    "DECISION_LOG_ASYNC": True,
+    "DECISION_LOG_BATCH_SIZE": 500,      # flush when this many rows are waiting...
+    "DECISION_LOG_FLUSH_MS": 200,        # ...or this long after the first one arrived
+    "DECISION_LOG_QUEUE_SIZE": 10000,
+    "DECISION_LOG_POLICY": "block",      # when full: "block" (up to the timeout, then drop) or "drop"
+    "DECISION_LOG_BLOCK_TIMEOUT_SECONDS": 1.0,
+
+    # AgentDecision is partitioned by month; archive_decisions moves older months to Parquet
+    "DECISION_RETENTION_MONTHS": 3,      # full months kept besides the current one
+    "DECISION_ARCHIVE_DIR": BASE_DIR / "archive" / "agent_decisions",
+
+    # tune_policy: memory for one block of decisions x candidates, per worker process
+    "TUNING_BLOCK_MB": 64,
 }
 
 